@@ -0,0 +1,154 @@
+"""Pack all output files into a single bundle file."""
+from __future__ import annotations
+
+import bisect
+import hashlib
+import mmap
+import struct
+import time
+from collections.abc import Iterable
+from dataclasses import dataclass
+from typing import Any
+
+from cloudimagedirectory.connection.codec import Codec, get_codec
+from cloudimagedirectory.connection.connection import DataEntry, WriteStats, replace_atomically
+
+# NOTE: A bundle starts with MAGIC, followed by the contents of all files
+# and the index. The footer holds the offset and the length of the index.
+MAGIC = b"CIDBNDL1"
+FOOTER = struct.Struct("<QQ8s")
+
+
+class InvalidBundle(Exception):
+    """Raise an exception if a file is not a bundle."""
+
+    def __init__(self, bundle_path: str):
+        """Constructor for InvalidBundle class."""
+        super().__init__(f"The file '{bundle_path}' is not a valid bundle.")
+
+
+class DuplicateBundlePath(Exception):
+    """Raise an exception if a path is added to a bundle more than once."""
+
+    def __init__(self, path: str):
+        """Constructor for DuplicateBundlePath class."""
+        super().__init__(f"The path '{path}' occurs more than once in the bundle.")
+
+
+@dataclass(frozen=True)
+class BundleEntry:
+    """Position and hash of a single file in the bundle."""
+
+    offset: int
+    length: int
+    sha256: str
+
+
+def write_bundle(bundle_path: str, entries: Iterable[DataEntry], codec: Codec | None = None) -> WriteStats:
+    """Write the content of all entries into a bundle.
+
+    The files are ordered by path and the bundle contains no timestamps, so
+    identical outputs always produce identical bundles. The index is
+    encoded with the codec as well. The bundle replaces an existing file at
+    once.
+
+    Raises:
+        DuplicateBundlePath: If a path occurs more than once.
+    """
+    start = time.perf_counter()
+    codec = codec if codec is not None else get_codec()
+    contents = {}
+    for entry in entries:
+        if entry.filename in contents:
+            raise DuplicateBundlePath(entry.filename)
+        contents[entry.filename] = entry.content
+    stats = WriteStats()
+
+    with replace_atomically(bundle_path) as tmp, open(tmp, "wb") as f:
+        f.write(MAGIC)
+        offset = len(MAGIC)
+        index = []
+        for path in sorted(contents):
+            data = codec.dumps(contents[path]) + b"\n"
+            f.write(data)
+            index.append([path, offset, len(data), hashlib.sha256(data).hexdigest()])
+            offset += len(data)
+            stats.files += 1
+            stats.bytes += len(data)
+            stats.written += 1
+            stats.paths.append(path)
+
+        index_data = codec.dumps({"files": index})
+        f.write(index_data)
+        f.write(FOOTER.pack(offset, len(index_data), MAGIC))
+
+    stats.seconds = time.perf_counter() - start
+    return stats
+
+
+class BundleReader:
+    """Serve the files of a bundle from a memory map.
+
+    The contents are returned as memoryviews of the map, so no file is ever
+    copied. All views must be released before the reader is closed.
+    """
+
+    def __init__(self, bundle_path: str, codec: Codec | None = None) -> None:
+        """Map the bundle and load its index."""
+        # NOTE: The map keeps its own handle, so the file can be closed.
+        with open(bundle_path, "rb") as f:
+            try:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise InvalidBundle(bundle_path) from None
+
+        size = len(self._mmap)
+        if size < len(MAGIC) + FOOTER.size or self._mmap[: len(MAGIC)] != MAGIC:
+            self.close()
+            raise InvalidBundle(bundle_path)
+        index_offset, index_length, magic = FOOTER.unpack(self._mmap[size - FOOTER.size :])
+        if magic != MAGIC or index_offset + index_length != size - FOOTER.size:
+            self.close()
+            raise InvalidBundle(bundle_path)
+
+        codec = codec if codec is not None else get_codec()
+        index = codec.loads(self._mmap[index_offset : index_offset + index_length])["files"]
+        self.paths: list[str] = [x[0] for x in index]
+        self._entries = [BundleEntry(x[1], x[2], x[3]) for x in index]
+        self._view = memoryview(self._mmap)
+
+    def entry(self, path: str) -> BundleEntry:
+        """Return the position and hash of a file."""
+        # NOTE: The index is sorted by path, so a binary search finds every file.
+        i = bisect.bisect_left(self.paths, path)
+        if i == len(self.paths) or self.paths[i] != path:
+            raise KeyError(path)
+        return self._entries[i]
+
+    def get(self, path: str) -> memoryview:
+        """Return the content of a file without copying it."""
+        entry = self.entry(path)
+        return self._view[entry.offset : entry.offset + entry.length]
+
+    def __contains__(self, path: object) -> bool:
+        """Check if the bundle contains a file."""
+        if not isinstance(path, str):
+            return False
+        i = bisect.bisect_left(self.paths, path)
+        return i < len(self.paths) and self.paths[i] == path
+
+    def __len__(self) -> int:
+        """Return the number of files in the bundle."""
+        return len(self.paths)
+
+    def close(self) -> None:
+        """Unmap the bundle."""
+        if hasattr(self, "_view"):
+            self._view.release()
+        self._mmap.close()
+
+    def __enter__(self) -> BundleReader:
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
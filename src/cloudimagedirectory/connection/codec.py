@@ -0,0 +1,102 @@
+"""Encode and decode JSON documents."""
+from __future__ import annotations
+
+import json
+from typing import Any, Protocol
+
+from cloudimagedirectory.optional import is_installed
+
+HAS_ORJSON = is_installed("orjson")
+if HAS_ORJSON:
+    import orjson
+
+
+class Codec(Protocol):
+    """Encodes and decodes JSON documents."""
+
+    name: str
+
+    def dumps(self, data: Any) -> bytes:
+        """Encode data as compact UTF-8 JSON."""
+
+    def loads(self, data: bytes | str) -> Any:
+        """Decode a JSON document."""
+
+
+class CodecJSON:
+    """Codec based on the json module of the standard library."""
+
+    name = "json"
+
+    def __init__(self) -> None:
+        """Initialize the codec."""
+        # NOTE: Reuse the encoder and decoder instead of building new ones for
+        # every document like json.dumps and json.loads do with custom options.
+        self._encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+        self._decoder = json.JSONDecoder()
+
+    def __reduce__(self) -> tuple[Any, ...]:
+        """Pickle the codec by name, since the decoder can't be pickled."""
+        return get_codec, (self.name,)
+
+    def dumps(self, data: Any) -> bytes:
+        """Encode data as compact UTF-8 JSON."""
+        return self._encoder.encode(data).encode()
+
+    def loads(self, data: bytes | str) -> Any:
+        """Decode a JSON document."""
+        if isinstance(data, bytes):
+            data = data.decode()
+        return self._decoder.decode(data)
+
+
+class CodecOrjson:
+    """Codec based on the optional orjson package.
+
+    The output is identical to CodecJSON, except for floats the standard
+    library writes in exponent notation, e.g. 1e16 instead of 1e+16 and
+    0.00001 instead of 1e-05; both decode to the same value. Integers beyond
+    64 bits are encoded by the standard library, but decoded as floats.
+    """
+
+    name = "orjson"
+
+    def dumps(self, data: Any) -> bytes:
+        """Encode data as compact UTF-8 JSON."""
+        try:
+            return orjson.dumps(data)
+        except TypeError:
+            # NOTE: orjson rejects integers beyond 64 bits.
+            return CodecJSON().dumps(data)
+
+    def loads(self, data: bytes | str) -> Any:
+        """Decode a JSON document."""
+        return orjson.loads(data)
+
+
+class UnknownCodec(Exception):
+    """Raise an exception if a codec is unknown or not installed."""
+
+    def __init__(self, name: str):
+        """Constructor for UnknownCodec class."""
+        super().__init__(f"The codec '{name}' is unknown or not installed.")
+
+
+def available_codecs() -> list[str]:
+    """Return the names of all installed codecs, fastest first."""
+    names = []
+    if HAS_ORJSON:
+        names.append(CodecOrjson.name)
+    names.append(CodecJSON.name)
+    return names
+
+
+def get_codec(name: str = "") -> Codec:
+    """Return a codec by name, or the fastest installed codec if name is empty."""
+    if name == "":
+        name = available_codecs()[0]
+    if name not in available_codecs():
+        raise UnknownCodec(name)
+    if name == CodecOrjson.name:
+        return CodecOrjson()
+    return CodecJSON()
@@ -0,0 +1,127 @@
+"""Precompress output files for CDNs and object stores."""
+from __future__ import annotations
+
+import gzip
+import posixpath
+import threading
+from typing import Any
+
+from cloudimagedirectory.optional import is_installed
+
+HAS_BROTLI = is_installed("brotli")
+if HAS_BROTLI:
+    import brotli
+
+HAS_ZSTANDARD = is_installed("zstandard")
+if HAS_ZSTANDARD:
+    import zstandard
+
+# NOTE: Map every encoding to the suffix of its sidecar file.
+SUFFIXES = {"gzip": ".gz", "br": ".br", "zstd": ".zst"}
+
+# NOTE: Sidecars compressed with the trained dictionary can't be decoded
+# without it, so they don't use the suffix of plain zstd sidecars.
+DICTIONARY_SUFFIX = ".dzst"
+
+
+class UnknownEncoding(Exception):
+    """Raise an exception if an encoding is unknown or not installed."""
+
+    def __init__(self, encoding: str):
+        """Constructor for UnknownEncoding class."""
+        super().__init__(f"The encoding '{encoding}' is unknown or not installed.")
+
+
+def available_encodings() -> list[str]:
+    """Return the names of all installed encodings."""
+    encodings = ["gzip"]
+    if HAS_BROTLI:
+        encodings.append("br")
+    if HAS_ZSTANDARD:
+        encodings.append("zstd")
+    return encodings
+
+
+def is_image_document(filename: str) -> bool:
+    """Check if a file is the document of a single image, e.g. `v2/.../image/<sha1>`."""
+    directory_path, name = posixpath.split(filename)
+    return posixpath.basename(directory_path) == "image" and len(name) == 40
+
+
+class Compressor:
+    """Create compressed sidecar files for large outputs.
+
+    Every output of at least min_size bytes gets a sidecar per encoding, e.g.
+    `v2/all.gz`. If a zstd dictionary is trained, the smaller per-image
+    documents, which are very similar to each other, get a `.dzst` sidecar
+    compressed with the dictionary. Clients fetch the dictionary once and
+    decode these sidecars themselves; other small outputs get no sidecar.
+    """
+
+    def __init__(
+        self,
+        encodings: list[str],
+        min_size: int = 1024,
+        dictionary_size: int = 0,
+        dictionary_path: str = "",
+    ) -> None:
+        """Initialize the compressor.
+
+        Args:
+            encodings: Names of the encodings, see SUFFIXES.
+            min_size: Minimum size of compressed outputs in bytes.
+            dictionary_size: Size of the trained zstd dictionary, 0 to disable it.
+            dictionary_path: File the trained dictionary is written to.
+        """
+        for encoding in encodings:
+            if encoding not in available_encodings():
+                raise UnknownEncoding(encoding)
+        self.encodings = encodings
+        self.min_size = min_size
+        self.dictionary_size = dictionary_size if "zstd" in encodings else 0
+        self.dictionary_path = dictionary_path if self.dictionary_size > 0 else ""
+        self.dictionary: Any = None
+        self._local = threading.local()
+
+    def train(self, samples: list[bytes]) -> bytes:
+        """Train the zstd dictionary for small outputs.
+
+        Returns:
+            The dictionary, empty if there are not enough samples.
+        """
+        samples = [x for x in samples if len(x) < self.min_size]
+        if self.dictionary_size == 0 or len(samples) < 8:
+            return b""
+        try:
+            self.dictionary = zstandard.train_dictionary(self.dictionary_size, samples)
+        except zstandard.ZstdError:
+            # NOTE: zstd refuses to train on too few or too similar samples.
+            return b""
+        return self.dictionary.as_bytes()
+
+    def sidecars(self, filename: str, data: bytes) -> list[tuple[str, bytes]]:
+        """Return the suffixes and contents of all sidecars of an output."""
+        if len(data) < self.min_size:
+            if self.dictionary is None or not is_image_document(filename):
+                return []
+            return [(DICTIONARY_SUFFIX, self.__zstd(True).compress(data))]
+
+        results = []
+        for encoding in self.encodings:
+            if encoding == "gzip":
+                # NOTE: A fixed mtime keeps the sidecars of unchanged outputs identical.
+                compressed = gzip.compress(data, compresslevel=9, mtime=0)
+            elif encoding == "br":
+                compressed = brotli.compress(data, quality=11)
+            else:
+                compressed = self.__zstd(False).compress(data)
+            results.append((SUFFIXES[encoding], compressed))
+        return results
+
+    def __zstd(self, with_dictionary: bool) -> Any:
+        # NOTE: zstd compressors must not be shared between threads.
+        compressors = self._local.__dict__.setdefault("compressors", {})
+        if with_dictionary not in compressors:
+            dict_data = self.dictionary if with_dictionary else None
+            compressors[with_dictionary] = zstandard.ZstdCompressor(level=19, dict_data=dict_data)
+        return compressors[with_dictionary]
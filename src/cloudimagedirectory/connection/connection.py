@@ -1,11 +1,34 @@
 """Manage content in the S3 bucket."""
 from __future__ import annotations
 
+import copy
+import hashlib
+import itertools
 import json
+import multiprocessing
 import os
-import pathlib
-from dataclasses import dataclass
+import sys
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Iterable, Iterator
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import AbstractContextManager, contextmanager
+from dataclasses import dataclass, field
 from pathlib import Path
+from types import MappingProxyType
+from typing import IO, TYPE_CHECKING, Any, Callable, TypeVar
+
+from cloudimagedirectory.connection.codec import Codec, get_codec
+
+if TYPE_CHECKING:
+    from multiprocessing.context import BaseContext
+
+    from cloudimagedirectory.connection.compress import Compressor
+    from cloudimagedirectory.connection.manifest import Manifest
+    from cloudimagedirectory.connection.staging import StagedDestination
+
+T = TypeVar("T")
 
 
 class OriginPathDoesNotExist(Exception):
@@ -16,49 +39,608 @@ class OriginPathDoesNotExist(Exception):
         super().__init__(f"The origin path '{origin_path}' doesn't exist.")
 
 
-@dataclass
+# NOTE: Map the keys of the v2 API paths to the fields of DataEntry, e.g.
+# v2/os/rhel/provider/aws/version/8.6.0/region/eu-west-3/image/<sha1>.
+_V2_FIELDS = {"os": "os", "provider": "provider", "version": "version", "region": "region", "image": "image_id"}
+
+# NOTE: Names that is_provided_by is called with most, their results are
+# cached as bits of DataEntry.provided_by.
+_CACHED_PROVIDERS = ("aws", "azure", "google", "idx")
+
+_RAW = 1
+_API = 2
+_IMAGE = 4
+
+
+def _origin_flags(filename: str) -> int:
+    """Return the flags of the raw and provider names in a filename."""
+    flags = _RAW if "raw/" in filename else 0
+    for j, name in enumerate(_CACHED_PROVIDERS):
+        if f"{name}/" in filename:
+            flags |= 1 << (j + 3)
+    return flags
+
+
 class DataEntry:
-    """Handles a file from the bucket."""
+    """Handles a file from the bucket.
+
+    The path is parsed once into the API version, os, provider, version,
+    region and image id, when the filename is set. The directory of the
+    path and the components are interned, so all entries of a directory
+    share a single copy of them. The results of the predicates are cached
+    as bit flags.
+    """
+
+    __slots__ = ("_prefix", "_name", "content", "api", "os", "provider", "version", "region", "_flags")
+
+    def __init__(self, filename: str, content: list | dict | None) -> None:
+        self.content = content  # Content of the JSON file.
+        self.filename = filename  # File name of the JSON file.
+
+    @property
+    def filename(self) -> str:
+        """File name of the JSON file."""
+        return self._prefix + self._name
+
+    @filename.setter
+    def filename(self, filename: str) -> None:
+        filename = str(filename)
+        i = filename.rfind("/") + 1
+        self._prefix = sys.intern(filename[:i])
+        self._name = filename[i:]
+        self.api = self.os = self.provider = self.version = self.region = ""
+
+        path = filename.split("/")
+        flags = _origin_flags(filename)
+        if path[0] == "v1":
+            flags |= self.__parse_v1(path)
+        elif path[0] == "v2":
+            flags |= self.__parse_v2(path)
+        self._flags = flags
+
+    def __parse_v1(self, path: list[str]) -> int:
+        """Set the fields of a v1 path and return its flags."""
+        self.api = "v1"
+        if len(path) == 4:
+            self.provider, self.region = sys.intern(path[1]), sys.intern(path[2])
+        return _API
 
-    filename: str  # File name of the JSON file.
-    content: list | dict | None  # Content of the JSON file.
+    def __parse_v2(self, path: list[str]) -> int:
+        """Set the fields of a v2 path and return its flags."""
+        self.api = "v2"
+        flags = 0
+        # NOTE: check the number of components and the length of the hash value.
+        if len(path) == 11 and len(path[10]) == 40:
+            flags |= _API
+        for j in range(1, len(path) - 1, 2):
+            field_name = _V2_FIELDS.get(path[j])
+            if field_name == "image_id":
+                flags |= _IMAGE if j + 2 == len(path) else 0
+            elif field_name is not None:
+                setattr(self, field_name, sys.intern(path[j + 1]))
+        return flags
+
+    @property
+    def image_id(self) -> str:
+        """Image id of a v2 path, empty for other paths."""
+        return self._name if self._flags & _IMAGE else ""
+
+    def __repr__(self) -> str:
+        return f"DataEntry(filename={self.filename!r}, content={self.content!r})"
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, DataEntry):
+            return NotImplemented
+        return self.filename == other.filename and self.content == other.content
+
+    __hash__ = None  # type: ignore[assignment]
+
+    def __reduce__(self) -> tuple[Any, ...]:
+        return (DataEntry, (self.filename, self.content))
+
+    def __deepcopy__(self, memo: dict[int, Any]) -> DataEntry:
+        # NOTE: Copy the parsed fields instead of parsing the filename again.
+        result = DataEntry.__new__(DataEntry)
+        for name in DataEntry.__slots__:
+            setattr(result, name, getattr(self, name))
+        result.content = copy.deepcopy(self.content, memo)
+        return result
 
     def is_raw(self) -> bool:
         """Check if the file is in raw format."""
-        return "raw/" in self.filename
+        return bool(self._flags & _RAW)
 
     def is_provided_by(self, name: str) -> bool:
         """Check the origin of the file."""
+        if name in _CACHED_PROVIDERS:
+            return bool(self._flags & (1 << (_CACHED_PROVIDERS.index(name) + 3)))
         return f"{name}/" in self.filename
 
     def is_API(self, api: str) -> bool:
         """Check if the file is the actual API entry and not a sub url."""
-        path = self.filename.split("/")
-        if path[0] != api:
-            return False
+        return self.api == api and bool(self._flags & _API)
 
-        if path[0] == "v1":
-            return True
 
-        slash_count = self.filename.count("/")
-        if slash_count != 10:
-            return False
+class InvalidJSONArray(ValueError):
+    """Raise an exception if a stream doesn't contain a JSON array."""
+
+    def __init__(self, expected: str, got: str) -> None:
+        """Constructor for InvalidJSONArray class."""
+        expected = " or ".join(repr(x) for x in expected)
+        got = repr(got) if got else "the end of the input"
+        super().__init__(f"expected {expected} in JSON array, got {got}")
+
+
+class _JSONArrayReader:
+    """Window over a text stream, which is read in chunks."""
+
+    def __init__(self, stream: IO[str], chunk_size: int) -> None:
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self) -> None:
+        """Drop the consumed input and read the next chunk."""
+        chunk = self.stream.read(self.chunk_size)
+        self.buffer = self.buffer[self.pos :] + chunk
+        self.pos = 0
+        self.eof = chunk == ""
+
+    def peek(self) -> str:
+        """Return the next character that is not whitespace, empty at the end of the input."""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in " \t\n\r":
+                self.pos += 1
+            if self.pos < len(self.buffer) or self.eof:
+                return self.buffer[self.pos : self.pos + 1]
+            self.fill()
+
+    def take(self) -> str:
+        """Consume the next character that is not whitespace."""
+        char = self.peek()
+        self.pos += len(char)
+        return char
+
+    def decode(self) -> Any:
+        """Consume the next JSON value."""
+        self.peek()
+        while True:
+            try:
+                item, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+                self.fill()
+                continue
+            # NOTE: A number at the end of the buffer may continue in the next chunk.
+            if end < len(self.buffer) or self.eof:
+                self.pos = end
+                return item
+            self.fill()
+
+
+def iter_json_array(stream: IO[str], chunk_size: int = 64 * 1024) -> Iterator[Any]:
+    """Decode the items of a top level JSON array one by one.
+
+    Only a small window of the input is held in memory, so the memory usage
+    depends on the size of the largest item and not on the size of the file.
+    An empty input yields nothing.
+
+    Args:
+        stream: Text stream containing a JSON array.
+        chunk_size: Number of characters read at once.
+    """
+    reader = _JSONArrayReader(stream, chunk_size)
+    char = reader.take()
+    if char == "":
+        return
+    if char != "[":
+        raise InvalidJSONArray("[", char)
+    if reader.peek() == "]":
+        return
+    while True:
+        yield reader.decode()
+        char = reader.take()
+        if char == "]":
+            return
+        if char != ",":
+            raise InvalidJSONArray(",]", char)
+
+
+def read_only(content: Any) -> Any:
+    """Return a read-only view of decoded raw content.
+
+    The top level array becomes a tuple and every image record a mapping
+    proxy, so consumers sharing the same decoded file can't modify it.
+    """
+    if isinstance(content, list):
+        return tuple(MappingProxyType(x) if isinstance(x, dict) else x for x in content)
+    if isinstance(content, dict):
+        return MappingProxyType(content)
+    return content
+
+
+# NOTE: Decoded JSON takes about four times the size of the file in Python
+# objects, measured on the raw files of all providers.
+DECODED_SIZE_FACTOR = 4
+
+
+@dataclass
+class _StoredContent:
+    """Decoded content of a raw file held by the RawContentStore."""
+
+    content: Any
+    size: int  # Estimated size of the decoded content in bytes.
+    remaining: int  # Number of consumers that did not read the file yet.
+
+
+class RawContentStore:
+    """Share decoded raw files between all consumers of a single run.
+
+    Each raw file is decoded once and kept until every consumer has read or
+    released it. The store never holds more than `budget` bytes of decoded
+    content, estimated from the file sizes; the least recently used files
+    are evicted first and decoded again on demand.
+    """
+
+    def __init__(self, consumers: int = 2, budget: int = 512 * 1024 * 1024) -> None:
+        """Initialize the store.
+
+        Args:
+            consumers: Number of times every raw file is read during a run.
+            budget: Maximum estimated size of the decoded files in bytes.
+        """
+        self.consumers = consumers
+        self.budget = budget
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: OrderedDict[str, _StoredContent] = OrderedDict()
+        # NOTE: Consumers that released a file before it was stored.
+        self._released: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def get(self, filename: str, load: Callable[[], tuple[Any, int]]) -> Any:
+        """Return the read-only content of a file, decoding it on a miss.
+
+        Args:
+            filename: Name of the raw file.
+            load: Callable returning the decoded content and the file size.
+        """
+        with self._lock:
+            stored = self._entries.get(filename)
+            if stored is not None:
+                self.hits += 1
+                self.__consume(filename, stored)
+                return stored.content
+            self.misses += 1
+
+        content, size = load()
+        content = read_only(content)
+        size *= DECODED_SIZE_FACTOR
+
+        with self._lock:
+            remaining = self.consumers - 1 - self._released.pop(filename, 0)
+            if remaining > 0 and size <= self.budget and filename not in self._entries:
+                self._entries[filename] = _StoredContent(content, size, remaining)
+                self.size += size
+                while self.size > self.budget:
+                    self._release(next(iter(self._entries)))
+                    self.evictions += 1
+        return content
+
+    def release(self, filename: str) -> None:
+        """Give up the claim of a consumer that does not need to read a file.
+
+        A consumer that reuses the images of the previous run never reads
+        the raw file, the content is dropped once all other consumers read it.
+        """
+        with self._lock:
+            stored = self._entries.get(filename)
+            if stored is not None:
+                self.__consume(filename, stored)
+                return
+            released = self._released.get(filename, 0) + 1
+            if released < self.consumers:
+                self._released[filename] = released
+            else:
+                self._released.pop(filename, None)
+
+    def __consume(self, filename: str, stored: _StoredContent) -> None:
+        stored.remaining -= 1
+        if stored.remaining <= 0:
+            self._release(filename)
+        else:
+            self._entries.move_to_end(filename)
+
+    def _release(self, filename: str) -> None:
+        stored = self._entries.pop(filename)
+        self.size -= stored.size
+
+    def stats(self) -> str:
+        """Return a summary of the store usage."""
+        return f"raw content store: {self.hits} hits, {self.misses} misses, {self.evictions} evictions"
+
+
+@dataclass
+class WriteStats:
+    """Summary of a batch of written files."""
+
+    files: int = 0  # Number of processed files.
+    bytes: int = 0  # Number of processed bytes.
+    written: int = 0
+    skipped: int = 0  # Files with unchanged content.
+    deleted: int = 0  # Files that are no longer part of the output.
+    retries: int = 0  # Retried requests of remote writes.
+    seconds: float = 0.0
+    paths: list[str] = field(default_factory=list, repr=False)  # Names of all processed files.
+
+    def add(self, other: WriteStats) -> None:
+        """Add the counters of another batch."""
+        self.files += other.files
+        self.bytes += other.bytes
+        self.written += other.written
+        self.skipped += other.skipped
+        self.deleted += other.deleted
+        self.retries += other.retries
+        self.paths.extend(other.paths)
+
+    def __str__(self) -> str:
+        """Return a summary including the throughput."""
+        seconds = max(self.seconds, 1e-9)
+        summary = (
+            f"processed {self.files} files ({self.bytes} bytes) in {self.seconds:.2f}s: "
+            f"{self.files / seconds:.0f} files/s, {self.bytes / seconds:.0f} bytes/s, "
+            f"{self.written} written, {self.skipped} skipped, {self.deleted} deleted"
+        )
+        if self.retries > 0:
+            summary += f", {self.retries} retries"
+        return summary
+
+
+def content_hash(data: bytes) -> str:
+    """Return the hash used to detect changed outputs."""
+    return hashlib.sha256(data).hexdigest()
+
 
-        # NOTE: check length of hash value.
-        if len(path[len(path) - 1]) != 40:
+def is_unchanged(filename: str, data: bytes, known_hash: str = "") -> bool:
+    """Check if a file already has the given content.
+
+    Args:
+        filename: Name of the existing file.
+        data: New content of the file.
+        known_hash: Stored hash of the existing file, if available.
+    """
+    try:
+        if os.stat(filename).st_size != len(data):
             return False
+        if known_hash == "":
+            known_hash = content_hash(Path(filename).read_bytes())
+    except OSError:
+        return False
+    return known_hash == content_hash(data)
+
+
+@dataclass
+class _WriteOptions:
+    """Options shared by all batches of put_contents."""
+
+    skip_unchanged: bool = False
+    staging: StagedDestination | None = None
+    manifest: Manifest | None = None
+    compressor: Compressor | None = None
+
+
+def _encode_batch(codec_name: str, contents: list[Any]) -> list[bytes]:
+    """Encode a batch of documents, used by the serializer processes."""
+    codec = get_codec(codec_name)
+    return [codec.dumps(x) + b"\n" for x in contents]
+
+
+def process_context() -> BaseContext:
+    """Return the multiprocessing context of the process pools.
+
+    A forked child inherits the locks of the threads of its parent, which
+    may be held, so the pools start their processes with forkserver where
+    it is available and with spawn otherwise.
+    """
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return multiprocessing.get_context(method)
+
+
+def iter_batches(entries: Iterable[T], batch_size: int) -> Iterator[list[T]]:
+    """Yield lists of up to batch_size entries, consuming the entries lazily."""
+    iterator = iter(entries)
+    while True:
+        batch = list(itertools.islice(iterator, batch_size))
+        if len(batch) == 0:
+            return
+        yield batch
+
+
+def sample_entries(entries: Iterable[T], samples: int = 2000) -> tuple[list[T], Iterable[T]]:
+    """Return a sample of the entries and the entries to consume instead.
+
+    A list is sampled evenly. The entries of a stream are not all known yet,
+    so the first ones are sampled and chained in front of the rest.
+    """
+    if isinstance(entries, list):
+        return entries[:: max(1, len(entries) // samples)], entries
+    iterator = iter(entries)
+    head = list(itertools.islice(iterator, samples))
+    return head, itertools.chain(head, iterator)
+
+
+def make_directories(entries: list[DataEntry], known: set[str]) -> list[DataEntry]:
+    """Create the directories of the entries that are not known yet and add them to known."""
+    for directory_path in sorted({os.path.dirname(x.filename) for x in entries} - known):
+        os.makedirs(directory_path, exist_ok=True)
+        known.add(directory_path)
+    return entries
+
 
-        return True
+@contextmanager
+def replace_atomically(path: str) -> Iterator[str]:
+    """Yield a temporary path that replaces path once it is written.
 
+    The directory of path is created if needed. Readers see either the
+    previous file or the complete new one. The temporary file is removed if
+    writing it fails.
+    """
+    directory_path = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory_path, exist_ok=True)
+    tmp = os.path.join(directory_path, f".{os.path.basename(path)}.tmp")
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    try:
+        yield tmp
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    os.replace(tmp, path)
 
-class ConnectionFS:
-    """Handles the connection to the filesystem."""
 
-    def __init__(self, origin_path: str, arg_files: list[str]):
+def file_fingerprint(filename: str, with_hash: bool = True, stat: os.stat_result | None = None) -> dict[str, Any]:
+    """Return the size, modification time and content hash of a file.
+
+    A stat result collected before, e.g. while listing the files, saves the
+    stat call.
+    """
+    if stat is None:
+        stat = os.stat(filename)
+    result: dict[str, Any] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    if with_hash:
+        result["hash"] = "sha256:" + content_hash(Path(filename).read_bytes())
+    return result
+
+
+class Connection:
+    """Base class for the connections to raw data sources."""
+
+    def __init__(
+        self,
+        arg_files: list[str],
+        store: RawContentStore | None = None,
+        stream: bool = False,
+        workers: int = 1,
+        codec: Codec | None = None,
+    ):
         self.arg_files = arg_files
+        self.store = store
+        self.stream = stream
+        self.workers = workers
+        self.codec = codec if codec is not None else get_codec()
+
+    def __getstate__(self) -> dict[str, Any]:
+        """Return the state passed to worker processes.
+
+        The store is shared by the threads of this process only, so worker
+        processes load the raw files on their own.
+        """
+        return {**self.__dict__, "store": None}
+
+    def get_filenames(self) -> list[DataEntry]:
+        """Get the list of files in the bucket."""
+        raise NotImplementedError
+
+    def get_size(self, data: DataEntry) -> int:
+        """Get the size of a file in bytes, 0 if it is not accessible."""
+        raise NotImplementedError
+
+    def fingerprint(self, filename: str, with_hash: bool = True) -> dict[str, Any]:
+        """Get the size, modification time and content hash of a file."""
+        raise NotImplementedError
+
+    def _load(self, filename: str) -> tuple[Any, int]:
+        """Return the decoded content and the size of a file."""
+        raise NotImplementedError
+
+    def _open(self, filename: str) -> AbstractContextManager[IO[str]]:
+        """Open a file as text stream."""
+        raise NotImplementedError
+
+    def map_raw(self, func: Callable[[DataEntry], T], entries: list[DataEntry]) -> list[T]:
+        """Apply func to every raw file.
+
+        With more than one worker the files are processed in a thread pool,
+        largest files first. The results always follow the order of entries,
+        so the output does not depend on the number of workers.
+        """
+        if self.workers <= 1 or len(entries) <= 1:
+            return [func(x) for x in entries]
+
+        order = sorted(range(len(entries)), key=lambda i: self.get_size(entries[i]), reverse=True)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {i: executor.submit(func, entries[i]) for i in order}
+            return [futures[i].result() for i in range(len(entries))]
+
+    def get_content(self, data: DataEntry) -> DataEntry:
+        """Get the content of a file in the bucket.
+
+        If the connection has a RawContentStore, the content is shared with
+        every other consumer of the file and must not be modified.
+        """
+        if self.store is not None:
+            return DataEntry(data.filename, self.store.get(data.filename, lambda: self._load(data.filename)))
+        json_content, _ = self._load(data.filename)
+        return DataEntry(data.filename, json_content)
+
+    def release_content(self, data: DataEntry) -> None:
+        """Release a file that is not read, e.g. since its images are reused."""
+        if self.store is not None:
+            self.store.release(data.filename)
+
+    def iter_content(self, data: DataEntry) -> Iterator[Any]:
+        """Iterate over the image records of a raw file.
+
+        In stream mode the records are decoded incrementally from the file,
+        otherwise the whole file is decoded with get_content.
+        """
+        if not self.stream:
+            content = self.get_content(data).content
+            # NOTE: An empty raw file is decoded as an empty object.
+            yield from content if isinstance(content, (list, tuple)) else ()
+            return
+        with self._open(data.filename) as stream:
+            yield from iter_json_array(stream)
+
+
+class ConnectionFS(Connection):
+    """Handles the connection to the filesystem.
+
+    The raw files are listed below the origin path, optionally only in the
+    subtrees of some providers, e.g. `aws/`. Symlinks are resolved only if
+    requested. The stat results collected while listing are reused for the
+    file sizes and fingerprints.
+    """
+
+    def __init__(
+        self,
+        origin_path: str,
+        arg_files: list[str],
+        store: RawContentStore | None = None,
+        stream: bool = False,
+        workers: int = 1,
+        codec: Codec | None = None,
+        providers: list[str] | None = None,
+        resolve: bool = False,
+    ):
+        super().__init__(arg_files, store, stream, workers, codec)
         self.origin_path = origin_path
         if self.origin_path == "":
             self.origin_path = os.getcwd()
+        self.providers = providers or []
+        self.resolve = resolve
+        self._stats: dict[str, os.stat_result] = {}
+
+    def __getstate__(self) -> dict[str, Any]:
+        """Return the state passed to worker processes, without the listed stat results."""
+        return {**super().__getstate__(), "_stats": {}}
 
     def get_filenames(self) -> list[DataEntry]:
         """Get the list of files in the bucket."""
@@ -70,29 +652,206 @@ class ConnectionFS:
         return self.__list_files(self.origin_path)
 
     def __list_files(self, directory: str) -> list[DataEntry]:
-        data_files = []
-        p = pathlib.Path(directory)
-        if p.exists():
-            for child in p.glob("**/*.json"):
-                data_files.append(DataEntry(str(child.resolve()), None))
-        else:
+        directory = str(directory)
+        if not os.path.isdir(directory):
             raise OriginPathDoesNotExist(directory)
-        return data_files
+        root = os.path.realpath(directory) if self.resolve else os.path.abspath(directory)
 
-    def get_content(self, data: DataEntry) -> DataEntry:
-        """Get the content of a file in the bucket."""
-        content: str = ""
-        content = Path(data.filename).read_text()
-        if content == "":
-            content = "{}"
-        json_content = json.loads(content)
-        return DataEntry(data.filename, json_content)
+        # NOTE: Only descend into the subtrees of the requested providers.
+        pending = [root]
+        if len(self.providers) != 0:
+            pending = [os.path.join(root, x) for x in self.providers if os.path.isdir(os.path.join(root, x))]
+
+        while pending:
+            with os.scandir(pending.pop()) as it:
+                for entry in it:
+                    # NOTE: Like os.walk, do not follow symlinks to directories,
+                    # which could form a cycle.
+                    if entry.is_dir(follow_symlinks=False):
+                        pending.append(entry.path)
+                    elif entry.name.endswith(".json") and entry.is_file():
+                        path = os.path.realpath(entry.path) if self.resolve else entry.path
+                        self._stats[path] = entry.stat()
+
+        # NOTE: Sort the files, the scandir order depends on the filesystem.
+        return [DataEntry(x, None) for x in sorted(self._stats)]
+
+    def get_size(self, data: DataEntry) -> int:
+        """Get the size of a file in bytes, 0 if it is not accessible."""
+        stat = self._stats.get(data.filename)
+        if stat is not None:
+            return stat.st_size
+        try:
+            return os.stat(data.filename).st_size
+        except OSError:
+            return 0
+
+    def fingerprint(self, filename: str, with_hash: bool = True) -> dict[str, Any]:
+        """Get the size, modification time and content hash of a file."""
+        return file_fingerprint(filename, with_hash, self._stats.get(filename))
+
+    def _load(self, filename: str) -> tuple[Any, int]:
+        content = Path(filename).read_bytes()
+        size = len(content)
+        if content == b"":
+            content = b"{}"
+        return self.codec.loads(content), size
+
+    @contextmanager
+    def _open(self, filename: str) -> Iterator[IO[str]]:
+        with open(filename, encoding="utf-8") as f:
+            yield f
+
+    def put_contents(
+        self,
+        entries: Iterable[DataEntry],
+        batch_size: int = 256,
+        skip_unchanged: bool = False,
+        staging: StagedDestination | None = None,
+        manifest: Manifest | None = None,
+        compressor: Compressor | None = None,
+    ) -> WriteStats:
+        """Put the content of many files in the bucket.
+
+        The entries may be a stream, they are consumed one batch at a time.
+        The directory tree of a list of entries is created once, up front;
+        the directories of a stream are created as they appear, before the
+        batch is written. With more than one worker, the documents are
+        serialized in a process pool and written by a thread pool that
+        accepts only a bounded number of pending batches. If skip_unchanged
+        is set, files that already have the same content are not written
+        again. Files of a staged destination are written through the staging
+        directory. All files are added to the manifest and get compressed
+        sidecars, if requested.
+        """
+        start = time.perf_counter()
+        stats = WriteStats()
+        options = _WriteOptions(skip_unchanged, staging, manifest, compressor)
+
+        if compressor is not None and compressor.dictionary_path != "":
+            samples, entries = sample_entries(entries)
+            stats.add(self.__train_dictionary(samples, options))
+
+        directories: set[str] = set()
+        if isinstance(entries, list):
+            make_directories(entries, directories)
+
+        # NOTE: The entries are consumed one batch at a time, so a stream of
+        # entries is never held in memory as a whole.
+        batches = (make_directories(x, directories) for x in iter_batches(entries, batch_size))
+        head_batches = list(itertools.islice(batches, 2))
+        if self.workers <= 1 or len(head_batches) <= 1:
+            stats.add(self.__write_serial(itertools.chain(head_batches, batches), options))
+        else:
+            stats.add(self.__write_parallel(itertools.chain(head_batches, batches), options))
+        stats.seconds = time.perf_counter() - start
+        return stats
+
+    def __write_serial(self, batches: Iterable[list[DataEntry]], options: _WriteOptions) -> WriteStats:
+        """Serialize and write the batches one after the other."""
+        stats = WriteStats()
+        for batch in batches:
+            stats.add(self.__write_batch(batch, _encode_batch(self.codec.name, [x.content for x in batch]), options))
+        return stats
+
+    def __write_parallel(self, batches: Iterable[list[DataEntry]], options: _WriteOptions) -> WriteStats:
+        """Serialize the batches in a process pool and write them in a thread pool."""
+        # NOTE: Limit the number of pending batches, so the serializers can't
+        # buffer the whole output in memory while the disk catches up.
+        pending = threading.BoundedSemaphore(self.workers * 2)
+
+        def write_batch(batch: list[DataEntry], encoded: Future[list[bytes]]) -> WriteStats:
+            try:
+                return self.__write_batch(batch, encoded.result(), options)
+            finally:
+                pending.release()
+
+        stats = WriteStats()
+        with (
+            ProcessPoolExecutor(max_workers=self.workers, mp_context=process_context()) as serializers,
+            ThreadPoolExecutor(max_workers=self.workers) as writers,
+        ):
+            futures = []
+            for batch in batches:
+                pending.acquire()
+                encoded = serializers.submit(_encode_batch, self.codec.name, [x.content for x in batch])
+                futures.append(writers.submit(write_batch, batch, encoded))
+            for future in futures:
+                stats.add(future.result())
+        return stats
+
+    def __train_dictionary(self, samples: list[DataEntry], options: _WriteOptions) -> WriteStats:
+        """Train the zstd dictionary of the compressor on the sampled entries."""
+        stats = WriteStats()
+        compressor = options.compressor
+        if compressor is None:
+            return stats
+
+        dictionary = compressor.train(_encode_batch(self.codec.name, [x.content for x in samples]))
+        if dictionary != b"":
+            os.makedirs(os.path.dirname(compressor.dictionary_path), exist_ok=True)
+            self.__write_file(compressor.dictionary_path, dictionary, options, stats)
+        return stats
+
+    @classmethod
+    def __write_batch(cls, batch: list[DataEntry], encoded: list[bytes], options: _WriteOptions) -> WriteStats:
+        stats = WriteStats()
+        for entry, json_data in zip(batch, encoded):
+            cls.__write_file(entry.filename, json_data, options, stats)
+            if options.compressor is not None:
+                for suffix, compressed in options.compressor.sidecars(entry.filename, json_data):
+                    cls.__write_file(entry.filename + suffix, compressed, options, stats)
+        return stats
+
+    @staticmethod
+    def __write_file(filename: str, data: bytes, options: _WriteOptions, stats: WriteStats) -> None:
+        stats.files += 1
+        stats.bytes += len(data)
+        stats.paths.append(filename)
+        known_hash = ""
+        if options.manifest is not None:
+            known_hash = options.manifest.known_hash(filename)
+            options.manifest.add(filename, data)
+        if options.staging is not None:
+            if options.staging.write(filename, data):
+                stats.skipped += 1
+            else:
+                stats.written += 1
+            return
+        if options.skip_unchanged and is_unchanged(filename, data, known_hash):
+            stats.skipped += 1
+            return
+        Path(filename).write_bytes(data)
+        stats.written += 1
+
+    def delete_removed(self, directory: str, keep: Iterable[str]) -> int:
+        """Delete all files below directory that are not listed in keep.
+
+        Hidden files and directories are never deleted. Directories that
+        become empty are removed as well.
+
+        Returns:
+            Number of deleted files.
+        """
+        keep = {os.path.normpath(x) for x in keep}
+        deleted = 0
+        for root, _, files in os.walk(directory, topdown=False):
+            if any(x.startswith(".") for x in os.path.relpath(root, directory).split(os.sep) if x != "."):
+                continue
+            for file in files:
+                path = os.path.normpath(os.path.join(root, file))
+                if not file.startswith(".") and path not in keep:
+                    os.remove(path)
+                    deleted += 1
+            if root != directory and not os.listdir(root):
+                os.rmdir(root)
+        return deleted
 
     def put_content(self, data: DataEntry) -> None:
         """Put the content of a file in the bucket."""
-        json_data = json.dumps(data.content)
+        json_data = self.codec.dumps(data.content)
         tmp = data.filename.split("/")
         tmp = tmp[: len(tmp) - 1]
         directory_path = "/".join(tmp)
         os.makedirs(directory_path, exist_ok=True)
-        Path(data.filename).write_text(json_data + "\n")
+        Path(data.filename).write_bytes(json_data + b"\n")
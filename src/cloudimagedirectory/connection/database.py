@@ -0,0 +1,146 @@
+"""Export the v2 images and indexes into a SQLite database."""
+from __future__ import annotations
+
+import os
+import sqlite3
+import time
+from collections.abc import Iterable
+from typing import Any
+
+from cloudimagedirectory.connection.codec import Codec, get_codec
+from cloudimagedirectory.connection.connection import DataEntry, WriteStats, replace_atomically
+
+SCHEMA = """
+CREATE TABLE images (
+    path TEXT PRIMARY KEY,
+    image TEXT NOT NULL,
+    os TEXT NOT NULL,
+    provider TEXT NOT NULL,
+    version TEXT NOT NULL,
+    region TEXT NOT NULL,
+    arch TEXT,
+    name TEXT,
+    image_id TEXT,
+    date TEXT,
+    virt TEXT,
+    selflink TEXT,
+    record TEXT NOT NULL
+);
+CREATE TABLE indexes (
+    path TEXT PRIMARY KEY,
+    content TEXT NOT NULL
+);
+CREATE TABLE counts (
+    path TEXT NOT NULL,
+    name TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (path, name)
+);
+"""
+
+# NOTE: The indexes are created after the inserts, which is faster than
+# updating them for every row.
+INDEXES = """
+CREATE INDEX images_provider ON images (provider);
+CREATE INDEX images_version ON images (version);
+CREATE INDEX images_region ON images (region);
+CREATE INDEX images_arch ON images (arch);
+CREATE INDEX images_date ON images (date);
+"""
+
+
+def write_database(database_path: str, entries: Iterable[DataEntry], codec: Codec | None = None) -> WriteStats:
+    """Write the v2 images and the list indexes into a SQLite database.
+
+    Every image becomes a row of the images table, with the same record as
+    in v2/all. The list indexes are stored as JSON in the indexes table and
+    their counts, e.g. the number of images per provider, in the counts
+    table. The database is built in a temporary file with a single
+    transaction and replaces an existing database at once.
+
+    Example:
+        SELECT region, name, image_id, MAX(date) FROM images
+        WHERE provider = 'aws' AND version LIKE '9.%' AND arch = 'arm64'
+        GROUP BY region
+    """
+    start = time.perf_counter()
+    codec = codec if codec is not None else get_codec()
+    stats = WriteStats()
+    images: list[tuple[Any, ...]] = []
+    indexes: list[tuple[str, str]] = []
+    counts: list[tuple[str, str, int]] = []
+
+    for entry in entries:
+        if entry.is_API("v2"):
+            images.append(image_row(entry, codec))
+        elif entry.api == "v2" and entry.filename.endswith("/list"):
+            indexes.append((entry.filename, codec.dumps(entry.content).decode()))
+            counts.extend(index_counts(entry))
+        else:
+            continue
+        stats.files += 1
+        stats.paths.append(entry.filename)
+
+    with replace_atomically(database_path) as tmp:
+        create_database(tmp, images, indexes, counts)
+
+    stats.written = stats.files
+    stats.bytes = os.path.getsize(database_path)
+    stats.seconds = time.perf_counter() - start
+    return stats
+
+
+def image_row(entry: DataEntry, codec: Codec) -> tuple[Any, ...]:
+    """Return the row of a v2 image, with the same record as in v2/all."""
+    content = entry.content if isinstance(entry.content, dict) else {}
+    record = {**content, "provider": entry.provider, "region": entry.region}
+    return (
+        entry.filename,
+        entry.image_id,
+        entry.os,
+        entry.provider,
+        entry.version,
+        entry.region,
+        record.get("arch"),
+        record.get("name"),
+        record.get("imageId"),
+        record.get("date"),
+        record.get("virt"),
+        record.get("selflink"),
+        codec.dumps(record).decode(),
+    )
+
+
+def index_counts(entry: DataEntry) -> list[tuple[str, str, int]]:
+    """Return the counts of a v2 list index, e.g. the images per provider."""
+    if isinstance(entry.content, dict):
+        return [(entry.filename, x, y) for x, y in entry.content.items()]
+    if entry.filename == "v2/os/list" and isinstance(entry.content, list):
+        return [(entry.filename, x["name"], x["count"]) for x in entry.content]
+    return []
+
+
+def create_database(
+    database_path: str,
+    images: list[tuple[Any, ...]],
+    indexes: list[tuple[str, str]],
+    counts: list[tuple[str, str, int]],
+) -> None:
+    """Create a new database with the rows in a single transaction."""
+    db = sqlite3.connect(database_path, isolation_level=None)
+    try:
+        # NOTE: The temporary database is replaced at once, so it does not
+        # need a journal that survives crashes.
+        db.execute("PRAGMA journal_mode = OFF")
+        db.execute("PRAGMA synchronous = OFF")
+        db.execute("BEGIN")
+        for statement in SCHEMA.split(";"):
+            db.execute(statement)
+        db.executemany("INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", images)
+        db.executemany("INSERT OR REPLACE INTO indexes VALUES (?, ?)", indexes)
+        db.executemany("INSERT OR REPLACE INTO counts VALUES (?, ?, ?)", counts)
+        for statement in INDEXES.split(";"):
+            db.execute(statement)
+        db.execute("COMMIT")
+    finally:
+        db.close()
@@ -0,0 +1,103 @@
+"""Manifest of all output files of a run."""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+from cloudimagedirectory.connection.connection import replace_atomically
+
+
+@dataclass
+class ManifestEntry:
+    """Hashes and size of a single output file."""
+
+    md5: str  # Matches the ETag of objects uploaded in a single part.
+    sha256: str
+    size: int
+    previous_sha256: str | None = None  # Hash of the file in the previous run.
+
+
+class Manifest:
+    """Collect the hashes of all output files and compare them with the
+    manifest of the previous run.
+
+    The paths in the manifest are relative to the destination path, so they
+    match the object keys below the uploaded prefix.
+    """
+
+    def __init__(self, root: str, previous: dict[str, ManifestEntry] | None = None) -> None:
+        """Initialize the manifest.
+
+        Args:
+            root: Directory of the output files.
+            previous: Entries of the previous manifest.
+        """
+        self.root = root
+        self.previous = previous or {}
+        self.entries: dict[str, ManifestEntry] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, root: str, manifest_path: str) -> Manifest:
+        """Create a manifest that is compared with an existing manifest file."""
+        previous = {}
+        if os.path.exists(manifest_path):
+            content = json.loads(Path(manifest_path).read_text())
+            previous = {x: ManifestEntry(**y) for x, y in content["files"].items()}
+        return cls(root, previous)
+
+    def path(self, filename: str) -> str:
+        """Return the path of a file relative to the destination."""
+        return os.path.relpath(filename, self.root)
+
+    def known_hash(self, filename: str) -> str:
+        """Return the hash of a file in the previous run, empty if unknown."""
+        previous = self.previous.get(self.path(filename))
+        return previous.sha256 if previous is not None else ""
+
+    def add(self, filename: str, data: bytes) -> None:
+        """Add an output file."""
+        path = self.path(filename)
+        previous = self.previous.get(path)
+        entry = ManifestEntry(
+            md5=hashlib.md5(data).hexdigest(),  # noqa: S324
+            sha256=hashlib.sha256(data).hexdigest(),
+            size=len(data),
+            previous_sha256=previous.sha256 if previous is not None else None,
+        )
+        with self._lock:
+            self.entries[path] = entry
+
+    def added(self) -> list[str]:
+        """Return the paths that did not exist in the previous run."""
+        return sorted(x for x in self.entries if x not in self.previous)
+
+    def changed(self) -> list[str]:
+        """Return the paths with a different content than in the previous run."""
+        return sorted(x for x, y in self.entries.items() if x in self.previous and y.sha256 != y.previous_sha256)
+
+    def removed(self) -> list[str]:
+        """Return the paths of the previous run that no longer exist."""
+        return sorted(x for x in self.previous if x not in self.entries)
+
+    def write(self, manifest_path: str) -> None:
+        """Write the manifest, replacing the previous manifest file at once."""
+        content = {
+            "files": {x: asdict(self.entries[x]) for x in sorted(self.entries)},
+            "added": self.added(),
+            "changed": self.changed(),
+            "removed": self.removed(),
+        }
+        with replace_atomically(manifest_path) as tmp:
+            Path(tmp).write_text(json.dumps(content, indent=2) + "\n")
+
+    def __str__(self) -> str:
+        """Return a summary of the differences to the previous run."""
+        return (
+            f"manifest: {len(self.entries)} files, {len(self.added())} added, "
+            f"{len(self.changed())} changed, {len(self.removed())} removed"
+        )
@@ -0,0 +1,326 @@
+"""Manage content in S3 compatible object stores."""
+from __future__ import annotations
+
+import codecs
+import contextlib
+import hashlib
+import posixpath
+import threading
+import time
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import AbstractContextManager
+from typing import IO, TYPE_CHECKING, Any
+
+from cloudimagedirectory.connection.codec import Codec
+from cloudimagedirectory.connection.connection import (
+    Connection,
+    DataEntry,
+    RawContentStore,
+    WriteStats,
+    sample_entries,
+)
+
+if TYPE_CHECKING:
+    from cloudimagedirectory.connection.compress import Compressor
+    from cloudimagedirectory.connection.manifest import Manifest
+    from cloudimagedirectory.connection.staging import StagedDestination
+
+
+# NOTE: The outputs have no file extension, everything that is not a
+# sidecar or a dictionary is a JSON document.
+CONTENT_TYPES = {
+    ".gz": "application/gzip",
+    ".br": "application/x-brotli",
+    ".zst": "application/zstd",
+    # NOTE: Only clients with the trained dictionary can decode these.
+    ".dzst": "application/octet-stream",
+    ".dict": "application/octet-stream",
+}
+
+
+def content_type(key: str) -> str:
+    """Return the Content-Type of an output object."""
+    return CONTENT_TYPES.get(posixpath.splitext(key)[1], "application/json")
+
+
+class InvalidS3URL(Exception):
+    """Raise an exception if an S3 URL can't be parsed."""
+
+    def __init__(self, url: str):
+        """Constructor for InvalidS3URL class."""
+        super().__init__(f"The S3 URL '{url}' is invalid, expected s3://bucket/prefix.")
+
+
+class MissingS3Client(Exception):
+    """Raise an exception if boto3 is not installed."""
+
+    def __init__(self) -> None:
+        """Constructor for MissingS3Client class."""
+        super().__init__("S3 connections require boto3, install the 's3' extra.")
+
+
+class StagingNotSupported(Exception):
+    """Raise an exception if an S3 destination should be staged."""
+
+    def __init__(self) -> None:
+        """Constructor for StagingNotSupported class."""
+        super().__init__("S3 destinations can't be staged, the uploads are not atomic.")
+
+
+def is_s3_url(path: str) -> bool:
+    """Check if a path is an S3 URL."""
+    return path.startswith("s3://")
+
+
+def parse_s3_url(url: str) -> tuple[str, str]:
+    """Return the bucket and the key prefix of an S3 URL."""
+    if not is_s3_url(url):
+        raise InvalidS3URL(url)
+    bucket, _, prefix = url[len("s3://") :].partition("/")
+    if bucket == "":
+        raise InvalidS3URL(url)
+    return bucket, prefix
+
+
+def create_client(endpoint_url: str = "", max_pool_connections: int = 10) -> Any:
+    """Create an S3 client with a connection pool of the given size.
+
+    The endpoint URL allows to use S3 compatible stores, like MinIO.
+    """
+    # NOTE: boto3 is slow to import, so it is only imported for S3 connections.
+    try:
+        import boto3
+    except ImportError:  # pragma: no cover
+        raise MissingS3Client() from None
+    # NOTE: botocore is not a dependency of its own, boto3 exports its config.
+    config = boto3.session.Config(
+        max_pool_connections=max_pool_connections,
+        retries={"max_attempts": 5, "mode": "standard"},
+    )
+    return boto3.client("s3", endpoint_url=endpoint_url or None, config=config)
+
+
+class ConnectionS3(Connection):
+    """Handles the connection to an S3 compatible object store.
+
+    The object keys are used as filenames, e.g. `raw/aws/af-south-1.json`.
+    Large objects are downloaded with concurrent ranged GETs. In stream mode
+    the image records are decoded straight from the response body, so the
+    transformation overlaps the download.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        arg_files: list[str],
+        store: RawContentStore | None = None,
+        stream: bool = False,
+        workers: int = 1,
+        codec: Codec | None = None,
+        endpoint_url: str = "",
+        client: Any = None,
+        range_size: int = 8 * 1024 * 1024,
+    ):
+        super().__init__(arg_files, store, stream, workers, codec)
+        self.bucket, self.prefix = parse_s3_url(url)
+        # NOTE: Uploads are I/O bound, so allow more concurrent requests than workers.
+        self.concurrency = max(10, workers * 4)
+        self.endpoint_url = endpoint_url
+        self.client = client if client is not None else create_client(endpoint_url, self.concurrency)
+        self.range_size = range_size
+        self._objects: dict[str, dict[str, Any]] = {}
+
+    def __getstate__(self) -> dict[str, Any]:
+        """Return the state passed to worker processes, without the client."""
+        return {**super().__getstate__(), "client": None}
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        """Restore the state in a worker process with a new client."""
+        self.__dict__.update(state)
+        self.client = create_client(self.endpoint_url, self.concurrency)
+
+    def get_filenames(self) -> list[DataEntry]:
+        """Get the list of files in the bucket."""
+        if len(self.arg_files) != 0:
+            return [DataEntry(x, None) for x in self.arg_files]
+
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for obj in page.get("Contents", []):
+                if obj["Key"].endswith(".json"):
+                    self._objects[obj["Key"]] = self.__metadata(obj["Size"], obj["ETag"], obj["LastModified"])
+        return [DataEntry(x, None) for x in sorted(self._objects)]
+
+    @staticmethod
+    def __metadata(size: int, etag: str, last_modified: Any) -> dict[str, Any]:
+        return {"size": size, "etag": etag.strip('"'), "mtime_ns": int(last_modified.timestamp()) * 1_000_000_000}
+
+    def __object(self, key: str) -> dict[str, Any]:
+        """Return the size, ETag and modification time of an object."""
+        if key not in self._objects:
+            head = self.client.head_object(Bucket=self.bucket, Key=key)
+            self._objects[key] = self.__metadata(head["ContentLength"], head["ETag"], head["LastModified"])
+        return self._objects[key]
+
+    def get_size(self, data: DataEntry) -> int:
+        """Get the size of a file in bytes."""
+        return int(self.__object(data.filename)["size"])
+
+    def fingerprint(self, filename: str, with_hash: bool = True) -> dict[str, Any]:
+        """Get the size, modification time and content hash of a file.
+
+        The ETag is used as content hash, so the object is never downloaded.
+        """
+        obj = self.__object(filename)
+        return {"size": obj["size"], "mtime_ns": obj["mtime_ns"], "hash": "etag:" + obj["etag"]}
+
+    def _load(self, filename: str) -> tuple[Any, int]:
+        obj = self.__object(filename)
+        size = int(obj["size"])
+
+        def get_range(start: int) -> bytes:
+            end = min(start + self.range_size, size) - 1
+            # NOTE: Pin the ETag, so all ranges are read from the same version.
+            response = self.client.get_object(
+                Bucket=self.bucket, Key=filename, Range=f"bytes={start}-{end}", IfMatch=f'"{obj["etag"]}"'
+            )
+            return response["Body"].read()  # type: ignore[no-any-return]
+
+        if size <= self.range_size:
+            content = self.client.get_object(Bucket=self.bucket, Key=filename)["Body"].read()
+        else:
+            starts = list(range(0, size, self.range_size))
+            with ThreadPoolExecutor(max_workers=min(len(starts), 8)) as executor:
+                content = b"".join(executor.map(get_range, starts))
+
+        if content == b"":
+            content = b"{}"
+        return self.codec.loads(content), size
+
+    def _open(self, filename: str) -> AbstractContextManager[IO[str]]:
+        body = self.client.get_object(Bucket=self.bucket, Key=filename)["Body"]
+        return contextlib.closing(codecs.getreader("utf-8")(body))  # type: ignore[arg-type]
+
+    def key(self, filename: str) -> str:
+        """Return the object key of a filename or an s3:// URL."""
+        prefix = f"s3://{self.bucket}/"
+        if filename.startswith(prefix):
+            filename = filename[len(prefix) :]
+        if filename.strip("/") == "":
+            return ""
+        return posixpath.normpath(filename)
+
+    def __list_etags(self, prefix: str) -> dict[str, str]:
+        """Return the ETags of all objects below the prefix."""
+        etags = {}
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            for obj in page.get("Contents", []):
+                etags[obj["Key"]] = obj["ETag"].strip('"')
+        return etags
+
+    def put_contents(
+        self,
+        entries: Iterable[DataEntry],
+        skip_unchanged: bool = True,
+        staging: StagedDestination | None = None,
+        manifest: Manifest | None = None,
+        compressor: Compressor | None = None,
+    ) -> WriteStats:
+        """Upload the content of many files to the bucket.
+
+        The ETags of all existing objects are listed once up front. Objects
+        uploaded in a single part have the MD5 of their content as ETag, so
+        unchanged objects are skipped without a request. The uploads run in
+        a thread pool that accepts only a bounded number of pending objects,
+        so the entries may be a stream that is consumed lazily.
+        """
+        if staging is not None:
+            raise StagingNotSupported()
+
+        start = time.perf_counter()
+        etags = self.__list_etags(self.prefix) if skip_unchanged else {}
+        stats = self.__upload(self.__objects(entries, compressor), etags, manifest)
+        stats.seconds = time.perf_counter() - start
+        return stats
+
+    def __objects(self, entries: Iterable[DataEntry], compressor: Compressor | None) -> Iterator[tuple[str, bytes]]:
+        """Yield the key and the serialized content of every object to upload."""
+        if compressor is not None and compressor.dictionary_path != "":
+            samples, entries = sample_entries(entries)
+            dictionary = compressor.train([self.codec.dumps(x.content) + b"\n" for x in samples])
+            if dictionary != b"":
+                yield compressor.dictionary_path, dictionary
+        for entry in entries:
+            data = self.codec.dumps(entry.content) + b"\n"
+            yield entry.filename, data
+            if compressor is not None:
+                for suffix, compressed in compressor.sidecars(entry.filename, data):
+                    yield entry.filename + suffix, compressed
+
+    def __upload(
+        self, objects: Iterable[tuple[str, bytes]], etags: dict[str, str], manifest: Manifest | None
+    ) -> WriteStats:
+        """Upload the objects whose content differs from their ETag."""
+        stats = WriteStats()
+        # NOTE: Limit the number of pending uploads, so the serialized
+        # objects are not buffered in memory while the uploads catch up.
+        pending = threading.BoundedSemaphore(self.concurrency * 2)
+
+        def put(key: str, data: bytes) -> int:
+            try:
+                response = self.client.put_object(Bucket=self.bucket, Key=key, Body=data, ContentType=content_type(key))
+                return int(response["ResponseMetadata"].get("RetryAttempts", 0))
+            finally:
+                pending.release()
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as uploaders:
+            futures = []
+            for filename, data in objects:
+                stats.files += 1
+                stats.bytes += len(data)
+                stats.paths.append(filename)
+                if manifest is not None:
+                    manifest.add(filename, data)
+                key = self.key(filename)
+                if etags.get(key) == hashlib.md5(data).hexdigest():  # noqa: S324
+                    stats.skipped += 1
+                    continue
+                pending.acquire()
+                futures.append(uploaders.submit(put, key, data))
+            for future in futures:
+                stats.retries += future.result()
+                stats.written += 1
+        return stats
+
+    def delete_removed(self, directory: str, keep: Iterable[str]) -> int:
+        """Delete all objects below directory that are not listed in keep.
+
+        Only the top-level directories of the kept objects are pruned, so a
+        destination at the root of a bucket never deletes unrelated objects,
+        like the raw files. Hidden objects, like the state of the
+        transformer, are never deleted.
+
+        Returns:
+            Number of deleted objects.
+        """
+        prefix = self.key(directory.rstrip("/") + "/")
+        if prefix != "":
+            prefix += "/"
+        keep = {self.key(x) for x in keep}
+        paths = [x[len(prefix) :] for x in keep if x.startswith(prefix)]
+        tops = tuple({x.split("/")[0] + "/" for x in paths if "/" in x})
+        removed = []
+        for key in self.__list_etags(prefix):
+            path = key[len(prefix) :]
+            if key in keep or not path.startswith(tops):
+                continue
+            if any(x.startswith(".") for x in path.split("/")):
+                continue
+            removed.append(key)
+
+        for i in range(0, len(removed), 1000):
+            objects = [{"Key": x} for x in removed[i : i + 1000]]
+            self.client.delete_objects(Bucket=self.bucket, Delete={"Objects": objects, "Quiet": True})
+        return len(removed)
@@ -0,0 +1,161 @@
+"""Publish a destination tree atomically."""
+from __future__ import annotations
+
+import ctypes
+import os
+import shutil
+import sys
+import threading
+import time
+
+from cloudimagedirectory.connection.connection import is_unchanged
+
+
+def syncfs(path: str) -> bool:
+    """Flush the filesystem of a path with a single call.
+
+    Unlike os.sync, only the filesystem of the path is flushed. Returns
+    False if syncfs is not available, it is only provided by Linux.
+    """
+    if not sys.platform.startswith("linux"):
+        return False
+    libc = ctypes.CDLL(None, use_errno=True)
+    if not hasattr(libc, "syncfs"):
+        return False
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        if libc.syncfs(fd) != 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), path)
+    finally:
+        os.close(fd)
+    return True
+
+
+class StagedDestination:
+    """Stage a new generation of the destination tree next to the current one.
+
+    The destination path is a symlink to the current generation. A new
+    generation is written into a sibling directory and swapped in by
+    replacing the symlink, which is a single atomic rename no matter how
+    many files the tree contains. A crash before the swap leaves the current
+    generation untouched.
+    """
+
+    def __init__(self, destination_path: str) -> None:
+        """Initialize the staging directory.
+
+        A destination that is still a plain directory is converted into the
+        first generation, an interrupted conversion is completed.
+        """
+        self.destination_path = os.path.abspath(destination_path).rstrip("/")
+        self.parent, self.name = os.path.split(self.destination_path)
+
+        convert_link = os.path.join(self.parent, f".{self.name}.convert")
+        if not os.path.lexists(self.destination_path) and os.path.isdir(convert_link):
+            os.replace(convert_link, self.destination_path)
+            self.__fsync(self.parent)
+        elif os.path.isdir(self.destination_path) and not os.path.islink(self.destination_path):
+            self.__convert(convert_link)
+
+        self.previous = ""
+        if os.path.isdir(self.destination_path):
+            self.previous = os.path.realpath(self.destination_path)
+
+        self.path = self.__generation_path()
+        os.makedirs(self.path)
+        # NOTE: The written files of every directory, linked files only
+        # need their directory synced.
+        self._files: dict[str, list[str]] = {}
+        self._lock = threading.Lock()
+
+    def __convert(self, convert_link: str) -> None:
+        """Turn the plain destination directory into the first generation.
+
+        A directory can't be replaced by a symlink atomically: the
+        destination is missing between the rename and the replace. The link
+        is created before the rename, so the next run can complete a
+        conversion that was interrupted in between.
+        """
+        if os.path.lexists(convert_link):
+            os.remove(convert_link)
+        initial = self.__generation_path()
+        os.symlink(os.path.basename(initial), convert_link)
+        os.rename(self.destination_path, initial)
+        os.replace(convert_link, self.destination_path)
+        self.__fsync(self.parent)
+
+    def __generation_path(self) -> str:
+        return os.path.join(self.parent, f".{self.name}.gen-{time.time_ns()}")
+
+    def write(self, filename: str, data: bytes) -> bool:
+        """Write a file of the staging directory.
+
+        Files that are unchanged since the previous generation are hard-linked
+        instead of written. New files are written to a temporary file and
+        renamed, so no file is ever visible with partial content. The files
+        are synced in batches when the generation is published.
+
+        Returns:
+            True if the file was linked from the previous generation.
+        """
+        directory_path = os.path.dirname(filename)
+        with self._lock:
+            files = self._files.setdefault(directory_path, [])
+
+        if self.previous != "":
+            previous = os.path.join(self.previous, os.path.relpath(filename, self.path))
+            if is_unchanged(previous, data):
+                os.link(previous, filename)
+                return True
+
+        tmp = os.path.join(directory_path, f".{os.path.basename(filename)}.tmp")
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, filename)
+        with self._lock:
+            files.append(filename)
+        return False
+
+    def publish(self) -> None:
+        """Make the staged generation the current one."""
+        self.__sync()
+
+        link = os.path.join(self.parent, f".{self.name}.swap-{os.getpid()}")
+        os.symlink(os.path.basename(self.path), link)
+        os.replace(link, self.destination_path)
+        self.__fsync(self.parent)
+
+        # NOTE: Keep the previous generation to hard-link unchanged files in
+        # the next run, remove everything older.
+        keep = {os.path.realpath(self.path), self.previous}
+        prefix = f".{self.name}.gen-"
+        for entry in os.scandir(self.parent):
+            if entry.name.startswith(prefix) and os.path.realpath(entry.path) not in keep:
+                shutil.rmtree(entry.path)
+
+    def abort(self) -> None:
+        """Remove the staging directory without publishing it."""
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def __sync(self) -> None:
+        """Persist the staged files and their names before the swap.
+
+        syncfs flushes the filesystem of the staging directory at once.
+        Elsewhere the files of every directory are synced in one batch,
+        followed by the directory itself.
+        """
+        if syncfs(self.path):
+            return
+        for directory_path in sorted(self._files.keys() | {self.path}, reverse=True):
+            for filename in self._files.get(directory_path, []):
+                self.__fsync(filename)
+            self.__fsync(directory_path)
+
+    @staticmethod
+    def __fsync(path: str) -> None:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
@@ -1,10 +1,14 @@
-from typing import Any, Callable
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Any, Callable
 
-import pandas as pd
 import pytz
 from cloudimagedirectory.connection.connection import DataEntry
 from opentelemetry import metrics
 
+if TYPE_CHECKING:
+    import pandas as pd
+
 meter = metrics.get_meter("transformer.pipeline.filter.meter")
 
 
@@ -13,6 +17,9 @@ def get_utc_datetime(date_string: str) -> pd.Timestamp:  # type: ignore[no-any-u
 
     Returns: A datetime object representing the date string.
     """
+    # NOTE: pandas is slow to import, so it is only imported to compare dates.
+    import pandas as pd
+
     return pd.Timestamp(date_string).replace(tzinfo=pytz.UTC)
 
 
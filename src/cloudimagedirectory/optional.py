@@ -0,0 +1,14 @@
+"""Probe for optional dependencies."""
+from __future__ import annotations
+
+import importlib.util
+
+
+def is_installed(name: str) -> bool:
+    """Check if an optional package is installed, without importing it.
+
+    Modules import their optional packages only if they are installed,
+    instead of binding the names to None on an ImportError, so the type
+    checker keeps the types of the packages.
+    """
+    return importlib.util.find_spec(name) is not None
@@ -0,0 +1,119 @@
+"""Export the metrics of the transformer."""
+from __future__ import annotations
+
+import atexit
+import os
+import sys
+import threading
+from typing import IO, TYPE_CHECKING
+
+from opentelemetry import metrics
+
+if TYPE_CHECKING:
+    from opentelemetry.sdk.metrics import MeterProvider
+    from opentelemetry.sdk.metrics.export import MetricExporter
+
+EXPORTERS = ["otlp", "console", "none"]
+
+
+class UnknownExporter(ValueError):
+    """Raise an exception if a metric exporter is not supported."""
+
+    def __init__(self, name: str):
+        """Constructor for UnknownExporter class."""
+        super().__init__(f"unknown metric exporter: {name}")
+
+
+# NOTE: Seconds the exit of the process waits for the last export, so an
+# unreachable collector does not block the exit while the exporter retries.
+SHUTDOWN_TIMEOUT = 2.0
+
+
+def default_exporter() -> str:
+    """Return the exporter configured in the environment.
+
+    Metrics are opt-in: they are only exported if OTEL_METRICS_EXPORTER names
+    an exporter or an OTLP endpoint is configured. Exporters that are not
+    supported, e.g. prometheus, disable the metrics with a warning.
+    """
+    name = os.environ.get("OTEL_METRICS_EXPORTER", "").split(",")[0].strip()
+    if name in EXPORTERS:
+        return name
+    if name != "":
+        print(f"warn: unsupported OTEL_METRICS_EXPORTER {name}, metrics are disabled", file=sys.stderr)
+        return "none"
+    if os.environ.get("OTEL_EXPORTER_OTLP_ENDPOINT") or os.environ.get("OTEL_EXPORTER_OTLP_METRICS_ENDPOINT"):
+        return "otlp"
+    return "none"
+
+
+def create_exporter(name: str, output: IO[str] | None = None) -> MetricExporter | None:
+    """Return the metric exporter of the given name, None if metrics are disabled.
+
+    The console exporter writes one JSON document per export to output, the
+    standard output by default, for runs without a collector.
+    """
+    # NOTE: The exporters are slow to import, the OTLP exporter loads gRPC.
+    if name == "none":
+        return None
+    if name == "console":
+        from opentelemetry.sdk.metrics.export import ConsoleMetricExporter
+
+        return ConsoleMetricExporter(
+            out=output if output is not None else sys.stdout,
+            formatter=lambda x: x.to_json(indent=None) + "\n",
+        )
+    if name == "otlp":
+        from opentelemetry.exporter.otlp.proto.grpc.metric_exporter import OTLPMetricExporter
+
+        return OTLPMetricExporter()
+    raise UnknownExporter(name)
+
+
+def setup_metrics(name: str, output_path: str = "-") -> MeterProvider | None:
+    """Export the metrics of this process.
+
+    The meter provider can only be set once per process, so later calls
+    keep the first provider. The provider is shut down when the process
+    exits, without waiting longer than SHUTDOWN_TIMEOUT.
+    """
+    if name == "none":
+        return None
+
+    from opentelemetry.sdk.metrics import MeterProvider
+    from opentelemetry.sdk.metrics.export import PeriodicExportingMetricReader
+
+    if isinstance(metrics.get_meter_provider(), MeterProvider):
+        return None
+
+    output = None
+    if name == "console" and output_path != "-":
+        os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+        output = open(output_path, "a")  # noqa: SIM115
+    exporter = create_exporter(name, output)
+    if exporter is None:
+        return None
+    provider = MeterProvider(
+        metric_readers=[PeriodicExportingMetricReader(exporter)],
+        shutdown_on_exit=False,
+    )
+    metrics.set_meter_provider(provider)
+    atexit.register(shutdown_metrics, provider)
+    return provider
+
+
+def shutdown_metrics(provider: MeterProvider, timeout: float = SHUTDOWN_TIMEOUT) -> bool:
+    """Export the last metrics and shut down the provider.
+
+    The shutdown runs in a daemon thread, which is abandoned after timeout
+    seconds.
+
+    Returns:
+        True if the shutdown finished in time.
+    """
+    thread = threading.Thread(
+        target=provider.shutdown, kwargs={"timeout_millis": timeout * 1000}, name="metrics-shutdown", daemon=True
+    )
+    thread.start()
+    thread.join(timeout)
+    return not thread.is_alive()
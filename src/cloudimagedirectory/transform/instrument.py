@@ -0,0 +1,93 @@
+"""Record the performance of every pipeline stage."""
+from __future__ import annotations
+
+import resource
+import sys
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+from opentelemetry import metrics
+
+meter = metrics.get_meter("transformer.pipeline.stage.meter")
+
+stage_duration_histogram = meter.create_histogram(
+    name="pipeline.stage.duration",
+    description="Wall time of a pipeline stage",
+    unit="s",
+)
+
+stage_items_in_histogram = meter.create_histogram(
+    name="pipeline.stage.items.in",
+    description="Number of entries a pipeline stage reads",
+    unit="1",
+)
+
+stage_items_out_histogram = meter.create_histogram(
+    name="pipeline.stage.items.out",
+    description="Number of entries a pipeline stage produces",
+    unit="1",
+)
+
+stage_bytes_read_histogram = meter.create_histogram(
+    name="pipeline.stage.bytes.read",
+    description="Number of raw bytes a pipeline stage reads",
+    unit="By",
+)
+
+stage_bytes_written_histogram = meter.create_histogram(
+    name="pipeline.stage.bytes.written",
+    description="Number of bytes a pipeline stage writes",
+    unit="By",
+)
+
+stage_max_rss_histogram = meter.create_histogram(
+    name="pipeline.stage.rss.max",
+    description="Peak resident set size of the process at the end of a pipeline stage",
+    unit="By",
+)
+
+
+def max_rss() -> int:
+    """Return the peak resident set size of the process in bytes."""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # NOTE: macOS reports bytes, Linux kilobytes.
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+@dataclass
+class StageRecord:
+    """Measurements of a single run of a pipeline stage."""
+
+    stage: str
+    provider: str = ""
+    items_in: int = 0
+    items_out: int = 0
+    bytes_read: int = 0
+    bytes_written: int = 0
+    seconds: float = 0.0
+
+    def record(self) -> None:
+        """Record the measurements in the histograms."""
+        attributes = {"stage": self.stage, "provider": self.provider}
+        stage_duration_histogram.record(self.seconds, attributes)
+        stage_items_in_histogram.record(self.items_in, attributes)
+        stage_items_out_histogram.record(self.items_out, attributes)
+        stage_bytes_read_histogram.record(self.bytes_read, attributes)
+        stage_bytes_written_histogram.record(self.bytes_written, attributes)
+        stage_max_rss_histogram.record(max_rss(), attributes)
+
+
+@contextmanager
+def measure(stage: str, provider: str = "", items_in: int = 0) -> Iterator[StageRecord]:
+    """Measure the wall time of a stage.
+
+    The caller sets the other measurements on the yielded record, which is
+    recorded once the stage succeeded.
+    """
+    record = StageRecord(stage, provider, items_in)
+    start = time.perf_counter()
+    yield record
+    record.seconds = time.perf_counter() - start
+    record.record()
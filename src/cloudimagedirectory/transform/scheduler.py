@@ -0,0 +1,107 @@
+"""Run the stages of a pipeline as a dependency graph."""
+from __future__ import annotations
+
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Any, Callable
+
+
+class UnknownStage(Exception):
+    """Raise an exception if a stage depends on a stage that does not exist."""
+
+    def __init__(self, name: str, dependency: str):
+        """Constructor for UnknownStage class."""
+        super().__init__(f"The stage '{name}' depends on the unknown stage '{dependency}'.")
+
+
+@dataclass
+class Stage:
+    """A single step of the graph.
+
+    The function is called with the results of all inputs, in the order the
+    inputs are declared.
+    """
+
+    name: str
+    func: Callable[..., Any]
+    inputs: list[str] = field(default_factory=list)
+    seconds: float = 0.0  # Wall time of the last run.
+
+
+class StageGraph:
+    """Run stages as soon as all of their inputs are available.
+
+    Stages that do not depend on each other run concurrently in a thread
+    pool. With a single worker the stages run one after another in the
+    order they were added.
+    """
+
+    def __init__(self, workers: int = 1) -> None:
+        """Initialize an empty graph."""
+        self.workers = workers
+        self.stages: dict[str, Stage] = {}
+        self.seconds = 0.0
+
+    def add(self, name: str, func: Callable[..., Any], inputs: list[str] | None = None) -> None:
+        """Add a stage, its inputs must be added before."""
+        inputs = inputs or []
+        for dependency in inputs:
+            if dependency not in self.stages:
+                raise UnknownStage(name, dependency)
+        self.stages[name] = Stage(name, func, inputs)
+
+    def run(self) -> dict[str, Any]:
+        """Run all stages and return their results by name."""
+        start = time.perf_counter()
+        results: dict[str, Any] = {}
+
+        if self.workers <= 1:
+            for stage in self.stages.values():
+                results[stage.name] = self.__run_stage(stage, results)
+            self.seconds = time.perf_counter() - start
+            return results
+
+        pending = dict(self.stages)
+        running: dict[Future, Stage] = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while pending or running:
+                for stage in list(pending.values()):
+                    if all(x in results for x in stage.inputs):
+                        del pending[stage.name]
+                        running[executor.submit(self.__run_stage, stage, results)] = stage
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    results[running.pop(future).name] = future.result()
+
+        self.seconds = time.perf_counter() - start
+        return results
+
+    @staticmethod
+    def __run_stage(stage: Stage, results: dict[str, Any]) -> Any:
+        start = time.perf_counter()
+        result = stage.func(*[results[x] for x in stage.inputs])
+        stage.seconds = time.perf_counter() - start
+        return result
+
+    def critical_path(self) -> list[Stage]:
+        """Return the chain of dependent stages with the longest wall time."""
+        # NOTE: The stages were added after their inputs, so they are in
+        # topological order already.
+        longest: dict[str, tuple[float, list[Stage]]] = {}
+        for stage in self.stages.values():
+            seconds, path = max((longest[x] for x in stage.inputs), key=lambda x: x[0], default=(0.0, []))
+            longest[stage.name] = (seconds + stage.seconds, [*path, stage])
+        if not longest:
+            return []
+        return max(longest.values(), key=lambda x: x[0])[1]
+
+    def report(self) -> str:
+        """Return the wall time of every stage and the critical path."""
+        lines = [f"stage {x.name}: {x.seconds:.3f}s" for x in self.stages.values()]
+        path = self.critical_path()
+        lines.append(
+            f"critical path: {' -> '.join(x.name for x in path)} "
+            f"({sum(x.seconds for x in path):.3f}s of {self.seconds:.3f}s)"
+        )
+        return "\n".join(lines)
@@ -0,0 +1,64 @@
+"""Keep encoded image documents on disk until they are written."""
+from __future__ import annotations
+
+import os
+import tempfile
+from typing import Any
+
+from cloudimagedirectory.connection.codec import Codec
+from cloudimagedirectory.connection.connection import DataEntry
+
+
+class SpooledEntry(DataEntry):
+    """Data entry whose whole content is kept in a spool.
+
+    The entry itself only holds the reduced content that the filters and
+    index generators read.
+    """
+
+    __slots__ = ("location",)
+
+    def __init__(self, filename: str, content: list | dict | None, location: tuple[int, int]) -> None:
+        super().__init__(filename, content)
+        self.location = location  # Offset and length of the whole content in the spool.
+
+
+class Spool:
+    """Append-only temporary file of encoded documents.
+
+    Every document is encoded once when it is added and only its location
+    is kept in memory. The file is removed when the spool is closed.
+    """
+
+    def __init__(self, codec: Codec) -> None:
+        """Initialize an empty spool."""
+        self.codec = codec
+        self.size = 0
+        self._file = tempfile.TemporaryFile()
+
+    def add(self, content: Any) -> tuple[int, int]:
+        """Append a document and return its offset and length."""
+        data = self.codec.dumps(content)
+        offset = self.size
+        self._file.seek(0, os.SEEK_END)
+        self._file.write(data)
+        self.size += len(data)
+        return offset, len(data)
+
+    def get(self, location: tuple[int, int]) -> Any:
+        """Return the decoded document at a location."""
+        offset, length = location
+        self._file.seek(offset)
+        return self.codec.loads(self._file.read(length))
+
+    def close(self) -> None:
+        """Remove the spool file."""
+        self._file.close()
+
+    def __enter__(self) -> Spool:
+        """Return the spool."""
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        """Remove the spool file."""
+        self.close()
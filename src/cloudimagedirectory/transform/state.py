@@ -0,0 +1,111 @@
+"""Persist the transformed images of every raw file between runs."""
+from __future__ import annotations
+
+import os
+import threading
+from pathlib import Path
+from typing import Any, Callable
+
+from cloudimagedirectory.connection.codec import Codec, get_codec
+from cloudimagedirectory.connection.connection import DataEntry, file_fingerprint, replace_atomically
+
+# NOTE: Increase the version whenever the formatters change their output,
+# so the images of the previous run are not reused.
+STATE_VERSION = 2
+
+
+class TransformState:
+    """Cache the images every provider transformer produced from a raw file.
+
+    A raw file is unchanged if its size and modification time match the
+    previous run, or if its content hash does. The images of unchanged files
+    are served from the cache instead of being formatted again.
+    """
+
+    def __init__(
+        self,
+        previous: dict[str, Any] | None = None,
+        codec: Codec | None = None,
+        fingerprint: Callable[[str, bool], dict[str, Any]] = file_fingerprint,
+    ) -> None:
+        """Initialize the state with the files of the previous run.
+
+        Args:
+            previous: State of the raw files of the previous run.
+            codec: Codec of the state file.
+            fingerprint: Returns the size, modification time and, if requested,
+                the content hash of a raw file.
+        """
+        self.previous: dict[str, Any] = previous or {}
+        self.fingerprint = fingerprint
+        self.files: dict[str, Any] = {}
+        self.codec = codec if codec is not None else get_codec()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(
+        cls,
+        state_path: str,
+        fingerprint: Callable[[str, bool], dict[str, Any]] = file_fingerprint,
+    ) -> TransformState:
+        """Load the state of the previous run, if there is a compatible one."""
+        codec = get_codec()
+        previous = {}
+        if os.path.exists(state_path):
+            content = codec.loads(Path(state_path).read_bytes())
+            if content.get("version") == STATE_VERSION:
+                previous = content["files"]
+        return cls(previous, codec, fingerprint)
+
+    def __file(self, filename: str) -> dict[str, Any]:
+        """Return the state of a raw file of the current run."""
+        with self._lock:
+            state = self.files.get(filename)
+        if state is not None:
+            return state  # type: ignore[no-any-return]
+
+        # NOTE: Only hash the file if the size or modification time changed.
+        current = self.fingerprint(filename, False)
+        previous = self.previous.get(filename)
+        if previous is not None and all(previous[x] == current[x] for x in ["size", "mtime_ns"]):
+            current["hash"] = previous["hash"]
+        else:
+            current = self.fingerprint(filename, True)
+
+        images = {}
+        if previous is not None and previous["hash"] == current["hash"]:
+            images = previous["images"]
+
+        with self._lock:
+            return self.files.setdefault(filename, {**current, "images": images})  # type: ignore[no-any-return]
+
+    def get(self, transformer: str, filename: str) -> list[DataEntry] | None:
+        """Return the cached images of a raw file, None if it has changed."""
+        images = self.__file(filename)["images"].get(transformer)
+        with self._lock:
+            if images is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return [DataEntry(x, y) for x, y in images]
+
+    def put(self, transformer: str, filename: str, entries: list[DataEntry]) -> None:
+        """Store the images of a raw file."""
+        images = [[x.filename, x.content] for x in entries]
+        state = self.__file(filename)
+        with self._lock:
+            state["images"] = {**state["images"], transformer: images}
+
+    def write(self, state_path: str) -> None:
+        """Write the state of all raw files of the current run."""
+        # NOTE: Parallel stages add the files in any order, sort them so the
+        # state file does not depend on the schedule.
+        content = {"version": STATE_VERSION, "files": dict(sorted(self.files.items()))}
+        with replace_atomically(state_path) as tmp:
+            Path(tmp).write_bytes(self.codec.dumps(content))
+
+    def stats(self) -> str:
+        """Return a summary of the cache usage."""
+        return f"transform state: {self.hits} hits, {self.misses} misses"
@@ -0,0 +1,93 @@
+"""Partition data entries by kind, provider and API version."""
+from __future__ import annotations
+
+from collections.abc import Iterable, Iterator, Sequence
+
+from cloudimagedirectory.connection.connection import DataEntry
+
+PROVIDERS = ("aws", "azure", "google")
+
+
+def find_provider(entry: DataEntry) -> str:
+    """Return the provider of an entry, empty if it has none.
+
+    The provider is taken from its position in the path, so a provider name
+    elsewhere in the path, e.g. in the origin path, is ignored.
+    """
+    path = entry.filename.split("/")
+    candidates: list[Sequence[str]] = []
+    if "raw" in path:
+        i = len(path) - 1 - path[::-1].index("raw")
+        candidates.append(path[i + 1 : i + 2])
+    if entry.api == "v1":
+        candidates.append(path[1:2])
+    if entry.api == "v2":
+        candidates.append([entry.provider])
+    candidates.append(PROVIDERS)
+
+    for names in candidates:
+        matches = [x for x in names if x in PROVIDERS and entry.is_provided_by(x)]
+        if len(matches) != 0:
+            return matches[0]
+    return ""
+
+
+def classify(entry: DataEntry) -> tuple[str, str, str]:
+    """Return the kind, provider and API version of an entry.
+
+    The kind is one of raw, v1 or v2 for images, idx for indexes, or other.
+    """
+    api = entry.api
+    provider = find_provider(entry)
+    if entry.is_raw():
+        return "raw", provider, ""
+    if entry.is_provided_by("idx") or (api == "v2" and not entry.is_API("v2")):
+        return "idx", provider, api
+    if api != "":
+        return api, provider, api
+    return "other", provider, api
+
+
+class EntryStore:
+    """Keep data entries partitioned when they are inserted.
+
+    Every partition is a list in insertion order, so a stage gets exactly
+    its slice of the entries without scanning all others. Partitions are
+    kept for every combination of kind with and without provider and API
+    version.
+    """
+
+    def __init__(self, entries: Iterable[DataEntry] = ()) -> None:
+        """Initialize the store with a copy of the entries."""
+        self._entries: list[DataEntry] = []
+        self._partitions: dict[tuple[str, str, str], list[DataEntry]] = {}
+        self.extend(entries)
+
+    def add(self, entry: DataEntry) -> None:
+        """Add an entry to all of its partitions."""
+        kind, provider, api = classify(entry)
+        self._entries.append(entry)
+        for key in {(kind, "", ""), (kind, provider, ""), (kind, "", api), (kind, provider, api)}:
+            self._partitions.setdefault(key, []).append(entry)
+
+    def extend(self, entries: Iterable[DataEntry]) -> None:
+        """Add many entries."""
+        for entry in entries:
+            self.add(entry)
+
+    def select(self, kind: str = "", provider: str = "", api: str = "") -> list[DataEntry]:
+        """Return the entries of a partition, all entries if kind is empty.
+
+        The returned list is shared with the store and must not be modified.
+        """
+        if kind == "":
+            return self._entries
+        return self._partitions.get((kind, provider, api), [])
+
+    def __iter__(self) -> Iterator[DataEntry]:
+        """Iterate over all entries in insertion order."""
+        return iter(self._entries)
+
+    def __len__(self) -> int:
+        """Return the number of entries."""
+        return len(self._entries)
@@ -1,22 +1,42 @@
 """Transforms the raw data into useful data."""
-import copy
+from __future__ import annotations
+
 import hashlib
 import os
 from collections import defaultdict
+from collections.abc import Iterator
+from concurrent.futures import Executor, ProcessPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
-from typing import Any, Callable, no_type_check
+from typing import Any, Callable, ClassVar, cast, no_type_check
 
 from cloudimagedirectory import config
-from cloudimagedirectory.connection.connection import DataEntry
+from cloudimagedirectory.connection.codec import get_codec
+from cloudimagedirectory.connection.connection import DataEntry, process_context
 from cloudimagedirectory.format import format_aws, format_azure, format_google
+from cloudimagedirectory.transform import instrument
+from cloudimagedirectory.transform.scheduler import StageGraph
+from cloudimagedirectory.transform.spool import Spool, SpooledEntry
+from cloudimagedirectory.transform.state import TransformState
+from cloudimagedirectory.transform.store import EntryStore
 from opentelemetry import metrics
 
 meter = metrics.get_meter("transformer.pipeline.meter")
 
 
+def reduce_content(content: Any, fields: tuple[str, ...] | None) -> Any:
+    """Return only the given fields of an image, the whole content if fields is None."""
+    if fields is None or not isinstance(content, dict):
+        return content
+    return {x: content[x] for x in fields if x in content}
+
+
 class Pipeline:
     """Builds a pipeline of transformer tasks."""
 
+    # NOTE: The filters only read the name and date of the images.
+    filter_fields = ("name", "date")
+
     # TODO: Fix src_conn to have a specific type.
     def __init__(
         self,
@@ -24,49 +44,207 @@ class Pipeline:
         transformer_funcs: list[Callable],
         filter_funcs: list[Callable],
         idx_generator_funcs: list[Callable],
+        state: TransformState | None = None,
+        workers: int = 1,
+        processes: int = 0,
     ) -> None:
-        """Initialize the pipeline."""
-        self.transformers: list[Callable] = []
+        """Initialize the pipeline.
+
+        If a state is given, the provider transformers reuse the images of
+        raw files that did not change since the previous run. With more than
+        one worker, independent stages run concurrently. With processes, the
+        raw files are formatted in a process pool.
+        """
+        self.transformers: list[TransformerRaw] = []
         self.filter_funcs: list[Callable] = []
-        self.idx_generators: list[Callable] = []
+        self.idx_generators: list[Transformer] = []
         self.src_conn = src_conn
         self.filter_funcs = filter_funcs
+        self.workers = workers
+        self.processes = processes
         for transformer_func in transformer_funcs:
-            self.transformers.append(transformer_func(self.src_conn))
+            transformer = transformer_func(self.src_conn)
+            transformer.state = state
+            self.transformers.append(transformer)
         for idx_generator_func in idx_generator_funcs:
             self.idx_generators.append(idx_generator_func(self.src_conn))
 
+    @staticmethod
+    def __stage_name(graph: StageGraph, stage: Any) -> str:
+        name = type(stage).__name__
+        i = 1
+        while name in graph.stages:
+            i += 1
+            name = f"{type(stage).__name__}-{i}"
+        return name
+
+    def __filter(self, results: list) -> list:
+        generated_pages = len(results)
+        print("total images: ", generated_pages)
+
+        with instrument.measure("filter", items_in=generated_pages) as record:
+            for filter_func in self.filter_funcs:
+                before = generated_pages
+                results = filter_func(results)
+                after = len(results)
+                if before != after:
+                    print(f"filtered {before - after} items")
+            record.items_out = len(results)
+        return results
+
+    def __run_stage(self, name: str, stage: Any, entries: list) -> list:
+        """Run a transformer or index generator and record its measurements."""
+        provider = stage.provider if stage.kind == "raw" else ""
+        with instrument.measure(name, provider, len(entries)) as record:
+            if stage.kind == "raw":
+                record.bytes_read = sum(self.src_conn.get_size(x) for x in entries)
+            results: list = stage.run(entries)
+            record.items_out = len(results)
+        return results
+
+    @contextmanager
+    def __executor(self) -> Iterator[Executor | None]:
+        """Share a process pool between the provider transformers, if processes are used."""
+        executor = create_executor(self.src_conn, self.processes) if self.processes > 0 else None
+        for transformer in self.transformers:
+            transformer.executor = executor
+        try:
+            yield executor
+        finally:
+            if executor is not None:
+                executor.shutdown()
+            for transformer in self.transformers:
+                transformer.executor = None
+
     # TODO: Mypy complains that the transformer/idx_generator below do not have a .run()
     # method. This is something to fix later.
     @no_type_check
-    def run(self, data: list) -> list:
-        """Run the pipeline."""
-        results = data
-        for transformer in self.transformers:
-            results.extend(transformer.run(results))
+    def __graph(self, data: list) -> tuple[StageGraph, list[str]]:
+        """Return the stage graph of the pipeline and the names of the index stages."""
+        graph = StageGraph(self.workers)
+        graph.add("input", lambda: EntryStore(data))
 
-        generated_pages = len(results)
-        print("total images: ", generated_pages)
+        def stage_input(name: str, stage: Any) -> Callable:
+            provider = stage.provider if stage.kind == "raw" else ""
+            return lambda store: self.__run_stage(name, stage, store.select(stage.kind, provider))
 
-        for filter_func in self.filter_funcs:
-            before = generated_pages
-            results = filter_func(results)
-            after = len(results)
-            if before != after:
-                print(f"filtered {before - after} items")
+        transformer_stages = []
+        for transformer in self.transformers:
+            name = self.__stage_name(graph, transformer)
+            graph.add(name, stage_input(name, transformer), ["input"])
+            transformer_stages.append(name)
 
-        generated_pages = len(results)
+        def filter_stage(store: EntryStore, *outputs: list) -> EntryStore:
+            # NOTE: Keep the order of the sequential pipeline, raw files first.
+            results = list(store)
+            for output in outputs:
+                results.extend(output)
+            return EntryStore(self.__filter(results))
+
+        graph.add("filter", filter_stage, ["input", *transformer_stages])
 
+        idx_stages = []
         for idx_generator in self.idx_generators:
-            results.extend(idx_generator.run(results))
+            name = self.__stage_name(graph, idx_generator)
+            graph.add(name, stage_input(name, idx_generator), ["filter"])
+            idx_stages.append(name)
+        return graph, idx_stages
+
+    def run(self, data: list) -> list:
+        """Run the pipeline.
+
+        The provider transformers only read the raw files and the index
+        generators only read the filtered images, so the stages of each
+        group do not depend on each other. Every stage gets only its slice
+        of the entries. The caller's list is never modified.
+        """
+        graph, idx_stages = self.__graph(data)
+        with self.__executor():
+            outputs = graph.run()
+
+        results = list(outputs["filter"])
+        generated_pages = len(results)
+        for name in idx_stages:
+            results.extend(outputs[name])
 
         print(f"generated indexes: {len(results) - generated_pages}")
+        print(graph.report())
 
         return results
 
+    @no_type_check
+    def stream(self, data: list) -> Iterator[DataEntry]:
+        """Run the pipeline and yield its outputs one at a time.
+
+        The raw files are formatted a few at a time. Every image is added to
+        a spool file as soon as it is produced, and only the fields that the
+        filters and index generators read are kept in memory. Since filters
+        like the unique name filter need all images, the images are yielded
+        once all raw files are formatted, read back from the spool one at a
+        time, followed by the indexes. The peak memory usage depends on the
+        size of the indexes, not of the output.
+        """
+        fields = self.fields()
+        store = EntryStore(data)
+        # NOTE: Keep the order of the sequential pipeline, raw files first.
+        results = list(store)
+
+        with Spool(self.src_conn.codec) as spool:
+            with self.__executor():
+                for transformer in self.transformers:
+                    raw = store.select(transformer.kind, transformer.provider)
+                    with instrument.measure(type(transformer).__name__, transformer.provider, len(raw)) as record:
+                        record.bytes_read = sum(self.src_conn.get_size(x) for x in raw)
+                        spooled = spool.size
+                        for images in transformer.iter_run(raw, max(self.workers, self.processes)):
+                            for image in images:
+                                location = spool.add(image.content)
+                                results.append(
+                                    SpooledEntry(image.filename, reduce_content(image.content, fields), location)
+                                )
+                            record.items_out += len(images)
+                        record.bytes_written = spool.size - spooled
+            print(f"spooled images: {spool.size} bytes")
+
+            results = self.__filter(results)
+            for entry in results:
+                if isinstance(entry, SpooledEntry):
+                    yield DataEntry(entry.filename, spool.get(entry.location))
+                else:
+                    yield entry
+
+        store = EntryStore(results)
+        generated = 0
+        for idx_generator in self.idx_generators:
+            indexes = self.__run_stage(type(idx_generator).__name__, idx_generator, store.select(idx_generator.kind))
+            generated += len(indexes)
+            yield from indexes
+        print(f"generated indexes: {generated}")
+
+    def fields(self) -> tuple[str, ...] | None:
+        """Return the content fields the filters and index generators read, None for all."""
+        fields = set(self.filter_fields)
+        for idx_generator in self.idx_generators:
+            if idx_generator.fields is None:
+                return None
+            fields.update(idx_generator.fields)
+        return tuple(sorted(fields))
+
 
 class Transformer:
-    """Base class for transforming raw image data."""
+    """Base class for transforming raw image data.
+
+    The image records are shared between all stages without copies, so a
+    transformer must never modify the content of its input entries.
+    """
+
+    # NOTE: The pipeline passes only the entries of this kind, and of the
+    # provider of raw transformers, see EntryStore. Empty means all entries.
+    kind = ""
+
+    # NOTE: The content fields an index generator reads, see Pipeline.stream.
+    # None means the whole content.
+    fields: tuple[str, ...] | None = None
 
     # TODO: Fix src_conn to have a specific type.
     def __init__(self, src_conn: Any) -> None:
@@ -81,54 +259,58 @@ class Transformer:
 class TransformerIdxListImageLatest(Transformer):
     """Sort the transformed data, to have the latest images."""
 
+    kind = "v1"
+    fields = ("arch", "date", "name")
     chunk_size = 50
     provider = ""
 
-    # TODO: The ruff linter complains that this method is too complex. We might be able
-    # to break it up into more manageable chunks.
-    def run(self, data: list[DataEntry]) -> list:  # noqa: C901
+    def run(self, data: list[DataEntry]) -> list:
+        """Return the pages of the images of the provider, latest first."""
+        images_list = [x for x in self.sort_images(data) if self.provider in ("", x["provider"])]
+        return self.paginate(images_list, self.provider)
+
+    def sort_images(self, data: list[DataEntry]) -> list[dict]:
+        """Return the images of all providers sorted by date, latest first."""
         # NOTE: Verify that the data is not raw.
         entries: list = [x for x in data if not x.is_raw() and not x.is_provided_by("idx")]
 
-        # NOTE: Sort the list of data by date
-        entries.sort(
-            key=lambda x: datetime.strptime("".join(x.content["date"].split("T")[0]), "%Y-%m-%d"),
-            reverse=True,
-        )
-
-        images_list = []
+        # NOTE: Parse every distinct date only once, many images share a date.
+        dates: dict[str, datetime] = {}
         for entry in entries:
-            provider = "unknown"
-            if entry.is_provided_by("aws"):
-                provider = "aws"
-            elif entry.is_provided_by("azure"):
-                provider = "azure"
-            elif entry.is_provided_by("google"):
-                provider = "google"
-
-            # NOTE: Filter images for pre-defined provider.
-            # If Provider is not set, all providers are valid.
-            if self.provider != "" and self.provider != provider:
-                continue
-
-            region = "unkown"
-            filename = entry.filename.split("/")
-            if len(filename) == 4:
-                region = filename[2]
-            else:
-                print("warn: could not determine region of image: " + entry.filename)
-
-            images_list.append(
-                {
-                    "name": entry.content["name"],
-                    "date": entry.content["date"].split("T")[0],
-                    "provider": provider,  # TODO: Evaluate if this can be removed
-                    "ref": entry.filename,
-                    "arch": entry.content["arch"],
-                    "region": region,  # TODO: Evaluate if this can be removed
-                }
-            )
+            date = entry.content["date"].split("T")[0]
+            if date not in dates:
+                dates[date] = datetime.strptime(date, "%Y-%m-%d")
 
+        # NOTE: Sort the list of data by date
+        entries.sort(key=lambda x: dates[x.content["date"].split("T")[0]], reverse=True)
+
+        return [self.summary(x) for x in entries]
+
+    @staticmethod
+    def summary(entry: DataEntry) -> dict:
+        """Return the fields of an image that the pages list."""
+        provider = next((x for x in ("aws", "azure", "google") if entry.is_provided_by(x)), "unknown")
+
+        region = "unkown"
+        filename = entry.filename.split("/")
+        if len(filename) == 4:
+            region = filename[2]
+        else:
+            print("warn: could not determine region of image: " + entry.filename)
+
+        # NOTE: The entries are images, so their content is a dict.
+        content = cast(dict, entry.content)
+        return {
+            "name": content["name"],
+            "date": content["date"].split("T")[0],
+            "provider": provider,  # TODO: Evaluate if this can be removed
+            "ref": entry.filename,
+            "arch": content["arch"],
+            "region": region,  # TODO: Evaluate if this can be removed
+        }
+
+    def paginate(self, images_list: list[dict], provider: str) -> list[DataEntry]:
+        """Split the sorted images into pages of the provider."""
         # NOTE: Split the list of images into equally sized chunkes
         chunked_list = []
         chunk = []
@@ -138,9 +320,8 @@ class TransformerIdxListImageLatest(Transformer):
                 chunked_list.append(chunk)
                 chunk = []
 
-        provider = ""
-        if self.provider != "":
-            provider = "-" + self.provider
+        if provider != "":
+            provider = "-" + provider
 
         first = 0
         results = []
@@ -161,6 +342,31 @@ class TransformerIdxListImageLatest(Transformer):
         return results
 
 
+class TransformerIdxListImageLatestAll(TransformerIdxListImageLatest):
+    """Sort the transformed data once, to have the latest images of all and every provider.
+
+    The sort is stable, so the images of a provider keep the order they would
+    have if only they were sorted. The pages are the same as those of the
+    separate transformers of every provider.
+    """
+
+    providers: ClassVar[tuple[str, ...]] = ("", "google", "aws", "azure")
+
+    def run(self, data: list[DataEntry]) -> list:
+        """Return the pages of all images and of every provider."""
+        images_list = self.sort_images(data)
+
+        by_provider: dict[str, list[dict]] = {x: [] for x in self.providers}
+        for image in images_list:
+            if image["provider"] in by_provider:
+                by_provider[image["provider"]].append(image)
+
+        results = []
+        for provider in self.providers:
+            results.extend(self.paginate(images_list if provider == "" else by_provider[provider], provider))
+        return results
+
+
 class TransformerIdxListImageLatestGoogle(TransformerIdxListImageLatest):
     """Sort the transformed data to have the latest google images."""
 
@@ -185,85 +391,207 @@ class TransformerIdxListImageLatestAZURE(TransformerIdxListImageLatest):
         return super().run(data)
 
 
-class TransformerAWS(Transformer):
-    """Transform raw AWS data."""
+# NOTE: The connection of a worker process, it is passed once per process
+# instead of with every raw file.
+_worker_connection: Any = None
+
+
+def _init_worker(src_conn: Any) -> None:
+    """Keep the connection of a worker process."""
+    global _worker_connection
+    _worker_connection = src_conn
+
+
+def create_executor(src_conn: Any, processes: int) -> ProcessPoolExecutor:
+    """Return a process pool that formats the raw files of the connection.
+
+    The connection is passed to every worker process once, the raw files
+    are passed by their filename.
+    """
+    return ProcessPoolExecutor(
+        max_workers=processes, mp_context=process_context(), initializer=_init_worker, initargs=(src_conn,)
+    )
+
+
+def _transform_remote(transformer_cls: type, filename: str, codec_name: str) -> bytes:
+    """Transform a single raw file in a worker process.
+
+    The images are returned encoded as a single buffer, which is much cheaper
+    to pass between processes than pickled entries with nested dicts.
+    """
+    results = transformer_cls(_worker_connection).transform(DataEntry(filename, None))
+    return get_codec(codec_name).dumps([[x.filename, x.content] for x in results])
+
+
+class TransformerRaw(Transformer):
+    """Base class for transforming the raw data of one provider."""
+
+    kind = "raw"
+    provider = ""
+    state: TransformState | None = None
+    counter: Any = None  # Counts the generated images, if set.
+    executor: Executor | None = None  # Formats the raw files in other processes, if set.
 
     def run(self, data: list[DataEntry]) -> list:
         """Transform the raw data."""
-        # NOTE: Verify that the data is from AWS.
-        entries = [x for x in data if x.is_provided_by("aws") and x.is_raw()]
+        # NOTE: Verify that the data is raw and from the provider.
+        entries = [x for x in data if x.is_provided_by(self.provider) and x.is_raw()]
 
+        # NOTE: The connection decides if the raw files are processed in parallel.
+        # The results are always merged in the order of the raw files.
         results = []
-        for entry in entries:
-            raw = self.src_conn.get_content(entry)
-            region = os.path.basename(raw.filename).split(".")[0]
+        if self.executor is not None:
+            batches = self.transform_remote(entries)
+        else:
+            batches = self.src_conn.map_raw(self.transform_cached, entries)
+        for images in batches:
+            results.extend(images)
+
+        # NOTE: Counters are only updated in this process, the worker
+        # processes have no meter provider.
+        if self.counter is not None and len(results) > 0:
+            self.counter.add(len(results), {"provider": self.provider})
 
-            for content in raw.content:
-                if content["OwnerId"] != config.AWS_RHEL_OWNER_ID:
-                    continue
+        return results
 
-                image_data = format_aws.image_rhel(content, region)
-                image_name = image_data["name"].replace(" ", "_").lower()
-                data_entry = DataEntry(f"v1/aws/{region}/{image_name}", image_data)
-                results.append(data_entry)
+    def iter_run(self, data: list[DataEntry], chunk_size: int = 1) -> Iterator[list]:
+        """Transform the raw data, yield the images of one raw file at a time.
+
+        Only chunk_size raw files are formatted at once, in parallel if the
+        connection has workers or the transformer an executor.
+        """
+        entries = [x for x in data if x.is_provided_by(self.provider) and x.is_raw()]
+        for i in range(0, len(entries), chunk_size):
+            chunk = entries[i : i + chunk_size]
+            if self.executor is not None:
+                batches = self.transform_remote(chunk)
+            else:
+                batches = self.src_conn.map_raw(self.transform_cached, chunk)
+            for images in batches:
+                if self.counter is not None and len(images) > 0:
+                    self.counter.add(len(images), {"provider": self.provider})
+                yield images
+
+    def transform_cached(self, entry: DataEntry) -> list:
+        """Transform a single raw file, unless it is unchanged since the previous run."""
+        if self.state is None:
+            return self.transform(entry)
+
+        name = type(self).__name__
+        results = self.state.get(name, entry.filename)
+        if results is None:
+            results = self.transform(entry)
+            self.state.put(name, entry.filename, results)
+        else:
+            # NOTE: The raw file is not read, the other consumers of the
+            # connection's store may still need it.
+            self.src_conn.release_content(entry)
+        return results
 
+    def transform_remote(self, entries: list[DataEntry]) -> list[list]:
+        """Transform the changed raw files in the process pool."""
+        name = type(self).__name__
+        codec = self.src_conn.codec
+        results: list = [None] * len(entries)
+        futures = {}
+        for i, entry in enumerate(entries):
+            if self.state is not None:
+                results[i] = self.state.get(name, entry.filename)
+            if results[i] is None:
+                futures[i] = self.executor.submit(  # type: ignore[union-attr]
+                    _transform_remote, type(self), entry.filename, codec.name
+                )
+
+        for i, future in futures.items():
+            results[i] = [DataEntry(x, y) for x, y in codec.loads(future.result())]
+            if self.state is not None:
+                self.state.put(name, entries[i].filename, results[i])
         return results
 
+    def transform(self, entry: DataEntry) -> list:
+        """Transform a single raw file."""
+        raise NotImplementedError
 
-class TransformerGoogle(Transformer):
+
+class TransformerAWS(TransformerRaw):
+    """Transform raw AWS data."""
+
+    provider = "aws"
+
+    def transform(self, entry: DataEntry) -> list:
+        """Transform a single raw file."""
+        region = os.path.basename(entry.filename).split(".")[0]
+
+        results = []
+        for content in self.src_conn.iter_content(entry):
+            if content["OwnerId"] != config.AWS_RHEL_OWNER_ID:
+                continue
+
+            image_data = format_aws.image_rhel(content, region)
+            image_name = image_data["name"].replace(" ", "_").lower()
+            data_entry = DataEntry(f"v1/aws/{region}/{image_name}", image_data)
+            results.append(data_entry)
+
+        return results
+
+
+class TransformerGoogle(TransformerRaw):
     """Transform raw google data."""
 
-    def run(self, data: list[DataEntry]) -> list:
-        """Transform the raw data."""
-        # NOTE: Verify that the data is from Google.
-        entries = [x for x in data if x.is_provided_by("google") and x.is_raw()]
+    provider = "google"
 
+    def transform(self, entry: DataEntry) -> list:
+        """Transform a single raw file."""
         results = []
-        for entry in entries:
-            raw = self.src_conn.get_content(entry)
-            for content in raw.content:
-                content["creation_timestamp"] = content["creationTimestamp"]
-                if "rhel" in content["name"]:
-                    image_data = format_google.image_rhel(content)
-                    image_name = image_data["name"].replace(" ", "_").lower()
-                    data_entry = DataEntry(f"v1/google/global/{image_name}", image_data)
-                    results.append(data_entry)
+        for content in self.src_conn.iter_content(entry):
+            # NOTE: Raw content is shared between transformers, never modify it.
+            content = {**content, "creation_timestamp": content["creationTimestamp"]}
+            if "rhel" in content["name"]:
+                image_data = format_google.image_rhel(content)
+                image_name = image_data["name"].replace(" ", "_").lower()
+                data_entry = DataEntry(f"v1/google/global/{image_name}", image_data)
+                results.append(data_entry)
 
         return results
 
 
-class TransformerAZURE(Transformer):
+class TransformerAZURE(TransformerRaw):
     """Transform raw Azure data."""
 
+    provider = "azure"
+
     def run(self, data: list[DataEntry]) -> list:
         """Transform the raw data."""
-        # NOTE: Verify that the data is from Azure.
-        entries = [x for x in data if x.is_provided_by("azure") and x.is_raw()]
-
+        # NOTE: Keep only the first image of every name, across all raw files.
         seen = {}
         results = []
-        for entry in entries:
-            raw = self.src_conn.get_content(entry)
+        for data_entry in super().run(data):
+            if data_entry.filename in seen:
+                continue
+            else:
+                seen[data_entry.filename] = True
 
-            for content in raw.content:
-                if content["publisher"] != "RedHat":
-                    continue
+            results.append(data_entry)
 
-                content["hyperVGeneration"] = "unknown"
+        return results
 
-                try:
-                    image_data = format_azure.image_rhel(content)
-                    image_name = image_data["name"].replace(" ", "_").lower()
-                    data_entry = DataEntry(f"v1/azure/global/{image_name}", image_data)
+    def transform(self, entry: DataEntry) -> list:
+        """Transform a single raw file."""
+        results = []
+        for content in self.src_conn.iter_content(entry):
+            if content["publisher"] != "RedHat":
+                continue
 
-                    if image_name in seen:
-                        continue
-                    else:
-                        seen[image_name] = True
+            # NOTE: Raw content is shared between transformers, never modify it.
+            content = {**content, "hyperVGeneration": "unknown"}
 
-                    results.append(data_entry)
-                except KeyError:
-                    print("Could not format image, sku: " + content["sku"] + " offer: " + content["offer"])
+            try:
+                image_data = format_azure.image_rhel(content)
+                image_name = image_data["name"].replace(" ", "_").lower()
+                data_entry = DataEntry(f"v1/azure/global/{image_name}", image_data)
+                results.append(data_entry)
+            except KeyError:
+                print("Could not format image, sku: " + content["sku"] + " offer: " + content["offer"])
 
         return results
 
@@ -271,6 +599,9 @@ class TransformerAZURE(Transformer):
 class TransformerIdxListImageNames(Transformer):
     """Genearate list of all image names."""
 
+    kind = "v1"
+    fields = ()
+
     def run(self, data: list[DataEntry]) -> list:
         # NOTE: Verify that the data is not raw.
         entries = [x for x in data if not x.is_raw() and not x.is_provided_by("idx")]
@@ -292,70 +623,96 @@ generated_image_provider_metadata_counter = meter.create_counter(
 )
 
 
-class TransformerAWSV2RHEL(Transformer):
+class TransformerAWSV2RHEL(TransformerRaw):
     """Transform raw rhel AWS data into the schema."""
 
-    def run(self, data: list[DataEntry]) -> list:
-        """Transform the raw data."""
-        # NOTE: Verify that the data is raw.
-        entries = [x for x in data if x.is_provided_by("aws") and x.is_raw()]
-
-        results = []
-        for e in entries:
-            entry = copy.deepcopy(e)
+    provider = "aws"
+    counter = generated_image_provider_metadata_counter
 
-            raw = self.src_conn.get_content(entry)
-            region = os.path.basename(raw.filename).split(".")[0]
+    def transform(self, entry: DataEntry) -> list:
+        """Transform a single raw file."""
+        region = os.path.basename(entry.filename).split(".")[0]
 
-            for content in raw.content:
-                if content["OwnerId"] != config.AWS_RHEL_OWNER_ID:
-                    continue
+        results = []
+        for content in self.src_conn.iter_content(entry):
+            if content["OwnerId"] != config.AWS_RHEL_OWNER_ID:
+                continue
 
-                image_data = format_aws.image_rhel(content, region)
-                image_name = image_data["name"].replace(" ", "_").lower()
-                os_name = "rhel"
-                provider = "aws"
-                version = image_data["version"]
-                # NOTE: Due to consistency issues between the cloud providers and the fact
-                # that they do not all have unique numbers to identify their images, we decided
-                # to use this solution instead.
-                image_id = hashlib.sha1(image_name.encode()).hexdigest()  # noqa: S324
+            image_data = format_aws.image_rhel(content, region)
+            image_name = image_data["name"].replace(" ", "_").lower()
+            os_name = "rhel"
+            provider = "aws"
+            version = image_data["version"]
+            # NOTE: Due to consistency issues between the cloud providers and the fact
+            # that they do not all have unique numbers to identify their images, we decided
+            # to use this solution instead.
+            image_id = hashlib.sha1(image_name.encode()).hexdigest()  # noqa: S324
+
+            # NOTE: example of expected paths
+            # v2/os/rhel/provider/aws/version/8.6.0/region/eu-west-3/image/71d0a7aaa1f0dc06840e46f6ce316a7acfb022d4
+            # v2/os/rhel/provider/aws/version/8.2.0/region/eu-north-1/image/14e4eab326cc5a2ef13cb5c0f36bc9bfa41025d9
+            path = f"v2/os/{os_name}/provider/{provider}/version/{version}/region/{region}/image/{image_id}"
+            data_entry = DataEntry(path, image_data)
 
-                # NOTE: example of expected paths
-                # v2/os/rhel/provider/aws/version/8.6.0/region/eu-west-3/image/71d0a7aaa1f0dc06840e46f6ce316a7acfb022d4
-                # v2/os/rhel/provider/aws/version/8.2.0/region/eu-north-1/image/14e4eab326cc5a2ef13cb5c0f36bc9bfa41025d9
-                path = f"v2/os/{os_name}/provider/{provider}/version/{version}/region/{region}/image/{image_id}"
-                data_entry = DataEntry(path, image_data)
-
-                results.append(data_entry)
-                generated_image_provider_metadata_counter.add(1, {"provider": provider})
+            results.append(data_entry)
         return results
 
 
-class TransformerAzureV2RHEL(Transformer):
+class TransformerAzureV2RHEL(TransformerRaw):
     """Transform raw rhel Azure data into the schema."""
 
-    def run(self, data: list[DataEntry]) -> list:
-        """Transform the raw data."""
-        # NOTE: Verify that the data is raw and provided by azure.
-        entries = [x for x in data if x.is_provided_by("azure") and x.is_raw()]
+    provider = "azure"
+    counter = generated_image_provider_metadata_counter
 
+    def transform(self, entry: DataEntry) -> list:
+        """Transform a single raw file."""
         results = []
-        for e in entries:
-            entry = copy.deepcopy(e)
-            raw = self.src_conn.get_content(entry)
+        for content in self.src_conn.iter_content(entry):
+            if content["publisher"] != "RedHat":
+                continue
+
+            # NOTE: Raw content is shared between transformers, never modify it.
+            content = {**content, "hyperVGeneration": "unknown"}
+
+            image_data = format_azure.image_rhel(content)
+            image_name = image_data["name"].replace(" ", "_").lower()
+            os_name = "rhel"
+            provider = "azure"
+            region = "global"
+            version = image_data["version"]
+            # NOTE: Due to consistency issues between the cloud providers and the fact
+            # that they do not all have unique numbers to identify their images, we decided
+            # to use this solution instead.
+            image_id = hashlib.sha1(image_name.encode()).hexdigest()  # noqa: S324
+
+            # NOTE: example of expected paths
+            # v2/os/rhel/provider/azure/version/8.6.0/region/southcentralus/image/71d0a7aaa1f0dc06840e46f6ce316a7acfb022d4
+            # v2/os/rhel/provider/azure/version/8.2.0/region/southcentralus/image/14e4eab326cc5a2ef13cb5c0f36bc9bfa41025d9
+            path = f"v2/os/{os_name}/provider/{provider}/version/{version}/region/{region}/image/{image_id}"
+            data_entry = DataEntry(path, image_data)
 
-            for content in raw.content:
-                if content["publisher"] != "RedHat":
-                    continue
+            results.append(data_entry)
+        return results
 
-                content["hyperVGeneration"] = "unknown"
 
-                image_data = format_azure.image_rhel(content)
+class TransformerGoogleV2RHEL(TransformerRaw):
+    """Transform raw rhel Google data into the schema."""
+
+    provider = "google"
+    counter = generated_image_provider_metadata_counter
+
+    def transform(self, entry: DataEntry) -> list:
+        """Transform a single raw file."""
+        results = []
+        for content in self.src_conn.iter_content(entry):
+            # NOTE: Raw content is shared between transformers, never modify it.
+            content = {**content, "creation_timestamp": content["creationTimestamp"]}
+            if "rhel" in content["name"]:
+                image_data = format_google.image_rhel(content)
                 image_name = image_data["name"].replace(" ", "_").lower()
-                os_name = "rhel"
-                provider = "azure"
                 region = "global"
+                os_name = "rhel"
+                provider = "google"
                 version = image_data["version"]
                 # NOTE: Due to consistency issues between the cloud providers and the fact
                 # that they do not all have unique numbers to identify their images, we decided
@@ -363,51 +720,12 @@ class TransformerAzureV2RHEL(Transformer):
                 image_id = hashlib.sha1(image_name.encode()).hexdigest()  # noqa: S324
 
                 # NOTE: example of expected paths
-                # v2/os/rhel/provider/azure/version/8.6.0/region/southcentralus/image/71d0a7aaa1f0dc06840e46f6ce316a7acfb022d4
-                # v2/os/rhel/provider/azure/version/8.2.0/region/southcentralus/image/14e4eab326cc5a2ef13cb5c0f36bc9bfa41025d9
+                # v2/os/rhel/provider/google/version/8.6.0/region/global/image/71d0a7aaa1f0dc06840e46f6ce316a7acfb022d4
+                # v2/os/rhel/provider/google/version/8.2.0/region/global/image/14e4eab326cc5a2ef13cb5c0f36bc9bfa41025d9
                 path = f"v2/os/{os_name}/provider/{provider}/version/{version}/region/{region}/image/{image_id}"
                 data_entry = DataEntry(path, image_data)
 
                 results.append(data_entry)
-                generated_image_provider_metadata_counter.add(1, {"provider": provider})
-        return results
-
-
-class TransformerGoogleV2RHEL(Transformer):
-    """Transform raw rhel Google data into the schema."""
-
-    def run(self, data: list[DataEntry]) -> list:
-        """Transform the raw data."""
-        # NOTE: Verify that the data is raw and provided by google.
-        entries = [x for x in data if x.is_provided_by("google") and x.is_raw()]
-
-        results = []
-        for e in entries:
-            entry = copy.deepcopy(e)
-            raw = self.src_conn.get_content(entry)
-
-            for content in raw.content:
-                content["creation_timestamp"] = content["creationTimestamp"]
-                if "rhel" in content["name"]:
-                    image_data = format_google.image_rhel(content)
-                    image_name = image_data["name"].replace(" ", "_").lower()
-                    region = "global"
-                    os_name = "rhel"
-                    provider = "google"
-                    version = image_data["version"]
-                    # NOTE: Due to consistency issues between the cloud providers and the fact
-                    # that they do not all have unique numbers to identify their images, we decided
-                    # to use this solution instead.
-                    image_id = hashlib.sha1(image_name.encode()).hexdigest()  # noqa: S324
-
-                    # NOTE: example of expected paths
-                    # v2/os/rhel/provider/google/version/8.6.0/region/global/image/71d0a7aaa1f0dc06840e46f6ce316a7acfb022d4
-                    # v2/os/rhel/provider/google/version/8.2.0/region/global/image/14e4eab326cc5a2ef13cb5c0f36bc9bfa41025d9
-                    path = f"v2/os/{os_name}/provider/{provider}/version/{version}/region/{region}/image/{image_id}"
-                    data_entry = DataEntry(path, image_data)
-
-                    results.append(data_entry)
-                    generated_image_provider_metadata_counter.add(1, {"provider": provider})
         return results
 
 
@@ -418,200 +736,184 @@ generated_image_endpoint_metadata_counter = meter.create_counter(
 )
 
 
-class TransformerV2All(Transformer):
-    """Generate list of all image details."""
+# NOTE: Descriptions and display names of the operating systems in v2/os/list.
+OS_DESCRIPTIONS = {"rhel": "Red Hat Enterprise Linux"}
+OS_DISPLAY_NAMES = {"rhel": "Red Hat Enterprise Linux"}
 
-    def run(self, data: list[DataEntry]) -> list:
-        # NOTE: Verify that the data is from api v2.
-        entries = [x for x in data if x.is_API("v2")]
 
-        results: list = []
+class V2Aggregate:
+    """Aggregate the v2 images in a single pass.
+
+    The images are counted for every level of the os, provider, version,
+    region and image hierarchy. Every level is a dict from the API path of
+    its list to the counts, in the order the paths are seen first, so every
+    list endpoint is emitted from the aggregate without another pass.
+    """
 
-        for e in entries:
-            entry = copy.deepcopy(e)
+    def __init__(self, entries: list[DataEntry]) -> None:
+        """Aggregate the v2 API entries."""
+        self.records: list = []
+        self.os: dict = defaultdict(int)
+        self.providers: defaultdict = defaultdict(lambda: defaultdict(int))
+        self.versions: defaultdict = defaultdict(lambda: defaultdict(int))
+        self.regions: defaultdict = defaultdict(lambda: defaultdict(int))
+        self.images: defaultdict = defaultdict(list)
 
-            filename = entry.filename.split("/")
-            if len(filename) < 3:
+        for entry in entries:
+            if not entry.is_API("v2"):
+                continue
+            os, provider, version, region = entry.os, entry.provider, entry.version, entry.region
+            prefix = f"v2/os/{os}/provider"
+            self.os[os] += 1
+            self.providers[f"{prefix}/list"][provider] += 1
+            self.versions[f"{prefix}/{provider}/version/list"][version] += 1
+            # NOTE: Add /list suffix to prevent collision with "region" and "image" folder.
+            self.regions[f"{prefix}/{provider}/version/{version}/region/list"][region] += 1
+            self.images[f"{prefix}/{provider}/version/{version}/region/{region}/image/list"].append(entry.image_id)
+
+            if provider == "" or region == "":
                 print("warn: could not determine region or provider of image: " + entry.filename)
                 continue
 
-            # Update the DataEntry with the provider and region.
+            # Add the provider and region to the image details.
+            # NOTE: Image records are shared between all stages and never
+            # modified, so build a new dict instead of updating the record.
             # NOTE(mhayden): mypy knows that the second argument for DataEntry could be
             # a dict, list, or None, so we must check that here to prevent a type error.
-            updated_content = {
-                "provider": filename[4],
-                "region": filename[8],
-            }
+            updated_content = {"provider": provider, "region": region}
             if not entry.content or isinstance(entry.content, list):
-                entry.content = updated_content
+                self.records.append(updated_content)
             else:
-                entry.content.update(updated_content)
+                self.records.append({**entry.content, **updated_content})
+
+    def all(self) -> list[DataEntry]:
+        """Return the list of all image details."""
+        results = list(self.records)
+        # NOTE: Break ties between equal names to keep the output deterministic.
+        results.sort(key=lambda x: (x["name"], x["provider"], x["region"], x.get("imageId", "")), reverse=False)
+        if len(results) > 0:
+            generated_image_endpoint_metadata_counter.add(len(results), {"endpoint": "/all"})
+        return [DataEntry("v2/all", results)]
 
-            results.append(entry.content)
-            generated_image_endpoint_metadata_counter.add(1, {"endpoint": "/all"})
+    def os_list(self, description: dict | None = None, display_name: dict | None = None) -> list[DataEntry]:
+        """Return the list of all operating systems."""
+        description = description if description is not None else OS_DESCRIPTIONS
+        display_name = display_name if display_name is not None else OS_DISPLAY_NAMES
+        results = [
+            {
+                "name": os,
+                "display_name": display_name.get(os, "no display name"),
+                "description": description.get(os, "no description"),
+                "count": val,
+            }
+            for os, val in sorted(self.os.items())
+        ]
+        # NOTE: Add /list suffix to prevent collision with "os" folder.
+        return [DataEntry("v2/os/list", results)]
 
-        results.sort(key=lambda x: x["name"], reverse=False)
+    @staticmethod
+    def __counts(counts: dict) -> list[DataEntry]:
+        # NOTE: Sort the keys to keep the output deterministic.
+        return [DataEntry(x, dict(sorted(y.items()))) for x, y in counts.items()]
 
-        return [DataEntry("v2/all", results)]
+    def provider_lists(self) -> list[DataEntry]:
+        """Return the providers of every os."""
+        return self.__counts(self.providers)
+
+    def version_lists(self) -> list[DataEntry]:
+        """Return the versions of every provider."""
+        return self.__counts(self.versions)
+
+    def region_lists(self) -> list[DataEntry]:
+        """Return the regions of every version."""
+        return self.__counts(self.regions)
+
+    def image_lists(self) -> list[DataEntry]:
+        """Return the images of every region."""
+        # NOTE: Sort the images to keep the output deterministic.
+        return [DataEntry(x, sorted(y)) for x, y in self.images.items()]
+
+
+class TransformerV2All(Transformer):
+    """Generate list of all image details."""
+
+    kind = "v2"
+
+    def run(self, data: list[DataEntry]) -> list:
+        return V2Aggregate(data).all()
 
 
 class TransformerV2(Transformer):
     """Base class for all v2 transformers."""
 
+    kind = "v2"
+
     def filtered_entries(self, data: list[DataEntry]) -> list:
         """Return only data entries for api v2."""
         return [x for x in data if x.is_API("v2")]
 
 
+class TransformerV2Aggregate(TransformerV2):
+    """Generate v2/all and every v2 list endpoint in a single pass.
+
+    The output is the same as the one of TransformerV2All,
+    TransformerV2ListOS, TransformerV2ListProviderByOS,
+    TransformerV2ListVersionByProvider, TransformerV2ListRegionByVersion and
+    TransformerV2ListImageByRegion, in this order.
+    """
+
+    def run(self, data: list[DataEntry]) -> list:
+        aggregate = V2Aggregate(data)
+        return [
+            *aggregate.all(),
+            *aggregate.os_list(),
+            *aggregate.provider_lists(),
+            *aggregate.version_lists(),
+            *aggregate.region_lists(),
+            *aggregate.image_lists(),
+        ]
+
+
 class TransformerV2ListOS(TransformerV2):
     """Generate list of all available operating systems."""
 
     @property
     def description(self) -> dict:
         """Return description."""
-        return {"rhel": "Red Hat Enterprise Linux"}
+        return OS_DESCRIPTIONS
 
     @property
     def display_name(self) -> dict:
         """Return display name."""
-        return {"rhel": "Red Hat Enterprise Linux"}
+        return OS_DISPLAY_NAMES
 
     def run(self, data: list[DataEntry]) -> list:
-        results: list = []
-        os_list: dict = {}
-
-        for e in self.filtered_entries(data):
-            entry = copy.deepcopy(e)
-            filename = entry.filename.split("/")[10]
-
-            try:
-                os = entry.filename.split("/")[2]
-
-                if os not in os_list:
-                    os_list[os] = 1
-                else:
-                    os_list[os] += 1
-            except IndexError:
-                print(f"Could not format image, filename: {filename}")
-
-        for os, val in os_list.items():
-            desc = self.description.get(os, "no description")
-            disp_name = self.display_name.get(os, "no display name")
-
-            entry_object = {
-                "name": os,
-                "display_name": disp_name,
-                "description": desc,
-                "count": val,
-            }
-
-            results.append(entry_object)
-
-        # NOTE: Add /list suffix to prevent collision with "os" folder.
-        return [DataEntry("v2/os/list", results)]
+        return V2Aggregate(data).os_list(self.description, self.display_name)
 
 
 class TransformerV2ListProviderByOS(TransformerV2):
     """Generate a list for all available providers of a specific os."""
 
     def run(self, data: list[DataEntry]) -> list:
-        # Start each provider at a count of 0 so we can increment the counter as
-        # we build the results.
-        providers: defaultdict = defaultdict(lambda: defaultdict(int))
-
-        for e in self.filtered_entries(data):
-            entry = copy.deepcopy(e)
-            filename = entry.filename.split("/")
-            os = filename[2]
-            provider = filename[4]
-
-            # Build the API path that corresponds to this entry.
-            api_path = f"v2/os/{os}/provider/list"
-
-            # Increment the count for this provider at this API path.
-            providers[api_path][provider] += 1
-
-        # Convert the API path and provider counts into DataEntry objects.
-        return [DataEntry(x, dict(y)) for x, y in providers.items()]
+        return V2Aggregate(data).provider_lists()
 
 
 class TransformerV2ListVersionByProvider(TransformerV2):
     """Generate a list for all available versions for a specific provider."""
 
     def run(self, data: list[DataEntry]) -> list:
-        # Start each version at a count of 0 so we can increment the counter as
-        # we build the results.
-        versions: defaultdict = defaultdict(lambda: defaultdict(int))
-
-        for e in self.filtered_entries(data):
-            entry = copy.deepcopy(e)
-            filename = entry.filename.split("/")
-            os = filename[2]
-            provider = filename[4]
-            version = filename[6]
-
-            # Build the API path that corresponds to this entry.
-            api_path = f"v2/os/{os}/provider/{provider}/version/list"
-
-            # Increment the count for this version at this API path.
-            versions[api_path][version] += 1
-
-        # Convert the API path and version counts into DataEntry objects.
-        return [DataEntry(x, dict(y)) for x, y in versions.items()]
+        return V2Aggregate(data).version_lists()
 
 
 class TransformerV2ListRegionByVersion(TransformerV2):
     """Generate a list for all available regions for one version."""
 
     def run(self, data: list[DataEntry]) -> list:
-        # NOTE: check that its the v2 data entries.
-        [x for x in data if x.is_API("v2")]
-
-        # Start each region at a count of 0 so we can increment the counter as
-        # we build the results.
-        regions: defaultdict = defaultdict(lambda: defaultdict(int))
-
-        for entry in self.filtered_entries(data):
-            filename = entry.filename.split("/")
-            os = filename[2]
-            provider = filename[4]
-            version = filename[6]
-            region = filename[8]
-
-            # Build the API path that corresponds to this entry.
-            # NOTE: Add /list suffix to prevent collision with "region" folder.
-            api_path = f"v2/os/{os}/provider/{provider}/version/{version}/region/list"
-
-            # Increment the count for this region at this API path.
-            regions[api_path][region] += 1
-
-        # Convert the API path and region counts into DataEntry objects.
-        return [DataEntry(x, dict(y)) for x, y in regions.items()]
+        return V2Aggregate(data).region_lists()
 
 
 class TransformerV2ListImageByRegion(TransformerV2):
     """Generate a list of all images for one region."""
 
     def run(self, data: list[DataEntry]) -> list:
-        # NOTE: check that its the v2 data entries.
-        entries = [x for x in data if x.is_API("v2")]
-
-        images: defaultdict = defaultdict(list)
-
-        for e in entries:
-            entry = copy.deepcopy(e)
-            filename = entry.filename.split("/")
-            os = filename[2]
-            provider = filename[4]
-            version = filename[6]
-            region = filename[8]
-            image = filename[10]
-
-            # Build the API path that corresponds to this entry.
-            # NOTE: Add /list suffix to prevent collision with "image" folder.
-            api_path = f"v2/os/{os}/provider/{provider}/version/{version}/region/{region}/image/list"
-
-            images[api_path].append(image)
-
-        # Convert the API path and appendend image into DataEntry objects.
-        return [DataEntry(x, y) for x, y in images.items()]
+        return V2Aggregate(data).image_lists()
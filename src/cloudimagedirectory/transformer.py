@@ -1,21 +1,22 @@
 """Add command for transforming image data."""
+from __future__ import annotations
+
 import datetime
+import itertools
+from collections.abc import Iterable, Iterator
+from typing import TYPE_CHECKING
 
 import click
-import pandas as pd
-from opentelemetry import metrics
-from opentelemetry.exporter.otlp.proto.grpc.metric_exporter import OTLPMetricExporter
-from opentelemetry.sdk.metrics import MeterProvider
-from opentelemetry.sdk.metrics.export import PeriodicExportingMetricReader
 
+from cloudimagedirectory import telemetry
 from cloudimagedirectory.connection import connection
 from cloudimagedirectory.filter import filter
-from cloudimagedirectory.transform import transform
+from cloudimagedirectory.transform import instrument, state, transform
 
-exporter = OTLPMetricExporter()
-reader = PeriodicExportingMetricReader(exporter)
-provider = MeterProvider(metric_readers=[reader])
-metrics.set_meter_provider(provider)
+# NOTE: The sinks import optional packages like brotli, zstandard and sqlite3,
+# so they are only imported by the functions that use them.
+if TYPE_CHECKING:
+    from cloudimagedirectory.connection import compress, manifest, s3, staging
 
 
 @click.command()
@@ -24,7 +25,13 @@ metrics.set_meter_provider(provider)
     "--origin.path",
     "origin_path",
     prompt="Origin filesystem path",
-    help="The path to the filesystem source",
+    help="The path to the filesystem source, or an s3://bucket/prefix URL",
+)
+@click.option(
+    "--s3.endpoint-url",
+    "s3_endpoint_url",
+    default="",
+    help="Endpoint URL of an S3 compatible object store",
 )
 @click.option(
     "-dp",
@@ -49,18 +56,291 @@ metrics.set_meter_provider(provider)
     prompt="files to process",
     help="List of predefined files to process",
 )
-def run(origin_path: str, destination_path: str, arg_files: str, filter_until: str) -> None:
-    # metrics.get_meter_provider().start_pipeline(ConsoleMetricExporter(), interval=5)
-
+@click.option(
+    "--input.providers",
+    "input_providers",
+    default="none",
+    help="Comma separated providers whose raw files are listed, e.g. aws,google",
+)
+@click.option(
+    "--input.resolve-symlinks",
+    "resolve_symlinks",
+    is_flag=True,
+    default=False,
+    help="Resolve symlinks of the listed raw files",
+)
+@click.option(
+    "--input.stream",
+    "input_stream",
+    is_flag=True,
+    default=False,
+    help="Decode raw files incrementally to keep the memory usage flat",
+)
+@click.option(
+    "-w",
+    "--workers",
+    "workers",
+    type=click.IntRange(min=1),
+    default=1,
+    help="Number of raw files processed in parallel",
+)
+@click.option(
+    "--processes",
+    "processes",
+    type=click.IntRange(min=0),
+    default=0,
+    help="Number of processes formatting raw files, 0 to format them in this process",
+)
+@click.option(
+    "--stream",
+    "stream",
+    is_flag=True,
+    default=False,
+    help="Write the outputs as a stream, to keep the memory usage bounded by the size of the indexes",
+)
+@click.option(
+    "--output.skip-unchanged",
+    "skip_unchanged",
+    is_flag=True,
+    default=False,
+    help="Do not rewrite files whose content has not changed",
+)
+@click.option(
+    "--output.delete-removed",
+    "delete_removed",
+    is_flag=True,
+    default=False,
+    help="Delete files in the destination that are no longer generated",
+)
+@click.option(
+    "--output.staged",
+    "staged",
+    is_flag=True,
+    default=False,
+    help="Write into a staging directory and swap it in atomically",
+)
+@click.option(
+    "--output.manifest",
+    "manifest_path",
+    default="",
+    help="Write a manifest with the hashes of all outputs to this path",
+)
+@click.option(
+    "--output.bundle",
+    "bundle_path",
+    default="",
+    help="Pack all outputs into a single bundle file at this path, instead of writing them as files",
+)
+@click.option(
+    "--output.database",
+    "database_path",
+    default="",
+    help="Export the v2 images and indexes into a SQLite database at this path",
+)
+@click.option(
+    "--state.path",
+    "state_path",
+    default="",
+    help=(
+        "Keep the images of every raw file in a state file at this path and reuse them in the next run, "
+        "if the raw file did not change. Keep it outside the destination, which is published"
+    ),
+)
+@click.option(
+    "--full",
+    "full",
+    is_flag=True,
+    default=False,
+    help="Transform all raw files, even if they did not change since the run that wrote --state.path",
+)
+@click.option(
+    "--output.compress",
+    "compress_encodings",
+    default="none",
+    help="Comma separated encodings of precompressed sidecars: gzip, br, zstd",
+)
+@click.option(
+    "--output.compress-min-size",
+    "compress_min_size",
+    type=click.IntRange(min=0),
+    default=4096,
+    help="Minimum size in bytes of outputs that get precompressed sidecars",
+)
+@click.option(
+    "--output.zstd-dictionary-size",
+    "zstd_dictionary_size",
+    type=click.IntRange(min=0),
+    default=0,
+    help=(
+        "Size in bytes of a trained zstd dictionary for the per-image documents, which get .dzst sidecars, "
+        "0 to disable it"
+    ),
+)
+@click.option(
+    "--metrics.exporter",
+    "metrics_exporter",
+    type=click.Choice(telemetry.EXPORTERS),
+    default=telemetry.default_exporter,
+    help=(
+        "Exporter of the metrics, console writes them as JSON for runs without a collector. "
+        "Defaults to OTEL_METRICS_EXPORTER, otlp if an OTLP endpoint is configured, none otherwise"
+    ),
+)
+@click.option(
+    "--metrics.output",
+    "metrics_output",
+    default="-",
+    help="File the console exporter appends the metrics to, - for the standard output",
+)
+def run(
+    origin_path: str,
+    destination_path: str,
+    arg_files: str,
+    s3_endpoint_url: str,
+    filter_until: str,
+    input_providers: str,
+    resolve_symlinks: bool,
+    input_stream: bool,
+    workers: int,
+    processes: int,
+    stream: bool,
+    skip_unchanged: bool,
+    delete_removed: bool,
+    staged: bool,
+    manifest_path: str,
+    bundle_path: str,
+    database_path: str,
+    state_path: str,
+    full: bool,
+    compress_encodings: str,
+    compress_min_size: int,
+    zstd_dictionary_size: int,
+    metrics_exporter: str,
+    metrics_output: str,
+) -> None:
     """Get content from filesystem format image data."""
-    target: list[str] = []
-    if arg_files != "none":
-        target = arg_files.split(",")
-    origin_connection = connection.ConnectionFS(origin_path, target)
+    telemetry.setup_metrics(metrics_exporter, metrics_output)
+    target = arg_files.split(",") if arg_files != "none" else []
+    check_options(destination_path, stream, staged, bundle_path, database_path, state_path)
+    # NOTE: Every raw file is read once by the v1 and once by the v2 pipeline.
+    # Streamed files are decoded by every consumer on its own instead, like
+    # all files of a stream run, where the pipelines run one after another.
+    store = None if input_stream or stream else connection.RawContentStore(consumers=2)
+    providers = input_providers.split(",") if input_providers != "none" else None
+    origin_connection = create_origin(
+        origin_path, target, store, input_stream, workers, s3_endpoint_url, providers, resolve_symlinks
+    )
     filenames = origin_connection.get_filenames()
     for file in filenames:
         print("input: " + file.filename)
 
+    transform_state = load_state(state_path, full, origin_connection)
+
+    pipeline_v1, pipeline_v2 = create_pipelines(
+        origin_connection, create_filters(filter_until), transform_state, workers, processes
+    )
+    entries: Iterable[connection.DataEntry]
+    if stream:
+        # NOTE: The outputs are written while the pipelines run.
+        entries = itertools.chain(
+            stream_pipeline("v1", pipeline_v1, filenames),
+            stream_pipeline("v2", pipeline_v2, filenames),
+        )
+    else:
+        results = run_pipelines(pipeline_v1, pipeline_v2, filenames)
+        if store is not None:
+            print(store.stats())
+        if transform_state is not None:
+            print(transform_state.stats())
+        export_results(results, database_path, bundle_path)
+        entries = results
+
+    # NOTE: A bundle replaces the files of the destination.
+    if bundle_path == "":
+        output_connection = create_output(destination_path, workers, s3_endpoint_url)
+        compression = (compress_encodings, compress_min_size, zstd_dictionary_size)
+        write_outputs(
+            output_connection,
+            entries,
+            destination_path,
+            skip_unchanged,
+            delete_removed,
+            staged,
+            manifest_path,
+            compression,
+        )
+
+    if transform_state is not None:
+        transform_state.write(state_path)
+
+
+class IncompatibleOptions(click.UsageError):
+    """Raise an exception if an option can't be combined with others."""
+
+    def __init__(self, option: str, others: str) -> None:
+        """Constructor for IncompatibleOptions class."""
+        super().__init__(f"{option} can't be combined with {others}")
+
+
+def check_options(
+    destination_path: str, stream: bool, staged: bool, bundle_path: str, database_path: str, state_path: str
+) -> None:
+    """Raise an exception if options are combined that exclude each other."""
+    from cloudimagedirectory.connection import s3
+
+    if stream and (bundle_path != "" or database_path != "" or state_path != ""):
+        raise IncompatibleOptions("--stream", "--output.bundle, --output.database or --state.path")
+    if staged and s3.is_s3_url(destination_path):
+        raise IncompatibleOptions("--output.staged", "an S3 destination")
+
+
+def create_origin(
+    origin_path: str,
+    target: list[str],
+    store: connection.RawContentStore | None,
+    input_stream: bool,
+    workers: int,
+    s3_endpoint_url: str,
+    providers: list[str] | None,
+    resolve_symlinks: bool,
+) -> connection.Connection:
+    """Return the connection to the raw files, in a bucket or on the filesystem."""
+    from cloudimagedirectory.connection import s3
+
+    if s3.is_s3_url(origin_path):
+        return s3.ConnectionS3(origin_path, target, store, input_stream, workers, endpoint_url=s3_endpoint_url)
+    return connection.ConnectionFS(
+        origin_path, target, store, input_stream, workers, providers=providers, resolve=resolve_symlinks
+    )
+
+
+def create_output(
+    destination_path: str, workers: int, s3_endpoint_url: str
+) -> connection.ConnectionFS | s3.ConnectionS3:
+    """Return the connection to the destination, a bucket or the filesystem."""
+    from cloudimagedirectory.connection import s3
+
+    if s3.is_s3_url(destination_path):
+        return s3.ConnectionS3(destination_path, [], workers=workers, endpoint_url=s3_endpoint_url)
+    return connection.ConnectionFS(destination_path, [], workers=workers)
+
+
+def load_state(state_path: str, full: bool, origin_connection: connection.Connection) -> state.TransformState | None:
+    """Return the state of the previous run, None if the state is not used.
+
+    The images of raw files that did not change since the previous run are
+    reused, unless a full rebuild is requested. The state is opt-in and
+    never written into the destination, which is published as is.
+    """
+    if state_path == "":
+        return None
+    if full:
+        return state.TransformState(fingerprint=origin_connection.fingerprint)
+    return state.TransformState.load(state_path, origin_connection.fingerprint)
+
+
+def create_filters(filter_until: str) -> list:
+    """Return the image filters, with the images after filter_until ignored."""
     filters = [
         filter.FilterImageByFilename("test"),
         filter.FilterImageByFilename("beta"),
@@ -73,9 +353,22 @@ def run(origin_path: str, destination_path: str, arg_files: str, filter_until: s
         filter_after = datetime.datetime.now() - datetime.timedelta(days=2 * 365)
         filters.append(filter.FilterImageByLatestUpdate(filter_after))
     elif filter_until != "" and filter_until != "none":
+        # NOTE: pandas is slow to import, so it is only imported if needed.
+        import pandas as pd
+
         filter_after = pd.to_datetime(filter_until)
         filters.append(filter.FilterImageByLatestUpdate(filter_after))
+    return filters
+
 
+def create_pipelines(
+    origin_connection: connection.Connection,
+    filters: list,
+    transform_state: state.TransformState | None,
+    workers: int,
+    processes: int,
+) -> tuple[transform.Pipeline, transform.Pipeline]:
+    """Return the v1 and the v2 pipeline."""
     pipeline_v1 = transform.Pipeline(
         origin_connection,
         [
@@ -86,14 +379,13 @@ def run(origin_path: str, destination_path: str, arg_files: str, filter_until: s
         filters,
         [
             transform.TransformerIdxListImageNames,
-            transform.TransformerIdxListImageLatest,
-            transform.TransformerIdxListImageLatestGoogle,
-            transform.TransformerIdxListImageLatestAWS,
-            transform.TransformerIdxListImageLatestAZURE,
+            # NOTE: Generates the sort-by-date pages of all and every provider.
+            transform.TransformerIdxListImageLatestAll,
         ],
+        transform_state,
+        workers,
+        processes,
     )
-    print("run pipeline v1")
-    results = pipeline_v1.run(filenames)
 
     # NOTE: Introducing a second pipeline, to avoid filtering of v1/v2 data
     # based on the image filename.
@@ -107,18 +399,150 @@ def run(origin_path: str, destination_path: str, arg_files: str, filter_until: s
         ],
         filters,
         [
-            transform.TransformerV2All,
-            transform.TransformerV2ListOS,
-            transform.TransformerV2ListProviderByOS,
-            transform.TransformerV2ListVersionByProvider,
-            transform.TransformerV2ListRegionByVersion,
-            transform.TransformerV2ListImageByRegion,
+            # NOTE: Generates v2/all and all list endpoints in a single pass.
+            transform.TransformerV2Aggregate,
         ],
+        transform_state,
+        workers,
+        processes,
     )
+    return pipeline_v1, pipeline_v2
+
+
+def run_pipelines(
+    pipeline_v1: transform.Pipeline, pipeline_v2: transform.Pipeline, filenames: list
+) -> list[connection.DataEntry]:
+    """Run the pipelines one after another and return all their results."""
+    print("run pipeline v1")
+    results = pipeline_v1.run(filenames)
     print("run pipeline v2")
     results.extend(pipeline_v2.run(filenames))
+    return results
+
+
+def export_results(results: list[connection.DataEntry], database_path: str, bundle_path: str) -> None:
+    """Write the results into the database and the bundle, if requested."""
+    from cloudimagedirectory.connection import bundle, database
+
+    if database_path != "":
+        with instrument.measure("database", items_in=len(results)) as record:
+            database_stats = database.write_database(database_path, results)
+            record.items_out = database_stats.written
+            record.bytes_written = database_stats.bytes
+        print(database_stats)
+
+    if bundle_path != "":
+        with instrument.measure("bundle", items_in=len(results)) as record:
+            bundle_stats = bundle.write_bundle(bundle_path, [x for x in results if not x.is_raw()])
+            record.items_out = bundle_stats.written
+            record.bytes_written = bundle_stats.bytes
+        print(bundle_stats)
+
+
+def write_outputs(
+    output_connection: connection.ConnectionFS | s3.ConnectionS3,
+    entries: Iterable[connection.DataEntry],
+    destination_path: str,
+    skip_unchanged: bool,
+    delete_removed: bool,
+    staged: bool,
+    manifest_path: str,
+    compression: tuple[str, int, int],
+) -> None:
+    """Write the outputs into the destination.
+
+    The compression is given as the encodings, the minimum size and the
+    size of the zstd dictionary.
+    """
+    from cloudimagedirectory.connection import manifest, s3, staging
+
+    # NOTE: A staged destination is written into a new generation, that
+    # only contains the current outputs and replaces the destination at once.
+    destination = None
+    output_path = destination_path
+    if staged:
+        destination = staging.StagedDestination(destination_path)
+        output_path = destination.path
+
+    output_manifest = None
+    if manifest_path != "":
+        output_manifest = manifest.Manifest.load(output_path, manifest_path)
+
+    # NOTE: Unchanged objects are never uploaded again.
+    skip_unchanged = skip_unchanged or s3.is_s3_url(destination_path)
+    compressor = create_compressor(compression, output_path)
+    stats = put_outputs(
+        output_connection, entries, output_path, skip_unchanged, destination, output_manifest, compressor
+    )
+
+    if destination is not None:
+        destination.publish()
+    elif delete_removed:
+        stats.deleted = output_connection.delete_removed(destination_path, stats.paths)
+    print(stats)
+
+    if output_manifest is not None:
+        output_manifest.write(manifest_path)
+        print(output_manifest)
+
+
+def put_outputs(
+    output_connection: connection.ConnectionFS | s3.ConnectionS3,
+    entries: Iterable[connection.DataEntry],
+    output_path: str,
+    skip_unchanged: bool,
+    destination: staging.StagedDestination | None,
+    output_manifest: manifest.Manifest | None,
+    compressor: compress.Compressor | None,
+) -> connection.WriteStats:
+    """Put the outputs below the output path, the staged generation is aborted on errors."""
+    try:
+        # NOTE: The sink of a stream run includes the time of the pipelines,
+        # their stages are measured on their own as well.
+        with instrument.measure("sink") as record:
+            stats = output_connection.put_contents(
+                rename_outputs(entries, output_path),
+                skip_unchanged=skip_unchanged,
+                staging=destination,
+                manifest=output_manifest,
+                compressor=compressor,
+            )
+            record.items_in = stats.files
+            record.items_out = stats.written
+            record.bytes_written = stats.bytes
+    except BaseException:
+        if destination is not None:
+            destination.abort()
+        raise
+    return stats
+
+
+def create_compressor(compression: tuple[str, int, int], output_path: str) -> compress.Compressor | None:
+    """Return the compressor of the outputs, None if they are not compressed."""
+    from cloudimagedirectory.connection import compress
+
+    compress_encodings, compress_min_size, zstd_dictionary_size = compression
+    if compress_encodings == "none":
+        return None
+    return compress.Compressor(
+        compress_encodings.split(","),
+        compress_min_size,
+        zstd_dictionary_size,
+        output_path + "/zstd.dict",
+    )
+
+
+def rename_outputs(entries: Iterable[connection.DataEntry], output_path: str) -> Iterator[connection.DataEntry]:
+    """Yield the outputs with their path in the destination."""
+    for entry in entries:
+        # NOTE: The raw files are still read by the v2 pipeline of a
+        # stream run, so only the outputs are renamed.
+        if not entry.is_raw():
+            entry.filename = output_path + "/" + entry.filename
+            yield entry
+
 
-    for result in results:
-        result.filename = destination_path + "/" + result.filename
-        if not result.is_raw():
-            origin_connection.put_content(result)
+def stream_pipeline(name: str, pipeline: transform.Pipeline, filenames: list) -> Iterator[connection.DataEntry]:
+    """Yield the outputs of a pipeline, once the previous pipeline is done."""
+    print(f"run pipeline {name}")
+    yield from pipeline.stream(filenames)
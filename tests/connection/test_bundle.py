@@ -0,0 +1,58 @@
+"""Tests for the bundle module."""
+import hashlib
+
+import pytest
+from cloudimagedirectory.connection.bundle import BundleReader, DuplicateBundlePath, InvalidBundle, write_bundle
+from cloudimagedirectory.connection.connection import DataEntry
+
+
+def test_bundle(tmp_path) -> None:
+    """Verify that all files are served from the bundle."""
+    bundle_path = str(tmp_path / "api.bundle")
+    entries = [
+        DataEntry("v2/os/rhel/image/b", {"name": "b"}),
+        DataEntry("v2/all", [{"name": "a"}, {"name": "b"}]),
+        DataEntry("v2/os/rhel/image/a", {"name": "ä"}),
+    ]
+
+    stats = write_bundle(bundle_path, entries)
+    assert stats.files == 3
+
+    with BundleReader(bundle_path) as reader:
+        assert reader.paths == ["v2/all", "v2/os/rhel/image/a", "v2/os/rhel/image/b"]
+        assert len(reader) == 3
+        assert "v2/all" in reader
+        assert "v2/none" not in reader
+        assert bytes(reader.get("v2/os/rhel/image/a")) == '{"name":"ä"}\n'.encode()
+        data = reader.get("v2/all")
+        assert hashlib.sha256(data).hexdigest() == reader.entry("v2/all").sha256
+        data.release()
+        with pytest.raises(KeyError):
+            reader.get("v2/none")
+
+
+def test_bundle_deterministic(tmp_path) -> None:
+    """Verify that the order of the entries does not change the bundle."""
+    entries = [DataEntry(f"v2/{x}", {"name": x}) for x in ["c", "a", "b"]]
+    write_bundle(str(tmp_path / "first"), entries)
+    write_bundle(str(tmp_path / "second"), reversed(entries))
+
+    assert (tmp_path / "first").read_bytes() == (tmp_path / "second").read_bytes()
+
+
+def test_bundle_duplicate_path(tmp_path) -> None:
+    """Verify that a path added twice is rejected."""
+    entries = [DataEntry("v2/a", {"name": "a"}), DataEntry("v2/a", {"name": "b"})]
+
+    with pytest.raises(DuplicateBundlePath):
+        write_bundle(str(tmp_path / "api.bundle"), entries)
+
+
+def test_invalid_bundle(tmp_path) -> None:
+    """Verify that other files are rejected."""
+    (tmp_path / "empty").write_bytes(b"")
+    (tmp_path / "json").write_bytes(b'{"name": "not a bundle"}\n' * 4)
+
+    for name in ["empty", "json"]:
+        with pytest.raises(InvalidBundle):
+            BundleReader(str(tmp_path / name))
@@ -0,0 +1,74 @@
+"""Tests for the codec module."""
+import json
+import os
+import pickle
+
+import pytest
+from cloudimagedirectory.connection import codec
+
+
+def expected_documents() -> list:
+    """Return the decoded documents of all expected test files."""
+    documents = []
+    for root, _, filenames in os.walk("tests/transformer/testdata/expected"):
+        for filename in sorted(filenames):
+            path = os.path.join(root, filename)
+            if os.path.getsize(path) != 0:
+                with open(path) as f:
+                    documents.append(json.load(f))
+    return documents
+
+
+@pytest.mark.parametrize("name", codec.available_codecs())
+def test_identical_output(name) -> None:
+    """Verify that every installed codec produces the same bytes."""
+    reference = codec.CodecJSON()
+    current = codec.get_codec(name)
+
+    documents = [*expected_documents(), {"name": "RHEL 9 ÄÖÜ", "count": 12, "tags": [None, True, 'a"b']}]
+    for document in documents:
+        assert current.dumps(document) == reference.dumps(document)
+        assert current.loads(current.dumps(document)) == document
+
+
+def test_compact() -> None:
+    """Verify that documents are encoded without whitespace."""
+    assert codec.get_codec().dumps({"a": [1, 2]}) == b'{"a":[1,2]}'
+
+
+def test_default_codec() -> None:
+    """Verify that the fastest installed codec is the default."""
+    assert codec.get_codec().name == codec.available_codecs()[0]
+
+
+def test_unknown_codec() -> None:
+    """Verify that an exception is raised for unknown codecs."""
+    with pytest.raises(codec.UnknownCodec):
+        codec.get_codec("foo")
+
+
+@pytest.mark.parametrize("name", codec.available_codecs())
+def test_large_integers(name) -> None:
+    """Verify that integers beyond 64 bits are encoded like the json module does."""
+    current = codec.get_codec(name)
+    for value in [2**63 - 1, 2**64 - 1, 2**64, -(2**63) - 1, 10**30]:
+        assert current.dumps({"size": value}) == codec.CodecJSON().dumps({"size": value})
+
+
+@pytest.mark.parametrize("name", codec.available_codecs())
+def test_floats(name) -> None:
+    """Verify that floats decode to the same value, even if they are spelled differently."""
+    current = codec.get_codec(name)
+    for value in [0.1, 123.456, 1e15, 1e16, 1.5e300, 1e-05, -2.5e-7]:
+        assert json.loads(current.dumps(value)) == value
+        assert current.loads(current.dumps(value)) == value
+        assert current.loads(codec.CodecJSON().dumps(value)) == value
+
+
+@pytest.mark.parametrize("name", codec.available_codecs())
+def test_pickle(name) -> None:
+    """Verify that codecs survive the trip to a worker process."""
+    current = pickle.loads(pickle.dumps(codec.get_codec(name)))  # noqa: S301
+
+    assert current.name == name
+    assert current.loads(current.dumps({"a": [1, 2]})) == {"a": [1, 2]}
@@ -0,0 +1,79 @@
+"""Tests for the compress module."""
+import gzip
+
+import pytest
+from cloudimagedirectory.connection.compress import Compressor, UnknownEncoding, available_encodings
+from cloudimagedirectory.connection.connection import ConnectionFS, DataEntry
+
+
+def test_sidecars(tmpdir) -> None:
+    """Verify that only large outputs get deterministic gzip sidecars."""
+    connection = ConnectionFS(tmpdir, [])
+    entries = [
+        DataEntry(f"{tmpdir}/v2/all", [{"name": f"image {i}"} for i in range(100)]),
+        DataEntry(f"{tmpdir}/v2/os/list", [{"name": "rhel"}]),
+    ]
+    stats = connection.put_contents(entries, compressor=Compressor(["gzip"], min_size=100))
+
+    assert stats.files == 3
+    assert f"{tmpdir}/v2/all.gz" in stats.paths
+    assert not tmpdir.join("v2", "os", "list.gz").exists()
+    assert gzip.decompress(tmpdir.join("v2", "all.gz").read_binary()) == tmpdir.join("v2", "all").read_binary()
+
+    stats = connection.put_contents(entries, skip_unchanged=True, compressor=Compressor(["gzip"], min_size=100))
+    assert stats.skipped == 3
+
+
+def test_sidecars_workers(tmpdir) -> None:
+    """Verify that serial and parallel writes produce the same sidecars."""
+    entries = [DataEntry(f"v2/{i}/all", [{"name": f"image {j}"} for j in range(100)]) for i in range(10)]
+    for name, workers in [("serial", 1), ("parallel", 2)]:
+        connection = ConnectionFS(tmpdir, [], workers=workers)
+        stats = connection.put_contents(
+            [DataEntry(f"{tmpdir}/{name}/{x.filename}", x.content) for x in entries],
+            batch_size=2,
+            compressor=Compressor(["gzip"], min_size=100),
+        )
+        assert stats.files == 20
+
+    for entry in entries:
+        expected = tmpdir.join("serial", f"{entry.filename}.gz").read_binary()
+        assert tmpdir.join("parallel", f"{entry.filename}.gz").read_binary() == expected
+
+
+def test_zstd_dictionary(tmpdir) -> None:
+    """Verify that small per-image documents are compressed with a trained dictionary."""
+    zstandard = pytest.importorskip("zstandard")
+
+    connection = ConnectionFS(tmpdir, [])
+    entries = [DataEntry(f"{tmpdir}/v2/os/list", [{"name": "rhel"}])]
+    entries += [
+        DataEntry(
+            f"{tmpdir}/v2/image/{i:040x}",
+            {
+                "name": f"RHEL {i % 10} HVM x86_64 Hourly2",
+                "imageId": f"ami-{i:016x}",
+                "date": f"2023-01-{i % 28 + 1:02}",
+            },
+        )
+        for i in range(500)
+    ]
+    compressor = Compressor(["zstd"], min_size=4096, dictionary_size=2048, dictionary_path=f"{tmpdir}/zstd.dict")
+    connection.put_contents(entries, compressor=compressor)
+
+    dictionary = zstandard.ZstdCompressionDict(tmpdir.join("zstd.dict").read_binary())
+    decompressor = zstandard.ZstdDecompressor(dict_data=dictionary)
+    name = f"{7:040x}"
+    compressed = tmpdir.join("v2", "image", f"{name}.dzst").read_binary()
+    assert decompressor.decompress(compressed) == tmpdir.join("v2", "image", name).read_binary()
+    assert not tmpdir.join("v2", "image", f"{name}.zst").exists()
+    # NOTE: Only the per-image documents get a dictionary sidecar.
+    assert not tmpdir.join("v2", "os", "list.dzst").exists()
+
+
+def test_available_encodings() -> None:
+    """Verify that gzip is always available and unknown encodings are rejected."""
+    assert "gzip" in available_encodings()
+
+    with pytest.raises(UnknownEncoding):
+        Compressor(["foo"])
@@ -1,8 +1,18 @@
 """Tests for the connection module."""
+import io
+import json
 import os
+import pickle
 
 import pytest
-from cloudimagedirectory.connection.connection import ConnectionFS, DataEntry, OriginPathDoesNotExist
+from cloudimagedirectory.connection.connection import (
+    ConnectionFS,
+    DataEntry,
+    OriginPathDoesNotExist,
+    RawContentStore,
+    iter_json_array,
+    replace_atomically,
+)
 
 
 class TestDataEntry:
@@ -46,6 +56,40 @@ class TestDataEntry:
         temp = DataEntry(f"v2/////////{'a'*40}/", None)
         assert not temp.is_API("v2")
 
+    def test_path_fields(self):
+        """Verify that the path is parsed into its components."""
+        temp = DataEntry(f"v2/os/rhel/provider/aws/version/8.6.0/region/eu-west-3/image/{'a'*40}", {})
+        assert temp.is_API("v2")
+        assert (temp.api, temp.os, temp.provider, temp.version, temp.region, temp.image_id) == (
+            "v2",
+            "rhel",
+            "aws",
+            "8.6.0",
+            "eu-west-3",
+            "a" * 40,
+        )
+
+        temp = DataEntry("v2/os/rhel/provider/aws/version/list", {})
+        assert (temp.provider, temp.version, temp.image_id) == ("aws", "list", "")
+
+        # NOTE: Only the last component of the path is an image id.
+        temp = DataEntry(f"v2/os/rhel/provider/aws/version/9/region/global/image/{'a'*40}/{'b'*40}", {})
+        assert (temp.region, temp.image_id) == ("global", "")
+
+        temp = DataEntry("v1/azure/global/rhel_9", {})
+        assert (temp.api, temp.provider, temp.region) == ("v1", "azure", "global")
+
+    def test_filename_setter(self):
+        """Verify that a new filename is parsed again."""
+        temp = DataEntry("v1/aws/eu-west-1/rhel_9", {"name": "rhel"})
+        temp.filename = "/output/" + temp.filename
+
+        assert temp.filename == "/output/v1/aws/eu-west-1/rhel_9"
+        assert not temp.is_API("v1")
+        assert temp.is_provided_by("aws")
+        assert temp == DataEntry("/output/v1/aws/eu-west-1/rhel_9", {"name": "rhel"})
+        assert not hasattr(temp, "__dict__")
+
 
 class TestConnectionFS:
     """Tests for the connection module."""
@@ -86,6 +130,58 @@ class TestConnectionFS:
         with pytest.raises(OriginPathDoesNotExist):
             result.get_filenames()
 
+    def test_get_filenames_providers(self, tmpdir) -> None:
+        """Verify that only the subtrees of the providers are listed."""
+        origin_path = tmpdir.mkdir("origin")
+        for provider in ["aws", "azure", "google"]:
+            origin_path.mkdir(provider).join("region.json").write("[]")
+        origin_path.join("aws", "notes.txt").write("")
+        os.symlink(origin_path.join("aws", "region.json"), origin_path.join("google", "link.json"))
+
+        result = ConnectionFS(origin_path, [], providers=["aws", "google", "missing"])
+        filenames = [x.filename for x in result.get_filenames()]
+
+        assert filenames == [
+            f"{origin_path}/aws/region.json",
+            f"{origin_path}/google/link.json",
+            f"{origin_path}/google/region.json",
+        ]
+        assert result.get_size(result.get_filenames()[0]) == 2
+        assert result.fingerprint(filenames[1], False) == {
+            "size": 2,
+            "mtime_ns": os.stat(filenames[0]).st_mtime_ns,
+        }
+
+        result = ConnectionFS(origin_path, [], providers=["google"], resolve=True)
+        filenames = [x.filename for x in result.get_filenames()]
+        expected = [f"{origin_path}/aws/region.json", f"{origin_path}/google/region.json"]
+        assert filenames == [os.path.realpath(x) for x in expected]
+
+    def test_pickle(self, tmpdir) -> None:
+        """Verify that worker processes get the connection without the listed stat results."""
+        origin_path = tmpdir.mkdir("origin")
+        origin_path.join("region.json").write("[]")
+        result = ConnectionFS(origin_path, [])
+        entries = result.get_filenames()
+
+        copy = pickle.loads(pickle.dumps(result))  # noqa: S301
+
+        assert copy.origin_path == origin_path
+        assert copy.get_content(entries[0]).content == []
+        assert result.get_size(entries[0]) == 2
+        assert copy._stats == {}
+
+    def test_get_filenames_directory_symlink(self, tmpdir) -> None:
+        """Verify that symlinks to directories are not followed."""
+        origin_path = tmpdir.mkdir("origin")
+        origin_path.mkdir("aws").join("region.json").write("[]")
+        os.symlink(origin_path, origin_path.join("aws", "loop"))
+
+        result = ConnectionFS(origin_path, [])
+        filenames = [x.filename for x in result.get_filenames()]
+
+        assert filenames == [f"{origin_path}/aws/region.json"]
+
     def test_get_content(self, tmpdir) -> None:
         """Verify an empty dict is returned when the file is empty."""
         origin_path = tmpdir.mkdir("origin")
@@ -96,3 +192,224 @@ class TestConnectionFS:
         content = result.get_content(filenames[0])
 
         assert content.content == {}
+
+    def test_iter_content_stream(self, tmpdir) -> None:
+        """Verify that records are streamed from the raw file."""
+        origin_path = tmpdir.mkdir("origin")
+        origin_path.join("file1.json").write('[{"foo": "bar"}, {"foo": "baz"}]')
+
+        result = ConnectionFS(origin_path, [origin_path.join("file1.json")], stream=True)
+        content = result.iter_content(result.get_filenames()[0])
+
+        assert not isinstance(content, list)
+        assert list(content) == [{"foo": "bar"}, {"foo": "baz"}]
+
+    def test_map_raw_order(self, tmpdir) -> None:
+        """Verify that parallel results follow the order of the raw files."""
+        origin_path = tmpdir.mkdir("origin")
+        files = []
+        for i in range(8):
+            origin_path.join(f"file{i}.json").write("[" + ",".join(["{}"] * i) + "]")
+            files.append(origin_path.join(f"file{i}.json"))
+
+        result = ConnectionFS(origin_path, files, workers=4)
+        entries = result.get_filenames()
+        sizes = result.map_raw(lambda x: len(list(result.iter_content(x))), entries)
+
+        assert sizes == list(range(8))
+
+    def test_put_contents(self, tmpdir) -> None:
+        """Verify that a batch of files is written like single files."""
+        entries = [DataEntry(f"v2/os/rhel/{i % 3}/image/{i}", {"name": f"image {i}", "count": i}) for i in range(20)]
+
+        serial = ConnectionFS(tmpdir, [])
+        parallel = ConnectionFS(tmpdir, [], workers=2)
+        for connection, name in [(serial, "serial"), (parallel, "parallel")]:
+            stats = connection.put_contents(
+                [DataEntry(f"{tmpdir}/{name}/{x.filename}", x.content) for x in entries], batch_size=3
+            )
+            assert stats.files == 20
+
+        for entry in entries:
+            single = DataEntry(f"{tmpdir}/single/{entry.filename}", entry.content)
+            serial.put_content(single)
+            expected = tmpdir.join("single", entry.filename).read_binary()
+            assert tmpdir.join("serial", entry.filename).read_binary() == expected
+            assert tmpdir.join("parallel", entry.filename).read_binary() == expected
+
+    def test_put_contents_directories(self, tmpdir, mocker) -> None:
+        """Verify that the directory tree of a list of files is created once, before any file is written."""
+        entries = [DataEntry(f"{tmpdir}/v2/{i % 3}/image-{i}", {"name": f"image {i}"}) for i in range(9)]
+        directories = [f"{tmpdir}/v2/{i}" for i in range(3)]
+        makedirs = mocker.spy(os, "makedirs")
+
+        def write_bytes(data: bytes) -> None:
+            assert all(os.path.isdir(x) for x in directories)
+
+        mocker.patch("pathlib.Path.write_bytes", side_effect=write_bytes)
+        ConnectionFS(tmpdir, []).put_contents(entries, batch_size=2)
+
+        created = [x.args[0] for x in makedirs.call_args_list]
+        assert all(created.count(x) == 1 for x in directories)
+
+    def test_put_contents_stream(self, tmpdir) -> None:
+        """Verify that a stream of files is consumed one batch at a time."""
+
+        def entries():
+            for i in range(20):
+                # NOTE: Only the first two batches are read ahead.
+                if i >= 6:
+                    assert tmpdir.join("v2", f"image-{i - 3}").exists()
+                yield DataEntry(f"{tmpdir}/v2/image-{i}", {"name": f"image {i}"})
+
+        stats = ConnectionFS(tmpdir, []).put_contents(entries(), batch_size=3)
+
+        assert stats.files == 20
+        assert tmpdir.join("v2", "image-19").read() == '{"name":"image 19"}\n'
+
+    def test_put_contents_skip_unchanged(self, tmpdir) -> None:
+        """Verify that files with unchanged content are not written again."""
+        connection = ConnectionFS(tmpdir, [])
+        entries = [DataEntry(f"{tmpdir}/v1/image-{i}", {"name": f"image {i}"}) for i in range(3)]
+        connection.put_contents(entries)
+        os.utime(f"{tmpdir}/v1/image-0", ns=(0, 0))
+
+        entries[2].content = {"name": "changed"}
+        stats = connection.put_contents(entries, skip_unchanged=True)
+
+        assert stats.skipped == 2
+        assert stats.written == 1
+        assert os.stat(f"{tmpdir}/v1/image-0").st_mtime_ns == 0
+        assert tmpdir.join("v1", "image-2").read() == '{"name":"changed"}\n'
+
+    def test_delete_removed(self, tmpdir) -> None:
+        """Verify that stale files and empty directories are deleted."""
+        tmpdir.mkdir("v1").join("keep").write("{}")
+        tmpdir.mkdir("v2").mkdir("old").join("stale").write("{}")
+        tmpdir.join(".state").write("{}")
+
+        connection = ConnectionFS(tmpdir, [])
+        deleted = connection.delete_removed(str(tmpdir), [f"{tmpdir}/v1/keep"])
+
+        assert deleted == 1
+        assert tmpdir.join("v1", "keep").exists()
+        assert tmpdir.join(".state").exists()
+        assert not tmpdir.join("v2").exists()
+
+
+class TestIterJsonArray:
+    """Tests for the incremental JSON array decoder."""
+
+    def test_small_chunks(self) -> None:
+        """Verify that items spanning several chunks are decoded."""
+        data = [{"name": "rhel-9", "tags": [1, 2, {"a": "]"}]}, 12345, "x,y", None, [], {}]
+        stream = io.StringIO(json.dumps(data, indent=2))
+
+        assert list(iter_json_array(stream, chunk_size=3)) == data
+
+    def test_empty(self) -> None:
+        """Verify that empty input and empty arrays yield nothing."""
+        assert list(iter_json_array(io.StringIO(""))) == []
+        assert list(iter_json_array(io.StringIO(" [ ] "))) == []
+
+    def test_invalid(self) -> None:
+        """Verify that anything but a JSON array is rejected."""
+        with pytest.raises(ValueError):
+            list(iter_json_array(io.StringIO('{"foo": "bar"}')))
+
+        with pytest.raises(ValueError):
+            list(iter_json_array(io.StringIO('[{"foo": "bar"}')))
+
+        with pytest.raises(ValueError):
+            list(iter_json_array(io.StringIO("[1 2]")))
+
+
+class TestRawContentStore:
+    """Tests for the RawContentStore class."""
+
+    def test_decode_once(self, tmpdir) -> None:
+        """Verify that every consumer shares the same decoded content."""
+        origin_path = tmpdir.mkdir("origin")
+        origin_path.join("file1.json").write('[{"foo": "bar"}]')
+
+        store = RawContentStore(consumers=2)
+        connection = ConnectionFS(origin_path, [origin_path.join("file1.json")], store)
+        entry = connection.get_filenames()[0]
+
+        first = connection.get_content(entry)
+        second = connection.get_content(entry)
+
+        assert first.content is second.content
+        assert first.content[0]["foo"] == "bar"
+        assert store.hits == 1
+        assert store.misses == 1
+        # NOTE: The last consumer releases the content.
+        assert store.size == 0
+
+    def test_read_only(self, tmpdir) -> None:
+        """Verify that shared content can't be modified."""
+        origin_path = tmpdir.mkdir("origin")
+        origin_path.join("file1.json").write('[{"foo": "bar"}]')
+
+        connection = ConnectionFS(origin_path, [origin_path.join("file1.json")], RawContentStore())
+        content = connection.get_content(connection.get_filenames()[0]).content
+
+        with pytest.raises(TypeError):
+            content[0]["foo"] = "baz"
+
+    def test_budget(self, tmpdir) -> None:
+        """Verify that files are evicted once the byte budget is exceeded."""
+        origin_path = tmpdir.mkdir("origin")
+        origin_path.join("file1.json").write('[{"foo": "bar"}]')
+        origin_path.join("file2.json").write('[{"foo": "baz"}]')
+
+        # NOTE: Each file is estimated at 4 * 16 bytes once decoded.
+        store = RawContentStore(consumers=2, budget=100)
+        files = [origin_path.join("file1.json"), origin_path.join("file2.json")]
+        connection = ConnectionFS(origin_path, files, store)
+        entries = connection.get_filenames()
+
+        connection.get_content(entries[0])
+        connection.get_content(entries[1])
+        connection.get_content(entries[0])
+
+        assert store.evictions == 2
+        assert store.misses == 3
+        assert store.size <= store.budget
+
+    def test_release(self, tmpdir) -> None:
+        """Verify that a consumer that does not read a file releases it."""
+        origin_path = tmpdir.mkdir("origin")
+        origin_path.join("file1.json").write('[{"foo": "bar"}]')
+        origin_path.join("file2.json").write('[{"foo": "baz"}]')
+
+        store = RawContentStore(consumers=2)
+        files = [origin_path.join("file1.json"), origin_path.join("file2.json")]
+        connection = ConnectionFS(origin_path, files, store)
+        entries = connection.get_filenames()
+
+        # NOTE: Released after it was read, and before it was read.
+        connection.get_content(entries[0])
+        connection.release_content(entries[0])
+        connection.release_content(entries[1])
+        connection.get_content(entries[1])
+
+        assert store.size == 0
+        assert store.misses == 2
+
+
+def test_replace_atomically(tmpdir) -> None:
+    """Verify that a file is only replaced once the temporary file is written."""
+    path = str(tmpdir.join("out", "file"))
+    with replace_atomically(path) as tmp:
+        with open(tmp, "w") as f:
+            f.write("first")
+        assert not os.path.exists(path)
+
+    with pytest.raises(RuntimeError), replace_atomically(path) as tmp:
+        with open(tmp, "w") as f:
+            f.write("partial")
+        raise RuntimeError()
+
+    assert tmpdir.join("out", "file").read() == "first"
+    assert os.listdir(tmpdir.join("out")) == ["file"]
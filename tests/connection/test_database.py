@@ -0,0 +1,41 @@
+"""Tests for the database module."""
+import json
+import sqlite3
+
+from cloudimagedirectory.connection.connection import DataEntry
+from cloudimagedirectory.connection.database import write_database
+
+IMAGE = "v2/os/rhel/provider/aws/version/9.2.0/region/{}/image/{}"
+
+
+def test_write_database(tmp_path) -> None:
+    """Verify that images, indexes and counts are exported."""
+    database_path = str(tmp_path / "images.db")
+    entries = [
+        DataEntry(IMAGE.format("eu-west-1", "a" * 40), {"name": "old", "arch": "arm64", "date": "2023-01-01"}),
+        DataEntry(IMAGE.format("eu-west-1", "b" * 40), {"name": "new", "arch": "arm64", "date": "2023-06-01"}),
+        DataEntry(IMAGE.format("us-east-1", "c" * 40), {"name": "x86", "arch": "x86_64", "date": "2023-06-01"}),
+        DataEntry("v2/os/list", [{"name": "rhel", "count": 3}]),
+        DataEntry("v2/os/rhel/provider/list", {"aws": 3}),
+        DataEntry("v2/all", []),
+        DataEntry("v1/aws/eu-west-1/old", {"name": "old"}),
+    ]
+
+    stats = write_database(database_path, entries)
+    assert stats.files == 5
+
+    db = sqlite3.connect(database_path)
+    rows = db.execute(
+        "SELECT region, name, MAX(date) FROM images WHERE provider = 'aws' AND arch = 'arm64' GROUP BY region"
+    ).fetchall()
+    assert rows == [("eu-west-1", "new", "2023-06-01")]
+
+    record = db.execute("SELECT record FROM images WHERE name = 'x86'").fetchone()[0]
+    assert json.loads(record)["region"] == "us-east-1"
+
+    counts = db.execute("SELECT path, name, count FROM counts ORDER BY path").fetchall()
+    assert counts == [("v2/os/list", "rhel", 3), ("v2/os/rhel/provider/list", "aws", 3)]
+
+    indexes = {x[0] for x in db.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert {"images_provider", "images_version", "images_region", "images_arch", "images_date"} <= indexes
+    db.close()
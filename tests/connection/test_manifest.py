@@ -0,0 +1,40 @@
+"""Tests for the manifest module."""
+import hashlib
+import json
+
+from cloudimagedirectory.connection.connection import ConnectionFS, DataEntry
+from cloudimagedirectory.connection.manifest import Manifest
+
+
+def test_manifest(tmpdir) -> None:
+    """Verify that the manifest lists hashes and the changes to the previous run."""
+    manifest_path = str(tmpdir.join("manifest.json"))
+    connection = ConnectionFS(tmpdir, [])
+
+    first = Manifest.load(str(tmpdir), manifest_path)
+    entries = [DataEntry(f"{tmpdir}/v1/{x}", {"name": x}) for x in ["a", "b", "c"]]
+    connection.put_contents(entries, manifest=first)
+    first.write(manifest_path)
+
+    content = json.loads(tmpdir.join("manifest.json").read())
+    data = tmpdir.join("v1", "a").read_binary()
+    assert content["files"]["v1/a"] == {
+        "md5": hashlib.md5(data).hexdigest(),  # noqa: S324
+        "sha256": hashlib.sha256(data).hexdigest(),
+        "size": len(data),
+        "previous_sha256": None,
+    }
+    assert content["added"] == ["v1/a", "v1/b", "v1/c"]
+
+    second = Manifest.load(str(tmpdir), manifest_path)
+    entries = [DataEntry(f"{tmpdir}/v1/a", {"name": "a"}), DataEntry(f"{tmpdir}/v1/b", {"name": "changed"})]
+    entries.append(DataEntry(f"{tmpdir}/v1/d", {"name": "d"}))
+    stats = connection.put_contents(entries, skip_unchanged=True, manifest=second)
+    second.write(manifest_path)
+
+    assert stats.skipped == 1
+    content = json.loads(tmpdir.join("manifest.json").read())
+    assert content["files"]["v1/a"]["previous_sha256"] == content["files"]["v1/a"]["sha256"]
+    assert content["added"] == ["v1/d"]
+    assert content["changed"] == ["v1/b"]
+    assert content["removed"] == ["v1/c"]
@@ -0,0 +1,172 @@
+"""Tests for the S3 connection."""
+import filecmp
+import os
+import socket
+import urllib.request
+
+import pytest
+from cloudimagedirectory import transformer
+from cloudimagedirectory.connection.connection import DataEntry
+from cloudimagedirectory.connection.staging import StagedDestination
+
+moto_server = pytest.importorskip("moto.server")
+s3 = pytest.importorskip("cloudimagedirectory.connection.s3")
+
+INPUT_PATH = "tests/transformer/testdata/input"
+
+
+@pytest.fixture
+def endpoint_url(monkeypatch):
+    """Fixture for a local S3 server with a bucket of the raw test files."""
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = moto_server.ThreadedMotoServer(ip_address="127.0.0.1", port=port)
+    server.start()
+
+    url = f"http://127.0.0.1:{port}"
+    # NOTE: All moto servers of a process share their state.
+    urllib.request.urlopen(urllib.request.Request(f"{url}/moto-api/reset", method="POST"))  # noqa: S310
+    client = s3.create_client(url)
+    client.create_bucket(Bucket="images")
+    for root, _, files in os.walk(INPUT_PATH):
+        for name in files:
+            filename = os.path.join(root, name)
+            client.upload_file(filename, "images", os.path.relpath(filename, INPUT_PATH))
+    client.put_object(Bucket="images", Key="raw/aws/README.md", Body=b"not an image")
+
+    yield url
+    server.stop()
+
+
+def test_parse_s3_url() -> None:
+    """Verify that S3 URLs are split into bucket and prefix."""
+    assert s3.parse_s3_url("s3://images/raw/") == ("images", "raw/")
+    assert s3.parse_s3_url("s3://images") == ("images", "")
+    with pytest.raises(s3.InvalidS3URL):
+        s3.parse_s3_url("/images/raw")
+
+
+def test_get_filenames(endpoint_url) -> None:
+    """Verify that only the JSON objects below the prefix are listed."""
+    connection = s3.ConnectionS3("s3://images/raw/", [], endpoint_url=endpoint_url)
+
+    filenames = [x.filename for x in connection.get_filenames()]
+
+    assert filenames == ["raw/aws/af-south-1.json", "raw/azure/eastus.json", "raw/google/all.json"]
+    assert connection.get_size(DataEntry("raw/aws/af-south-1.json", None)) == os.path.getsize(
+        f"{INPUT_PATH}/raw/aws/af-south-1.json"
+    )
+    assert connection.fingerprint("raw/aws/af-south-1.json")["hash"].startswith("etag:")
+
+
+def test_get_content(endpoint_url) -> None:
+    """Verify that ranged and streamed downloads match the file content."""
+    entry = DataEntry("raw/google/all.json", None)
+    expected = DataEntry(f"{INPUT_PATH}/raw/google/all.json", None)
+    fs = transformer.connection.ConnectionFS(".", [])
+
+    # NOTE: A small range size splits the object into many ranged GETs.
+    connection = s3.ConnectionS3("s3://images/", [], endpoint_url=endpoint_url, range_size=256)
+    assert connection.get_content(entry).content == fs.get_content(expected).content
+
+    connection = s3.ConnectionS3("s3://images/", [], stream=True, endpoint_url=endpoint_url)
+    assert list(connection.iter_content(entry)) == list(fs.iter_content(expected))
+
+
+def test_transformer_s3(runner, tmp_path, endpoint_url) -> None:
+    """Run the transformer end to end with the raw files in a bucket."""
+    result = runner.invoke(
+        transformer.run,
+        [
+            "-op=s3://images/raw/",
+            f"--s3.endpoint-url={endpoint_url}",
+            f"-dp={tmp_path}",
+            "--filter.until=none",
+            "--input.files=none",
+            "--workers=4",
+        ],
+    )
+
+    assert result.exit_code == 0, f"expected no error, but got code {result.exit_code} and output:\n{result.output}"
+    assert filecmp.cmp("tests/transformer/testdata/expected/v2/all", f"{tmp_path}/v2/all")
+
+
+def test_put_contents(endpoint_url) -> None:
+    """Verify that only changed objects are uploaded, with their Content-Type."""
+    connection = s3.ConnectionS3("s3://images/api/", [], endpoint_url=endpoint_url)
+    entries = [DataEntry(f"s3://images/api/v2/os/{x}", {"name": x}) for x in ["a", "b"]]
+
+    stats = connection.put_contents(entries)
+    assert (stats.written, stats.skipped) == (2, 0)
+
+    body = connection.client.get_object(Bucket="images", Key="api/v2/os/a")
+    assert body["ContentType"] == "application/json"
+    assert body["Body"].read() == b'{"name":"a"}\n'
+
+    entries[1].content = {"name": "changed"}
+    stats = connection.put_contents(entries)
+    assert (stats.written, stats.skipped) == (1, 1)
+    assert s3.content_type("api/v2/all.gz") == "application/gzip"
+
+
+def test_delete_removed(endpoint_url) -> None:
+    """Verify that objects no longer generated are deleted, hidden ones kept."""
+    connection = s3.ConnectionS3("s3://images/api", [], endpoint_url=endpoint_url)
+    connection.put_contents([DataEntry(f"api/{x}", {}) for x in ["v2/a", "v2/b", ".state"]])
+
+    assert connection.delete_removed("s3://images/api", ["s3://images/api/v2/a"]) == 1
+
+    listed = connection.client.list_objects_v2(Bucket="images", Prefix="api/")["Contents"]
+    assert sorted(x["Key"] for x in listed) == ["api/.state", "api/v2/a"]
+
+
+def test_delete_removed_bucket_root(endpoint_url) -> None:
+    """Verify that a destination at the bucket root keeps the unrelated objects."""
+    connection = s3.ConnectionS3("s3://images", [], endpoint_url=endpoint_url)
+    connection.put_contents([DataEntry(x, {}) for x in ["v2/a", "v2/b", "list"]])
+
+    assert connection.delete_removed("s3://images", ["s3://images/v2/a"]) == 1
+
+    listed = connection.client.list_objects_v2(Bucket="images")["Contents"]
+    keys = [x["Key"] for x in listed]
+    assert "v2/b" not in keys
+    assert {"v2/a", "list", "raw/aws/af-south-1.json", "raw/aws/README.md"} <= set(keys)
+
+
+def test_put_contents_staged(endpoint_url, tmp_path) -> None:
+    """Verify that S3 destinations refuse to be staged."""
+    connection = s3.ConnectionS3("s3://images/api/", [], endpoint_url=endpoint_url)
+    staging = StagedDestination(str(tmp_path))
+
+    with pytest.raises(s3.StagingNotSupported):
+        connection.put_contents([], staging=staging)
+
+
+def test_transformer_s3_destination(runner, tmp_path, endpoint_url) -> None:
+    """Run the transformer end to end and upload the outputs to a bucket."""
+    args = [
+        "-op=tests/transformer/testdata/input/raw",
+        "--input.files=none",
+        f"--s3.endpoint-url={endpoint_url}",
+        "-dp=s3://images/api",
+        "--filter.until=none",
+        "--output.delete-removed",
+    ]
+    result = runner.invoke(transformer.run, args)
+    assert result.exit_code == 0, f"expected no error, but got code {result.exit_code} and output:\n{result.output}"
+
+    client = s3.create_client(endpoint_url)
+    body = client.get_object(Bucket="images", Key="api/v2/all")["Body"].read()
+    with open("tests/transformer/testdata/expected/v2/all", "rb") as f:
+        assert body == f.read()
+
+    # NOTE: A second run does not upload anything again.
+    result = runner.invoke(transformer.run, args)
+    assert result.exit_code == 0
+    assert " 0 written" in result.output
+    assert " 0 deleted" in result.output
@@ -0,0 +1,93 @@
+"""Tests for the staging module."""
+import os
+import sys
+
+from cloudimagedirectory.connection import staging
+from cloudimagedirectory.connection.connection import ConnectionFS, DataEntry
+from cloudimagedirectory.connection.staging import StagedDestination
+
+
+def publish(connection, destination_path, contents) -> StagedDestination:
+    """Publish a new generation with the given contents."""
+    destination = StagedDestination(destination_path)
+    entries = [DataEntry(f"{destination.path}/{x}", y) for x, y in contents.items()]
+    connection.put_contents(entries, staging=destination)
+    destination.publish()
+    return destination
+
+
+def test_publish(tmpdir) -> None:
+    """Verify that generations are swapped in and unchanged files linked."""
+    destination_path = str(tmpdir.join("images"))
+    tmpdir.mkdir("images").join("old").write("{}")
+    connection = ConnectionFS(tmpdir, [])
+
+    first = publish(connection, destination_path, {"v1/a": {"name": "a"}, "v1/b": {"name": "b"}})
+
+    # NOTE: The plain directory became the first generation.
+    assert os.path.islink(destination_path)
+    assert os.path.realpath(destination_path) == os.path.realpath(first.path)
+    assert not os.path.exists(f"{destination_path}/old")
+    assert os.path.exists(first.previous)
+
+    second = publish(connection, destination_path, {"v1/a": {"name": "a"}, "v1/b": {"name": "changed"}})
+
+    assert os.path.realpath(destination_path) == os.path.realpath(second.path)
+    assert os.path.samefile(f"{first.path}/v1/a", f"{second.path}/v1/a")
+    assert not os.path.samefile(f"{first.path}/v1/b", f"{second.path}/v1/b")
+    assert tmpdir.join("images", "v1", "b").read() == '{"name":"changed"}\n'
+
+    # NOTE: Only the current and the previous generation are kept.
+    generations = [x for x in os.listdir(tmpdir) if x.startswith(".images.gen-")]
+    assert len(generations) == 2
+
+
+def test_abort(tmpdir) -> None:
+    """Verify that an aborted generation leaves the destination untouched."""
+    destination_path = str(tmpdir.join("images"))
+    connection = ConnectionFS(tmpdir, [])
+    publish(connection, destination_path, {"v1/a": {"name": "a"}})
+
+    destination = StagedDestination(destination_path)
+    connection.put_contents([DataEntry(f"{destination.path}/v1/a", {"name": "b"})], staging=destination)
+    destination.abort()
+
+    assert not os.path.exists(destination.path)
+    assert tmpdir.join("images", "v1", "a").read() == '{"name":"a"}\n'
+
+
+def test_interrupted_conversion(tmpdir) -> None:
+    """Verify that a conversion of a plain directory interrupted before the swap is completed."""
+    destination_path = str(tmpdir.join("images"))
+    tmpdir.mkdir(".images.gen-1").join("old").write("{}")
+    os.symlink(".images.gen-1", tmpdir.join(".images.convert"))
+
+    destination = StagedDestination(destination_path)
+
+    assert os.path.islink(destination_path)
+    assert tmpdir.join("images", "old").read() == "{}"
+    assert not os.path.lexists(tmpdir.join(".images.convert"))
+    assert destination.previous == os.path.realpath(tmpdir.join(".images.gen-1"))
+
+
+def test_publish_batches(tmpdir, mocker) -> None:
+    """Verify that the files are synced once per publish, not while they are written."""
+    destination_path = str(tmpdir.join("images"))
+    connection = ConnectionFS(tmpdir, [])
+    fsync = mocker.spy(os, "fsync")
+    mocker.patch.object(staging, "syncfs", return_value=False)
+
+    destination = StagedDestination(destination_path)
+    connection.put_contents([DataEntry(f"{destination.path}/v1/{x}", {"name": x}) for x in "ab"], staging=destination)
+    assert fsync.call_count == 0
+
+    destination.publish()
+
+    # NOTE: Both files, their directories and the parent of the symlink.
+    assert fsync.call_count == 5
+    assert tmpdir.join("images", "v1", "b").read() == '{"name":"b"}\n'
+
+
+def test_syncfs(tmpdir) -> None:
+    """Verify that syncfs flushes the filesystem where it is available."""
+    assert staging.syncfs(str(tmpdir)) == sys.platform.startswith("linux")
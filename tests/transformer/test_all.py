@@ -29,3 +29,29 @@ def test_all(runner, tmp_path):
         f"{pwd}/tests/transformer/testdata/expected/v2/all",
         f"{tmp_path}/v2/all",
     )
+
+
+def test_all_stream(runner, tmp_path):
+    """Verify that streamed raw files produce the same list of image
+    details."""
+    result = runner.invoke(
+        transformer.run,
+        [
+            "-f",
+            "tests/transformer/testdata/input/raw/google/all.json,tests/transformer/testdata/input/raw/aws/af-south-1.json,tests/transformer/testdata/input/raw/azure/eastus.json",
+            "-op=.",
+            f"-dp={tmp_path}",
+            "--filter.until=none",
+            "--input.stream",
+        ],
+    )
+
+    assert result.exit_code == 0, f"expected no error, but got code {result.exit_code} and output:\n{result.output}"
+
+    # Get current directory
+    pwd = os.getcwd()
+
+    assert filecmp.cmp(
+        f"{pwd}/tests/transformer/testdata/expected/v2/all",
+        f"{tmp_path}/v2/all",
+    )
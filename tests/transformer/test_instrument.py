@@ -0,0 +1,51 @@
+"""Tests for the measurements of pipeline stages."""
+from cloudimagedirectory.connection import connection
+from cloudimagedirectory.transform import instrument, transform
+
+
+def test_measure(mocker) -> None:
+    """Verify that a stage records all histograms with its attributes."""
+    histograms = {
+        x: mocker.patch.object(instrument, x)
+        for x in [
+            "stage_duration_histogram",
+            "stage_items_in_histogram",
+            "stage_items_out_histogram",
+            "stage_bytes_read_histogram",
+            "stage_bytes_written_histogram",
+            "stage_max_rss_histogram",
+        ]
+    }
+
+    with instrument.measure("TransformerAWS", "aws", items_in=3) as record:
+        record.items_out = 5
+        record.bytes_read = 100
+
+    attributes = {"stage": "TransformerAWS", "provider": "aws"}
+    histograms["stage_duration_histogram"].record.assert_called_once_with(record.seconds, attributes)
+    histograms["stage_items_in_histogram"].record.assert_called_once_with(3, attributes)
+    histograms["stage_items_out_histogram"].record.assert_called_once_with(5, attributes)
+    histograms["stage_bytes_read_histogram"].record.assert_called_once_with(100, attributes)
+    histograms["stage_bytes_written_histogram"].record.assert_called_once_with(0, attributes)
+    assert histograms["stage_max_rss_histogram"].record.call_args[0][0] > 0
+
+
+def test_pipeline_stages(mocker) -> None:
+    """Verify that every stage of a pipeline is measured."""
+    record = mocker.patch.object(instrument.StageRecord, "record", autospec=True)
+    src_conn = connection.ConnectionFS(".", [])
+    entries = [connection.DataEntry("tests/transformer/testdata/input/raw/aws/af-south-1.json", None)]
+    pipeline = transform.Pipeline(src_conn, [transform.TransformerAWS], [], [transform.TransformerIdxListImageNames])
+
+    for run in [pipeline.run, lambda x: list(pipeline.stream(x))]:
+        record.reset_mock()
+        run(entries)
+
+        records = {x[0][0].stage: x[0][0] for x in record.call_args_list}
+        assert list(records) == ["TransformerAWS", "filter", "TransformerIdxListImageNames"]
+        assert records["TransformerAWS"].provider == "aws"
+        assert records["TransformerAWS"].items_in == 1
+        assert records["TransformerAWS"].items_out == 1
+        assert records["TransformerAWS"].bytes_read == src_conn.get_size(entries[0])
+        assert records["filter"].items_in == 2
+        assert records["TransformerIdxListImageNames"].items_out == 1
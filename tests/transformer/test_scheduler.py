@@ -0,0 +1,55 @@
+"""Tests for the stage scheduler."""
+import threading
+import time
+
+import pytest
+from cloudimagedirectory.transform.scheduler import StageGraph, UnknownStage
+
+
+def test_run_order() -> None:
+    """Verify that every stage gets the results of its inputs."""
+    graph = StageGraph()
+    graph.add("input", lambda: [1, 2])
+    graph.add("double", lambda x: [y * 2 for y in x], ["input"])
+    graph.add("sum", lambda x, y: sum(x) + sum(y), ["input", "double"])
+
+    assert graph.run() == {"input": [1, 2], "double": [2, 4], "sum": 9}
+
+
+def test_run_concurrent() -> None:
+    """Verify that independent stages run at the same time."""
+    # NOTE: Both stages wait for each other, so they must run concurrently.
+    barrier = threading.Barrier(2, timeout=10)
+
+    def wait(x: int) -> int:
+        barrier.wait()
+        return x
+
+    graph = StageGraph(workers=2)
+    graph.add("input", lambda: 1)
+    graph.add("left", wait, ["input"])
+    graph.add("right", wait, ["input"])
+    graph.add("join", lambda x, y: x + y, ["left", "right"])
+
+    assert graph.run()["join"] == 2
+
+
+def test_critical_path() -> None:
+    """Verify that the slowest chain of stages is reported."""
+    graph = StageGraph(workers=2)
+    graph.add("input", lambda: None)
+    graph.add("fast", lambda x: None, ["input"])
+    graph.add("slow", lambda x: time.sleep(0.05), ["input"])
+    graph.add("join", lambda x, y: None, ["fast", "slow"])
+    graph.run()
+
+    assert [x.name for x in graph.critical_path()] == ["input", "slow", "join"]
+    assert "critical path: input -> slow -> join" in graph.report()
+    assert graph.stages["slow"].seconds >= 0.05
+
+
+def test_unknown_stage() -> None:
+    """Verify that inputs must be added before the stage."""
+    graph = StageGraph()
+    with pytest.raises(UnknownStage):
+        graph.add("join", lambda x: x, ["missing"])
@@ -0,0 +1,14 @@
+"""Tests for the spool of encoded documents."""
+from cloudimagedirectory.connection.codec import get_codec
+from cloudimagedirectory.transform.spool import Spool
+
+
+def test_spool() -> None:
+    """Verify that every document is read back from its location."""
+    documents = [{"name": f"image {i}", "tags": list(range(i))} for i in range(10)]
+
+    with Spool(get_codec()) as spool:
+        locations = [spool.add(x) for x in documents]
+        assert spool.size == sum(x[1] for x in locations)
+        for location, document in reversed(list(zip(locations, documents))):
+            assert spool.get(location) == document
@@ -0,0 +1,56 @@
+"""Tests for the startup time of the transformer."""
+import subprocess
+import sys
+
+# NOTE: Budget of the cumulative import time of the transformer in seconds,
+# generous enough for slow machines, but far below the heavy modules.
+IMPORT_BUDGET = 1.0
+
+# NOTE: Modules that are only imported once they are needed.
+LAZY_MODULES = [
+    "pandas",
+    "numpy",
+    "grpc",
+    "boto3",
+    "botocore",
+    "brotli",
+    "zstandard",
+    "sqlite3",
+    "opentelemetry.sdk",
+    "opentelemetry.exporter",
+]
+
+
+def import_times(*args: str) -> dict[str, float]:
+    """Return the cumulative import time of every module in seconds."""
+    # NOTE: The command runs this interpreter with the arguments of the tests only.
+    command = [sys.executable, "-X", "importtime", *args]
+    result = subprocess.run(command, capture_output=True, text=True, check=True)  # noqa: S603
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        times[name.strip()] = int(cumulative) / 1e6
+    return times
+
+
+def lazy_imports(times: dict[str, float]) -> list[str]:
+    """Return the imported modules that should only be imported when needed."""
+    return [x for x in times if any(x == y or x.startswith(y + ".") for y in LAZY_MODULES)]
+
+
+def test_import_time() -> None:
+    """Verify that importing the transformer stays within the budget, without any heavy module."""
+    times = import_times("-c", "import cloudimagedirectory.transformer")
+
+    assert times["cloudimagedirectory.transformer"] < IMPORT_BUDGET
+    assert lazy_imports(times) == []
+
+
+def test_help() -> None:
+    """Verify that the help does not import any heavy module."""
+    times = import_times("-c", "from cloudimagedirectory import transformer; transformer.run()", "--help")
+
+    assert "cloudimagedirectory.transformer" in times
+    assert lazy_imports(times) == []
@@ -0,0 +1,101 @@
+"""Tests for the incremental transform state."""
+import os
+
+from cloudimagedirectory import transformer
+from cloudimagedirectory.connection.connection import ConnectionFS, DataEntry, RawContentStore
+from cloudimagedirectory.transform.state import TransformState
+from cloudimagedirectory.transform.transform import TransformerAWS
+
+
+def test_transform_state(tmpdir):
+    """Verify that only images of unchanged raw files are reused."""
+    state_path = str(tmpdir.join("state.json"))
+    raw = tmpdir.mkdir("raw")
+    raw.join("a.json").write('[{"name": "a"}]')
+    raw.join("b.json").write('[{"name": "b"}]')
+    raw.join("c.json").write('[{"name": "c"}]')
+
+    state = TransformState()
+    for name in ["a", "b", "c"]:
+        filename = str(raw.join(f"{name}.json"))
+        assert state.get("TransformerAWS", filename) is None
+        state.put("TransformerAWS", filename, [DataEntry(f"v1/aws/{name}", {"name": name})])
+    state.write(state_path)
+
+    # NOTE: b is touched without changing its content, c is changed.
+    os.utime(str(raw.join("b.json")), ns=(0, 0))
+    raw.join("c.json").write('[{"name": "changed"}]')
+
+    state = TransformState.load(state_path)
+    a = state.get("TransformerAWS", str(raw.join("a.json")))
+    b = state.get("TransformerAWS", str(raw.join("b.json")))
+
+    assert a == [DataEntry("v1/aws/a", {"name": "a"})]
+    assert b == [DataEntry("v1/aws/b", {"name": "b"})]
+    assert state.get("TransformerAWS", str(raw.join("c.json"))) is None
+    assert state.get("TransformerGoogle", str(raw.join("a.json"))) is None
+    assert state.hits == 2
+    assert state.misses == 2
+
+
+def test_release_reused(tmpdir):
+    """Verify that a transformer reusing the images releases the raw file of the store."""
+    raw = tmpdir.mkdir("raw")
+    raw.join("a.json").write('[{"name": "a"}]')
+    store = RawContentStore(consumers=2)
+    connection = ConnectionFS(str(raw), [str(raw.join("a.json"))], store)
+    entry = connection.get_filenames()[0]
+
+    runner = TransformerAWS(connection)
+    runner.state = TransformState()
+    runner.state.put("TransformerAWS", entry.filename, [])
+
+    connection.get_content(entry)
+    assert store.size > 0
+
+    assert runner.transform_cached(entry) == []
+    assert store.size == 0
+
+
+def test_incremental_run(runner, tmp_path):
+    """Verify that a second run reuses the images of all raw files."""
+    args = [
+        "-f",
+        "tests/transformer/testdata/input/raw/aws/af-south-1.json,tests/transformer/testdata/input/raw/azure/eastus.json",
+        "-op=.",
+        f"-dp={tmp_path}/images",
+        "--filter.until=none",
+        f"--state.path={tmp_path}/state.json",
+    ]
+    result = runner.invoke(transformer.run, args)
+    assert result.exit_code == 0, f"expected no error, but got code {result.exit_code} and output:\n{result.output}"
+    assert "transform state: 0 hits, 4 misses" in result.output
+    assert (tmp_path / "state.json").exists()
+
+    expected = (tmp_path / "images" / "v2" / "all").read_bytes()
+
+    result = runner.invoke(transformer.run, args)
+    assert result.exit_code == 0, f"expected no error, but got code {result.exit_code} and output:\n{result.output}"
+    assert "transform state: 4 hits, 0 misses" in result.output
+
+    # NOTE: Cached images produce the same files.
+    assert (tmp_path / "images" / "v2" / "all").read_bytes() == expected
+
+    result = runner.invoke(transformer.run, [*args, "--full"])
+    assert result.exit_code == 0, f"expected no error, but got code {result.exit_code} and output:\n{result.output}"
+    assert "transform state: 0 hits, 4 misses" in result.output
+
+
+def test_state_opt_in(runner, tmp_path):
+    """Verify that no state is kept without --state.path."""
+    args = [
+        "-f",
+        "tests/transformer/testdata/input/raw/aws/af-south-1.json",
+        "-op=.",
+        f"-dp={tmp_path}",
+        "--filter.until=none",
+    ]
+    result = runner.invoke(transformer.run, args)
+    assert result.exit_code == 0, f"expected no error, but got code {result.exit_code} and output:\n{result.output}"
+    assert "transform state" not in result.output
+    assert [x for x in os.listdir(tmp_path) if x.startswith(".")] == []
@@ -0,0 +1,50 @@
+"""Tests for the entry store."""
+from cloudimagedirectory.connection import connection
+from cloudimagedirectory.transform import transform
+from cloudimagedirectory.transform.store import EntryStore, classify
+
+V2_IMAGE = "v2/os/rhel/provider/{}/version/9/region/global/image/" + "a" * 40
+
+
+def test_classify() -> None:
+    """Verify the kind, provider and API version of entries."""
+    assert classify(connection.DataEntry("/data/aws/raw/google/all.json", None)) == ("raw", "google", "")
+    assert classify(connection.DataEntry("v1/azure/global/rhel", None)) == ("v1", "azure", "v1")
+    assert classify(connection.DataEntry(V2_IMAGE.format("aws"), None)) == ("v2", "aws", "v2")
+    assert classify(connection.DataEntry("v2/all", None)) == ("idx", "", "v2")
+    assert classify(connection.DataEntry("v1/idx/list/image-names", None)) == ("idx", "", "v1")
+
+
+def test_select() -> None:
+    """Verify that every partition holds its entries in insertion order."""
+    entries = [
+        connection.DataEntry(V2_IMAGE.format("google"), None),
+        connection.DataEntry("raw/aws/eu-west-1.json", None),
+        connection.DataEntry(V2_IMAGE.format("aws"), None),
+        connection.DataEntry("raw/google/all.json", None),
+    ]
+    store = EntryStore(entries)
+
+    assert len(store) == 4
+    assert list(store) == entries
+    assert store.select("raw", "aws") == [entries[1]]
+    assert store.select("raw") == [entries[1], entries[3]]
+    assert store.select("v2", api="v2") == [entries[0], entries[2]]
+    assert store.select("v2", "aws", "v2") == [entries[2]]
+    assert store.select("v1") == []
+
+
+def test_pipeline_does_not_modify_input() -> None:
+    """Verify that a pipeline does not extend the caller's list."""
+    src_conn = connection.ConnectionFS(".", [])
+    data = [connection.DataEntry("tests/transformer/testdata/input/raw/aws/af-south-1.json", None)]
+    pipeline = transform.Pipeline(
+        src_conn, [transform.TransformerAWSV2RHEL, transform.TransformerGoogleV2RHEL], [], [transform.TransformerV2All]
+    )
+
+    results = pipeline.run(data)
+
+    assert len(data) == 1
+    assert results[0] is data[0]
+    assert results[-1].filename == "v2/all"
+    assert len(results[-1].content) == len(results) - 2
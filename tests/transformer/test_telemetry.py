@@ -0,0 +1,68 @@
+"""Tests for the export of metrics."""
+import io
+import json
+import threading
+import time
+from unittest import mock
+
+import pytest
+from cloudimagedirectory import telemetry
+from opentelemetry.sdk.metrics import MeterProvider
+from opentelemetry.sdk.metrics.export import PeriodicExportingMetricReader
+
+
+def test_console_exporter() -> None:
+    """Verify that the console exporter writes the metrics as JSON lines."""
+    output = io.StringIO()
+    exporter = telemetry.create_exporter("console", output)
+    provider = MeterProvider(metric_readers=[PeriodicExportingMetricReader(exporter)])
+    histogram = provider.get_meter("test").create_histogram("pipeline.stage.duration", unit="s")
+    histogram.record(1.5, {"stage": "filter", "provider": ""})
+    provider.shutdown()
+
+    lines = output.getvalue().splitlines()
+    assert len(lines) >= 1
+    metric = json.loads(lines[0])["resource_metrics"][0]["scope_metrics"][0]["metrics"][0]
+    assert metric["name"] == "pipeline.stage.duration"
+    assert metric["data"]["data_points"][0]["attributes"] == {"stage": "filter", "provider": ""}
+    assert metric["data"]["data_points"][0]["sum"] == 1.5
+
+
+def test_exporters() -> None:
+    """Verify that metrics can be disabled and unknown exporters are rejected."""
+    assert telemetry.create_exporter("none") is None
+    assert telemetry.setup_metrics("none") is None
+    with pytest.raises(telemetry.UnknownExporter):
+        telemetry.create_exporter("unknown")
+
+
+def test_default_exporter(monkeypatch, capsys) -> None:
+    """Verify that metrics are only exported if the environment configures them."""
+    for name in ["OTEL_METRICS_EXPORTER", "OTEL_EXPORTER_OTLP_ENDPOINT", "OTEL_EXPORTER_OTLP_METRICS_ENDPOINT"]:
+        monkeypatch.delenv(name, raising=False)
+    assert telemetry.default_exporter() == "none"
+
+    monkeypatch.setenv("OTEL_EXPORTER_OTLP_ENDPOINT", "http://collector:4317")
+    assert telemetry.default_exporter() == "otlp"
+
+    monkeypatch.setenv("OTEL_METRICS_EXPORTER", "console,otlp")
+    assert telemetry.default_exporter() == "console"
+
+    monkeypatch.setenv("OTEL_METRICS_EXPORTER", "prometheus")
+    assert telemetry.default_exporter() == "none"
+    assert "unsupported OTEL_METRICS_EXPORTER prometheus" in capsys.readouterr().err
+
+
+def test_shutdown_timeout() -> None:
+    """Verify that an export that does not finish does not block the shutdown."""
+    blocked = threading.Event()
+    provider = mock.Mock()
+    provider.shutdown.side_effect = lambda timeout_millis: blocked.wait()
+
+    start = time.perf_counter()
+    assert not telemetry.shutdown_metrics(provider, timeout=0.1)
+    assert time.perf_counter() - start < 1
+    blocked.set()
+
+    exporter = telemetry.create_exporter("console", io.StringIO())
+    assert telemetry.shutdown_metrics(MeterProvider(metric_readers=[PeriodicExportingMetricReader(exporter)]))
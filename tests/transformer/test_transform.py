@@ -1,6 +1,11 @@
 """Test basic transformations for the latest images."""
+import filecmp
+import json
+import os
+import sqlite3
+
 from cloudimagedirectory import transformer
-from cloudimagedirectory.connection import connection
+from cloudimagedirectory.connection import bundle, codec, connection
 from cloudimagedirectory.transform import transform
 
 
@@ -110,3 +115,344 @@ def test_transformeridxlistimagelatest(tmpdir):
 
     # verify that only two pages exist
     assert len(results) == 3
+
+
+def test_parallel_workers(runner, tmp_path):
+    """Verify that parallel workers produce the same files as a serial run."""
+    # NOTE: Several raw files of a provider, so they are formatted in parallel.
+    with open("tests/transformer/testdata/input/raw/aws/af-south-1.json") as f:
+        images = json.load(f)
+    os.makedirs(tmp_path / "raw" / "aws")
+    regions = {"af-south-1": "6.10", "eu-west-3": "7.9", "us-east-1": "8.6", "us-west-2": "9.2"}
+    for region, version in regions.items():
+        # NOTE: Images are filtered by unique names, every region gets its own version.
+        content = [dict(image, Name=image["Name"].replace("6.10", version)) for image in images]
+        with open(tmp_path / "raw" / "aws" / f"{region}.json", "w") as f:
+            json.dump(content, f)
+    files = ",".join(
+        [
+            "tests/transformer/testdata/input/raw/google/all.json",
+            *[f"{tmp_path}/raw/aws/{region}.json" for region in regions],
+            "tests/transformer/testdata/input/raw/azure/eastus.json",
+        ]
+    )
+    for name, workers in [("serial", "1"), ("parallel", "4")]:
+        result = runner.invoke(
+            transformer.run,
+            ["-f", files, "-op=.", f"-dp={tmp_path}/{name}", "--filter.until=none", f"--workers={workers}"],
+        )
+        assert result.exit_code == 0, f"expected no error, but got code {result.exit_code} and output:\n{result.output}"
+
+    for root, _, filenames in os.walk(tmp_path / "serial"):
+        for filename in filenames:
+            expected = os.path.join(root, filename)
+            actual = expected.replace(f"{tmp_path}/serial", f"{tmp_path}/parallel")
+            assert filecmp.cmp(expected, actual, shallow=False)
+    for region in regions:
+        assert os.path.isdir(tmp_path / "parallel" / "v1" / "aws" / region)
+
+
+def test_skip_unchanged(runner, tmp_path):
+    """Verify that a second run does not rewrite any file."""
+    args = [
+        "-f",
+        "tests/transformer/testdata/input/raw/aws/af-south-1.json",
+        "-op=.",
+        f"-dp={tmp_path}",
+        "--filter.until=none",
+        "--output.skip-unchanged",
+        "--output.delete-removed",
+    ]
+    result = runner.invoke(transformer.run, args)
+    assert result.exit_code == 0, f"expected no error, but got code {result.exit_code} and output:\n{result.output}"
+    assert " 0 skipped" in result.output
+
+    result = runner.invoke(transformer.run, args)
+    assert result.exit_code == 0, f"expected no error, but got code {result.exit_code} and output:\n{result.output}"
+    assert " 0 written" in result.output
+    assert " 0 deleted" in result.output
+
+
+def test_staged(runner, tmp_path):
+    """Verify that a staged run publishes the expected files."""
+    for _ in range(2):
+        result = runner.invoke(
+            transformer.run,
+            [
+                "-f",
+                "tests/transformer/testdata/input/raw/aws/af-south-1.json",
+                "-op=.",
+                f"-dp={tmp_path}/images",
+                "--filter.until=none",
+                "--output.staged",
+            ],
+        )
+        assert result.exit_code == 0, f"expected no error, but got code {result.exit_code} and output:\n{result.output}"
+
+    assert os.path.islink(f"{tmp_path}/images")
+    assert filecmp.cmp(
+        "tests/transformer/testdata/expected/v1/aws/af-south-1/rhel_6.10_hvm_x86_64_hourly2",
+        f"{tmp_path}/images/v1/aws/af-south-1/rhel_6.10_hvm_x86_64_hourly2",
+        shallow=False,
+    )
+
+
+def test_compress(runner, tmp_path):
+    """Verify that large outputs get gzip sidecars."""
+    result = runner.invoke(
+        transformer.run,
+        [
+            "-f",
+            "tests/transformer/testdata/input/raw/aws/af-south-1.json",
+            "-op=.",
+            f"-dp={tmp_path}",
+            "--filter.until=none",
+            "--output.compress=gzip",
+            "--output.compress-min-size=200",
+        ],
+    )
+    assert result.exit_code == 0, f"expected no error, but got code {result.exit_code} and output:\n{result.output}"
+
+    assert os.path.exists(f"{tmp_path}/v2/all.gz")
+    assert not os.path.exists(f"{tmp_path}/v2/os/list.gz")
+
+
+def test_bundle(runner, tmp_path):
+    """Verify that the bundle serves the same outputs as the file tree."""
+    args = [
+        "-f",
+        "tests/transformer/testdata/input/raw/aws/af-south-1.json",
+        "-op=.",
+        "--filter.until=none",
+    ]
+    result = runner.invoke(transformer.run, [*args, f"-dp={tmp_path}/tree"])
+    assert result.exit_code == 0, f"expected no error, but got code {result.exit_code} and output:\n{result.output}"
+
+    for name in ["first", "second"]:
+        result = runner.invoke(
+            transformer.run, [*args, f"-dp={tmp_path}/{name}", f"--output.bundle={tmp_path}/{name}.bundle"]
+        )
+        assert result.exit_code == 0, f"expected no error, but got code {result.exit_code} and output:\n{result.output}"
+
+    assert filecmp.cmp(f"{tmp_path}/first.bundle", f"{tmp_path}/second.bundle", shallow=False)
+    assert not os.path.exists(f"{tmp_path}/first/v2/all")
+
+    with bundle.BundleReader(f"{tmp_path}/first.bundle") as reader:
+        for path in reader.paths:
+            with open(f"{tmp_path}/tree/{path}", "rb") as f:
+                assert f.read() == reader.get(path)
+
+
+def test_database(runner, tmp_path):
+    """Verify that the database holds the same images as v2/all."""
+    result = runner.invoke(
+        transformer.run,
+        [
+            "-f",
+            "tests/transformer/testdata/input/raw/google/all.json,tests/transformer/testdata/input/raw/aws/af-south-1.json,tests/transformer/testdata/input/raw/azure/eastus.json",
+            "-op=.",
+            f"-dp={tmp_path}",
+            "--filter.until=none",
+            f"--output.database={tmp_path}/images.db",
+        ],
+    )
+    assert result.exit_code == 0, f"expected no error, but got code {result.exit_code} and output:\n{result.output}"
+
+    with open(f"{tmp_path}/v2/all") as f:
+        expected = sorted(json.dumps(x, sort_keys=True) for x in json.load(f))
+    db = sqlite3.connect(f"{tmp_path}/images.db")
+    records = sorted(json.dumps(json.loads(x), sort_keys=True) for x, in db.execute("SELECT record FROM images"))
+    db.close()
+    assert records == expected
+
+
+def test_processes(runner, tmp_path):
+    """Verify that formatting in worker processes produces the same files."""
+    files = (
+        "tests/transformer/testdata/input/raw/google/all.json,"
+        "tests/transformer/testdata/input/raw/aws/af-south-1.json,"
+        "tests/transformer/testdata/input/raw/azure/eastus.json"
+    )
+    for name, options in [("serial", []), ("processes", ["--processes=2"]), ("stream", ["--processes=2", "--stream"])]:
+        result = runner.invoke(
+            transformer.run,
+            ["-f", files, "-op=.", f"-dp={tmp_path}/{name}", "--filter.until=none", *options],
+        )
+        assert result.exit_code == 0, f"expected no error, but got code {result.exit_code} and output:\n{result.output}"
+
+    for root, _, filenames in os.walk(tmp_path / "serial"):
+        for filename in filenames:
+            if filename.startswith("."):
+                continue
+            expected = os.path.join(root, filename)
+            for name in ["processes", "stream"]:
+                actual = expected.replace(f"{tmp_path}/serial", f"{tmp_path}/{name}")
+                assert filecmp.cmp(expected, actual, shallow=False)
+
+
+def test_processes_counter(mocker):
+    """Verify that the images formatted in worker processes are counted here."""
+    src_conn = connection.ConnectionFS(".", [])
+    runner = transform.TransformerAWSV2RHEL(src_conn)
+    runner.counter = mocker.Mock()
+    entries = [connection.DataEntry("tests/transformer/testdata/input/raw/aws/af-south-1.json", None)]
+
+    with transform.create_executor(src_conn, 1) as executor:
+        runner.executor = executor
+        results = runner.run(entries)
+
+    runner.executor = None
+    assert [x.filename for x in results] == [x.filename for x in runner.run(entries)]
+    assert runner.counter.add.call_count == 2
+    runner.counter.add.assert_called_with(len(results), {"provider": "aws"})
+
+
+def test_processes_json_codec():
+    """Verify that the worker processes also start with the standard library codec."""
+    src_conn = connection.ConnectionFS(".", [], codec=codec.get_codec("json"))
+    entries = [connection.DataEntry("tests/transformer/testdata/input/raw/aws/af-south-1.json", None)]
+    generators = [transform.TransformerIdxListImageLatestAll]
+
+    results = transform.Pipeline(src_conn, [transform.TransformerAWS], [], generators, processes=2).run(entries)
+
+    expected = transform.Pipeline(src_conn, [transform.TransformerAWS], [], generators).run(entries)
+    assert [x.filename for x in results] == [x.filename for x in expected]
+    assert [x.content for x in results] == [x.content for x in expected]
+
+
+def test_v2_generators_read_only():
+    """Verify that the v2 index generators never modify the image records."""
+    path = "v2/os/rhel/provider/{}/version/9.2/region/{}/image/{}"
+    entries = [
+        connection.DataEntry(path.format("aws", "eu-west-1", "a" * 40), {"name": "b", "region": "eu-west-1"}),
+        connection.DataEntry(path.format("google", "global", "b" * 40), {"name": "a"}),
+    ]
+    for entry in entries:
+        entry.content = connection.read_only(entry.content)
+
+    generators = [
+        transform.TransformerV2All,
+        transform.TransformerV2ListOS,
+        transform.TransformerV2ListProviderByOS,
+        transform.TransformerV2ListVersionByProvider,
+        transform.TransformerV2ListRegionByVersion,
+        transform.TransformerV2ListImageByRegion,
+    ]
+    results = {x.__name__: x(None).run(entries) for x in generators}
+
+    assert results["TransformerV2All"][0].content == [
+        {"name": "a", "provider": "google", "region": "global"},
+        {"name": "b", "region": "eu-west-1", "provider": "aws"},
+    ]
+    assert dict(entries[1].content) == {"name": "a"}
+
+
+def test_v2_aggregate():
+    """Verify that the aggregate emits every v2 endpoint in a single pass."""
+    path = "v2/os/rhel/provider/{}/version/{}/region/{}/image/{}"
+    entries = [
+        connection.DataEntry(path.format("aws", "9.2", "eu-west-1", "b" * 40), {"name": "b"}),
+        connection.DataEntry(path.format("google", "8.6", "global", "c" * 40), {"name": "c"}),
+        connection.DataEntry(path.format("aws", "9.2", "eu-west-1", "a" * 40), {"name": "a"}),
+        connection.DataEntry("v2/os/list", []),
+    ]
+
+    results = {x.filename: x.content for x in transform.TransformerV2Aggregate(None).run(entries)}
+
+    assert list(results) == [
+        "v2/all",
+        "v2/os/list",
+        "v2/os/rhel/provider/list",
+        "v2/os/rhel/provider/aws/version/list",
+        "v2/os/rhel/provider/google/version/list",
+        "v2/os/rhel/provider/aws/version/9.2/region/list",
+        "v2/os/rhel/provider/google/version/8.6/region/list",
+        "v2/os/rhel/provider/aws/version/9.2/region/eu-west-1/image/list",
+        "v2/os/rhel/provider/google/version/8.6/region/global/image/list",
+    ]
+    assert [x["name"] for x in results["v2/all"]] == ["a", "b", "c"]
+    assert results["v2/os/list"][0]["count"] == 3
+    assert results["v2/os/rhel/provider/list"] == {"aws": 2, "google": 1}
+    assert results["v2/os/rhel/provider/aws/version/9.2/region/eu-west-1/image/list"] == ["a" * 40, "b" * 40]
+
+
+def test_transformeridxlistimagelatest_all():
+    """Verify that sorting once gives the same pages as every provider sorted on its own."""
+    data = [
+        connection.DataEntry(
+            f"v1/{provider}/region-{i}/rhel-{i}",
+            {"date": f"20{10 + i % 7}-0{1 + i % 3}-01T00:00:00", "name": f"test{i}", "arch": "x86_64"},
+        )
+        for i, provider in enumerate(["aws", "azure", "google", "aws", "google", "azure", "aws"] * 3)
+    ]
+    data.append(connection.DataEntry("v1/raw/aws/region-1", {"date": "2030-01-01", "name": "invalid"}))
+
+    expected = []
+    for cls in [
+        transform.TransformerIdxListImageLatest,
+        transform.TransformerIdxListImageLatestGoogle,
+        transform.TransformerIdxListImageLatestAWS,
+        transform.TransformerIdxListImageLatestAZURE,
+    ]:
+        runner = cls(None)
+        runner.chunk_size = 4
+        expected.extend(runner.run(data))
+
+    runner = transform.TransformerIdxListImageLatestAll(None)
+    runner.chunk_size = 4
+    results = runner.run(data)
+
+    assert [x.filename for x in results] == [x.filename for x in expected]
+    assert [x.content for x in results] == [x.content for x in expected]
+
+
+def test_stream(runner, tmp_path):
+    """Verify that a stream run produces the same files as a regular run."""
+    files = (
+        "tests/transformer/testdata/input/raw/google/all.json,"
+        "tests/transformer/testdata/input/raw/aws/af-south-1.json,"
+        "tests/transformer/testdata/input/raw/azure/eastus.json"
+    )
+    for name, args in [("regular", []), ("stream", ["--stream"]), ("stream-workers", ["--stream", "--workers=2"])]:
+        result = runner.invoke(
+            transformer.run, ["-f", files, "-op=.", f"-dp={tmp_path}/{name}", "--filter.until=none", *args]
+        )
+        assert result.exit_code == 0, f"expected no error, but got code {result.exit_code} and output:\n{result.output}"
+
+    for root, _, filenames in os.walk(tmp_path / "regular"):
+        for filename in filenames:
+            if filename.startswith("."):
+                continue
+            expected = os.path.join(root, filename)
+            for name in ["stream", "stream-workers"]:
+                actual = expected.replace(f"{tmp_path}/regular", f"{tmp_path}/{name}")
+                assert filecmp.cmp(expected, actual, shallow=False)
+
+    result = runner.invoke(
+        transformer.run,
+        ["-f", files, "-op=.", f"-dp={tmp_path}", "-fu=none", "--stream", f"--output.bundle={tmp_path}/out.bundle"],
+    )
+    assert result.exit_code == 2
+    assert "--stream can't be combined" in result.output
+
+    result = runner.invoke(
+        transformer.run, ["-f", files, "-op=.", "-dp=s3://images/api", "-fu=none", "--output.staged"]
+    )
+    assert result.exit_code == 2
+    assert "--output.staged can't be combined with an S3 destination" in result.output
+
+
+def test_pipeline_stream():
+    """Verify that a stream yields the outputs of a regular run, with the full images."""
+    src_conn = connection.ConnectionFS(".", [])
+    entries = [connection.DataEntry("tests/transformer/testdata/input/raw/aws/af-south-1.json", None)]
+    generators = [transform.TransformerIdxListImageLatestAll]
+    pipeline = transform.Pipeline(src_conn, [transform.TransformerAWS], [], generators)
+
+    assert pipeline.fields() == ("arch", "date", "name")
+    results = list(pipeline.stream(entries))
+
+    expected = transform.Pipeline(src_conn, [transform.TransformerAWS], [], generators).run(entries)
+    assert [x.filename for x in results] == [x.filename for x in expected]
+    assert [x.content for x in results] == [x.content for x in expected]
+    assert len(results[1].content) > 3